@@ -0,0 +1,34 @@
+"""Benchmark threshold estimation of the binarizer.
+
+Reports wall time and the drift of the ``lo`` / ``hi`` estimates against
+exact full resolution estimation for 300 and 600 DPI pages, at various
+decimation levels, with exact percentiles (sorting) and histogram bins.
+
+    python -m benchmarks.bench_binarize
+"""
+
+from ocrd_anybaseocr.nlbin import estimate_thresholds
+
+from .common import synthetic_page, timed
+
+VARIANTS = [(1, 0), (1, 1024), (2, 0), (4, 0), (4, 1024)]
+
+def main():
+    for dpi in (300, 600):
+        flat = synthetic_page(dpi)
+        times = {}
+        estimates = {}
+        for decimate, bins in VARIANTS:
+            with timed(times, (decimate, bins)):
+                estimates[decimate, bins] = estimate_thresholds(
+                    flat, decimate=decimate, bins=bins, value_range=(0, 1))
+        lo1, hi1 = estimates[VARIANTS[0]]
+        for decimate, bins in VARIANTS:
+            lo, hi = estimates[decimate, bins]
+            elapsed = times[decimate, bins]
+            print("%d DPI decimate=%d histbins=%4d: %6.2fs (speedup %4.1fx) lo=%.4f (%+.4f) hi=%.4f (%+.4f)" % (
+                dpi, decimate, bins, elapsed, times[VARIANTS[0]] / elapsed,
+                lo, lo - lo1, hi, hi - hi1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark page throughput of the block segmentation model by batch size.
+
+Runs Mask R-CNN inference (``MaskRCNN.detect``, without post-processing)
+on synthetic pages with batch sizes 1, 2, 4 and 8, each in a fresh
+process (so every graph is built from scratch), and reports pages per
+second after a warm-up batch. Uses the given weights file if any, or
+else random weights (which does not change the amount of computation,
+but the number of detections, so prefer real weights for end-to-end
+numbers). Needs TensorFlow.
+
+    python -m benchmarks.bench_block_batch [WEIGHTS] [PAGES]
+"""
+
+import multiprocessing as mp
+import sys
+import time
+
+import numpy as np
+
+from .common import synthetic_page
+
+BATCH_SIZES = [1, 2, 4, 8]
+
+PAGES = 16
+
+def _throughput(batch_size, weights, pages, queue):
+    # pylint: disable=import-outside-toplevel
+    from ocrd_anybaseocr.mrcnn import model
+    from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import InferenceConfig
+    config = InferenceConfig(0.9, batch_size)
+    mrcnn_model = model.MaskRCNN(mode="inference", model_dir="/tmp", config=config)
+    if weights:
+        mrcnn_model.load_weights(weights, by_name=True)
+    page = np.stack((255 * (1 - synthetic_page(gray=False)),) * 3, axis=-1).astype(np.uint8)
+    images = [page] * batch_size
+    # warm-up (graph finalization, memory allocation)
+    mrcnn_model.detect(images)
+    batches = (pages + batch_size - 1) // batch_size
+    start = time.perf_counter()
+    for _ in range(batches):
+        mrcnn_model.detect(images)
+    queue.put(batches * batch_size / (time.perf_counter() - start))
+
+def throughput(batch_size, weights=None, pages=PAGES):
+    """Pages per second for ``batch_size``, measured in a fresh process."""
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_throughput, args=(batch_size, weights, pages, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode:
+        raise RuntimeError("inference with batch size %d failed" % batch_size)
+    return queue.get()
+
+def main():
+    weights = sys.argv[1] if len(sys.argv) > 1 else None
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else PAGES
+    try:
+        import tensorflow # pylint: disable=import-outside-toplevel, unused-import
+    except ImportError:
+        print("skipped (TensorFlow not installed)")
+        return
+    reference = None
+    for batch_size in BATCH_SIZES:
+        pages_per_second = throughput(batch_size, weights, pages)
+        reference = reference or pages_per_second
+        print("batch size %d: %6.2f pages/s (speedup %4.2fx)" % (
+            batch_size, pages_per_second, pages_per_second / reference))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Report accuracy vs. latency of the exported block segmentation models.
+
+Exports the Keras model from the given weights file as frozen graph
+(plain and CPU-optimized, and with ``--experimental`` also optimized
+with float16 or int8 weights), then runs each variant (and the Keras model itself) on the given page
+images, each in a fresh process. Reports seconds per page (after a
+warm-up page), and the agreement of the detections with those of the
+Keras model: the share of detections matched by one of the same class
+with IoU >= 0.5 (F1 of precision and recall), and the mean IoU of the
+matched bounding boxes. Without images, uses a synthetic page (which
+gives few detections, so prefer real pages, e.g. from the test assets).
+Needs TensorFlow.
+
+    python -m benchmarks.bench_block_export [--experimental] WEIGHTS [IMAGE...]
+"""
+
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from .common import synthetic_page
+
+# name: (optimize, quantize)
+VARIANTS = {
+    'frozen': (False, None),
+    'optimized': (True, None),
+}
+
+# quantized weights (accuracy not yet verified with the trained model)
+EXPERIMENTAL_VARIANTS = {
+    'float16': (True, 'float16'),
+    'int8': (True, 'int8'),
+}
+
+MIN_CONFIDENCE = 0.9
+
+def _load_pages(images):
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+    if not images:
+        return [np.stack((255 * (1 - synthetic_page(gray=False)),) * 3, axis=-1).astype(np.uint8)]
+    return [np.array(Image.open(image).convert('RGB')) for image in images]
+
+def _export(weights, path, optimize, quantize, queue):
+    # pylint: disable=import-outside-toplevel
+    from pkg_resources import resource_filename
+    from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import load_mrcnn
+    from ocrd_anybaseocr.mrcnn.export import export_frozen
+    model_dir = resource_filename('ocrd_anybaseocr', 'mrcnn')
+    mrcnn_model = load_mrcnn(model_dir, weights, MIN_CONFIDENCE, 1)
+    export_frozen(mrcnn_model, path, optimize=optimize, quantize=quantize)
+    queue.put(os.path.getsize(path))
+
+def _detect(weights, images, queue):
+    # pylint: disable=import-outside-toplevel
+    from pkg_resources import resource_filename
+    from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import load_mrcnn
+    model_dir = resource_filename('ocrd_anybaseocr', 'mrcnn')
+    mrcnn_model = load_mrcnn(model_dir, weights, MIN_CONFIDENCE, 1)
+    pages = _load_pages(images)
+    # warm-up (graph finalization, memory allocation)
+    mrcnn_model.detect(pages[:1], compact_masks=True)
+    results = []
+    start = time.perf_counter()
+    for page in pages:
+        result, = mrcnn_model.detect([page], compact_masks=True)
+        results.append((result['rois'], result['class_ids'], result['scores']))
+    queue.put(((time.perf_counter() - start) / len(pages), results))
+
+def _run(target, *args):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def _iou(box, boxes):
+    y1 = np.maximum(box[0], boxes[:, 0])
+    x1 = np.maximum(box[1], boxes[:, 1])
+    y2 = np.minimum(box[2], boxes[:, 2])
+    x2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.maximum(0, y2 - y1) * np.maximum(0, x2 - x1)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(1, area + areas - inter)
+
+def agreement(results, reference):
+    """F1 and mean IoU of detections matched (greedily, by score) to the reference."""
+    matched, total, total_reference, ious = 0, 0, 0, []
+    for (rois, class_ids, scores), (ref_rois, ref_class_ids, _) in zip(results, reference):
+        total += len(rois)
+        total_reference += len(ref_rois)
+        free = np.ones(len(ref_rois), bool)
+        for k in np.argsort(-scores):
+            candidates = free & (ref_class_ids == class_ids[k])
+            if not candidates.any():
+                continue
+            overlap = np.where(candidates, _iou(rois[k], ref_rois), 0)
+            best = np.argmax(overlap)
+            if overlap[best] >= 0.5:
+                free[best] = False
+                matched += 1
+                ious.append(overlap[best])
+    if not total and not total_reference:
+        return 1.0, 1.0
+    f1 = 2 * matched / (total + total_reference)
+    return f1, np.mean(ious) if ious else 0.0
+
+def main():
+    args = sys.argv[1:]
+    experimental = '--experimental' in args
+    if experimental:
+        args.remove('--experimental')
+    if not args:
+        sys.exit(__doc__)
+    weights, images = args[0], args[1:]
+    variants = dict(VARIANTS, **(EXPERIMENTAL_VARIANTS if experimental else {}))
+    try:
+        import tensorflow # pylint: disable=import-outside-toplevel, unused-import
+    except ImportError:
+        print("skipped (TensorFlow not installed)")
+        return
+    seconds, reference = _run(_detect, weights, images)
+    print("%-10s %8.1f MB %6.2f s/page  F1 %5.3f  IoU %5.3f" % (
+        'keras', os.path.getsize(weights) / 1e6, seconds, 1, 1))
+    with tempfile.TemporaryDirectory() as tempdir:
+        for name, (optimize, quantize) in variants.items():
+            path = os.path.join(tempdir, name + '.pb')
+            size = _run(_export, weights, path, optimize, quantize)
+            seconds, results = _run(_detect, path, images)
+            f1, iou = agreement(results, reference)
+            print("%-10s %8.1f MB %6.2f s/page  F1 %5.3f  IoU %5.3f" % (
+                name, size / 1e6, seconds, f1, iou))
+
+if __name__ == '__main__':
+    main()
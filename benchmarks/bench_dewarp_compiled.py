@@ -0,0 +1,110 @@
+"""Report latency and output difference of the compiled dewarping generator.
+
+Runs the pix2pixHD generator from the given model file in eager mode
+and compiled with TorchScript (in float32, bfloat16 and float16, and
+float32 with int8 quantized convolutions), each in a fresh process, on
+the given page image (or a synthetic page), resized to 1024 pixels
+width. Reports the time for loading (including compilation), seconds
+per page (after a warm-up page), and the difference of the output to
+that of the eager model: the maximum absolute difference of gray
+values, and the share of pixels which get binarized differently.
+Variants without native support on this CPU fall back to float32.
+Needs PyTorch and pix2pixHD.
+
+    python -m benchmarks.bench_dewarp_compiled MODEL [IMAGE] [THREADS]
+"""
+
+import multiprocessing as mp
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .common import synthetic_page
+
+# name: (compiled, precision, quantize)
+VARIANTS = {
+    'eager': (False, 'float32', False),
+    'float32': (True, 'float32', False),
+    'bfloat16': (True, 'bfloat16', False),
+    'float16': (True, 'float16', False),
+    'int8': (True, 'float32', True),
+}
+
+WIDTH = 1024
+
+PAGES = 4
+
+def _load_page(image):
+    # pylint: disable=import-outside-toplevel
+    from PIL import Image
+    if image:
+        page = Image.open(image).convert('RGB')
+    else:
+        page = Image.fromarray(255 * (1 - synthetic_page(gray=False))).convert('RGB')
+    # multiple of 64 for the generator
+    height = round(page.height * WIDTH / page.width / 64) * 64
+    return np.array(page.resize((WIDTH, height), Image.BILINEAR))
+
+def _run_variant(model_path, image, threads, compiled, precision, quantize, queue):
+    # pylint: disable=import-outside-toplevel
+    import torch
+    from ocrd_anybaseocr.pix2pixhd_model import prepare_model
+    if threads > 0:
+        torch.set_num_threads(threads)
+    start = time.perf_counter()
+    model, _ = prepare_model(compiled=compiled, precision=precision, quantize=quantize,
+                             gpu_id=-1, model_path=model_path,
+                             resize_or_crop='none', loadSize=WIDTH, fineSize=WIDTH)
+    loading = time.perf_counter() - start
+    label = torch.from_numpy(_load_page(image)).permute(2, 0, 1)[np.newaxis].float() / 127.5 - 1
+    zeros = torch.zeros(1, dtype=torch.long)
+    # warm-up (memory allocation, profiling executor)
+    model.inference(label, zeros, zeros)
+    start = time.perf_counter()
+    for _ in range(PAGES):
+        generated = model.inference(label, zeros, zeros)
+    seconds = (time.perf_counter() - start) / PAGES
+    gray = generated.data.float().mean(dim=1)[0].numpy()
+    output = np.clip((gray + 1) / 2 * 255, 0, 255).astype(np.uint8)
+    queue.put((loading, seconds, output))
+
+def _run(*args):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_variant, args=args + (queue,))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    model, image = sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    try:
+        import torch # pylint: disable=import-outside-toplevel, unused-import
+    except ImportError:
+        print("skipped (PyTorch not installed)")
+        return
+    with tempfile.TemporaryDirectory() as tempdir:
+        # keep the compiled generators out of the model directory
+        model_path = Path(tempdir, 'checkpoints', Path(model).parent.name, Path(model).name)
+        model_path.parent.mkdir(parents=True)
+        shutil.copy(model, model_path)
+        reference = None
+        for name, variant in VARIANTS.items():
+            loading, seconds, output = _run(str(model_path), image, threads, *variant)
+            if reference is None:
+                reference = output
+            diff = np.abs(output.astype(int) - reference).max()
+            flipped = np.mean((output > 127) != (reference > 127))
+            print("%-9s load %6.2f s  %6.3f s/page  max diff %3d  flipped %6.4f%%" % (
+                name, loading, seconds, diff, 100 * flipped))
+
+if __name__ == '__main__':
+    main()
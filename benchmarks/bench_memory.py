@@ -0,0 +1,63 @@
+"""Benchmark peak memory (RSS) of binarization and deskewing by floating-point precision.
+
+Each variant runs in a fresh process. Before processing, the peak resident
+set size gets reset (via ``/proc/self/clear_refs``), so the reported value
+is the peak RSS during processing minus the RSS before (i.e. without
+imports and the input page).
+
+    python -m benchmarks.bench_memory
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+from PIL import Image
+
+from .common import synthetic_page
+
+def _rss_status(key):
+    """Read a memory size from /proc/self/status in MB."""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) / 1024
+    raise KeyError(key)
+
+def _peak_rss(processor, precision, array, queue):
+    # pylint: disable=import-outside-toplevel
+    from ocrd_anybaseocr.cli.ocrd_anybaseocr_binarize import OcrdAnybaseocrBinarizer
+    from ocrd_anybaseocr.cli.ocrd_anybaseocr_deskew import OcrdAnybaseocrDeskewer
+    page = Image.fromarray(array)
+    del array
+    if processor == 'binarize':
+        run = OcrdAnybaseocrBinarizer(None, parameter={'precision': precision}).binarize_image
+    else:
+        page = page.point(lambda x: 255 * (x > 127))
+        run = OcrdAnybaseocrDeskewer(None, parameter={'precision': precision}).deskew_image
+    before = _rss_status('VmRSS')
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5') # reset VmHWM to VmRSS
+    run(page, 'bench')
+    queue.put(_rss_status('VmHWM') - before)
+
+def peak_rss(processor, precision, array):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_peak_rss, args=(processor, precision, array, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def main():
+    for processor in ('binarize', 'deskew'):
+        for dpi in (300, 600):
+            array = np.array(synthetic_page(dpi) * 255, dtype=np.uint8)
+            peaks = {precision: peak_rss(processor, precision, array)
+                     for precision in ('float64', 'float32')}
+            print("%s %d DPI: peak RSS float64 %6.0f MB, float32 %6.0f MB (%.0f%% less)" % (
+                processor, dpi, peaks['float64'], peaks['float32'],
+                100 * (1 - peaks['float32'] / peaks['float64'])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark the reading order of the block segmentation.
+
+Compares :py:func:`compute_reading_order` against the previous
+implementation (a search over all regions for each pair of regions, and
+a recursive topological sort) on synthetic pages with many small regions
+(as for newspapers or tables), arranged in columns of stacked blocks.
+
+    python -m benchmarks.bench_reading_order [REGIONS...]
+"""
+
+import sys
+
+import numpy as np
+
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import compute_reading_order
+
+from .common import timed
+
+REGIONS = [50, 100, 200, 500]
+
+# beyond this, the previous implementation would take minutes
+MAX_REFERENCE = 500
+
+def reading_order_loop(rois):
+    partial_order = np.zeros((len(rois), len(rois)), np.uint8)
+    for i, (min_y_i, min_x_i, max_y_i, max_x_i) in enumerate(rois):
+        for j, (min_y_j, min_x_j, max_y_j, max_x_j) in enumerate(rois):
+            if min_x_i < max_x_j and max_x_i > min_x_j:
+                if min_y_i < min_y_j:
+                    partial_order[i, j] = 1
+            else:
+                min_y = min(min_y_i, min_y_j)
+                max_y = max(max_y_i, max_y_j)
+                min_x = min(min_x_i, min_x_j)
+                max_x = max(max_x_i, max_x_j)
+                if next((False for (min_y_k, min_x_k, max_y_k, max_x_k) in rois
+                         if (min_y_k < max_y and max_y_k > min_y and
+                             min_x_k < max_x and max_x_k > min_x)),
+                        True):
+                    if ((min_y_j + max_y_j)/2 < min_y_i and
+                        (min_y_i + max_y_i)/2 > max_y_j):
+                        partial_order[j, i] = 1
+                    elif max_x_i < min_x_j:
+                        partial_order[i, j] = 1
+    visited = np.zeros(partial_order.shape[0], bool)
+    result = list()
+    def _visit(k):
+        if visited[k]:
+            return
+        visited[k] = True
+        for l in np.nonzero(partial_order[:, k])[0]:
+            _visit(l)
+        result.append(k)
+    for k in range(partial_order.shape[0]):
+        _visit(k)
+    return result
+
+def synthetic_regions(count, height=7000, width=5000, seed=0):
+    """Boxes (y1, x1, y2, x2) of ``count`` regions in columns, in random order."""
+    rng = np.random.default_rng(seed)
+    columns = max(1, int(np.sqrt(count / 4)))
+    rows = (count + columns - 1) // columns
+    column_width = width // columns
+    row_height = height // rows
+    rois = []
+    for k in range(count):
+        column, row = divmod(k, rows)
+        y1 = row * row_height + rng.integers(0, row_height // 4 + 1)
+        x1 = column * column_width + rng.integers(0, column_width // 8 + 1)
+        y2 = (row + 1) * row_height - rng.integers(1, row_height // 4 + 2)
+        x2 = (column + 1) * column_width - rng.integers(1, column_width // 8 + 2)
+        rois.append([y1, x1, y2, x2])
+    return rng.permutation(np.array(rois, np.int32))
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or REGIONS
+    for count in counts:
+        rois = synthetic_regions(count)
+        times = {}
+        with timed(times, 'new'):
+            order = compute_reading_order(rois)
+        if count > MAX_REFERENCE:
+            print("%5d regions: new %6.3fs" % (count, times['new']))
+            continue
+        with timed(times, 'old'):
+            expected = reading_order_loop(rois)
+        assert order == expected
+        print("%5d regions: new %6.3fs old %7.3fs (speedup %6.1fx)" % (
+            count, times['new'], times['old'], times['old'] / times['new']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark the binary seedfill of the text/image segmentation.
+
+Compares :py:func:`ocrd_anybaseocr.morphology.seedfill_binary` against
+the previous per-component implementation (one full-image scan for each
+seeded component, kept as reference in ``tests.test_morphology``) on a
+page mask at the resolution tiseg works on (i.e. reduced 4x), with a
+halftone illustration producing many components.
+
+    python -m benchmarks.bench_seedfill
+"""
+
+import numpy as np
+
+from ocrd_anybaseocr.morphology import seedfill_binary
+from tests.test_morphology import seedfill_binary_loop
+
+from .common import synthetic_page, timed
+
+def halftone_page(dpi, dots):
+    """Reduced page mask with text and a halftone (grid of ``dots`` x ``dots`` dots)."""
+    page = synthetic_page(dpi, gray=False)[::4, ::4]
+    height, width = page.shape
+    top, left = height // 4, width // 8
+    size = min(height // 2, width * 3 // 4)
+    step = size // dots
+    for y in range(top, top + dots * step, step):
+        for x in range(left, left + dots * step, step):
+            page[y:y + step // 2, x:x + step // 2] = 1
+    seed = np.zeros_like(page)
+    # seeds cover the illustration only
+    seed[top:top + dots * step:step, left:left + dots * step:step] = 1
+    return page, seed
+
+def main():
+    for dpi in (300, 600):
+        for dots in (10, 40, 100):
+            mask, seed = halftone_page(dpi, dots)
+            times = {}
+            with timed(times, 'new'):
+                fill = seedfill_binary(mask, seed)
+            with timed(times, 'old'):
+                expected = seedfill_binary_loop(mask, seed)
+            assert np.array_equal(fill, expected != 0)
+            print("%d DPI %5d seeded components: new %6.3fs old %7.3fs (speedup %5.1fx)" % (
+                dpi, dots * dots, times['new'], times['old'], times['old'] / times['new']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark import time of the processor CLI modules.
+
+Each module gets imported in a fresh interpreter with ``python -X importtime``,
+reporting its cumulative import time, the overhead compared to importing
+just the OCR-D processor framework (which every module needs anyway), and
+which of the heavy dependencies (only needed for processing) it already
+pulled in. Exits with an error if the overhead of any module exceeds the
+threshold or if any module imports a heavy dependency.
+
+    python -m benchmarks.bench_startup [THRESHOLD_SECONDS]
+"""
+
+import subprocess
+import sys
+
+MODULES = [
+    'binarize',
+    'deskew',
+    'cropping',
+    'preprocess',
+    'dewarp',
+    'tiseg',
+    'textline',
+    'layout_analysis',
+    'block_segmentation',
+    'block_segmentation_export',
+    'server',
+]
+
+# not needed for --help, --dump-json etc.
+HEAVY = ['tensorflow', 'torch', 'matplotlib', 'pix2pixhd']
+
+# common to all processors
+FRAMEWORK = 'ocrd.decorators'
+
+THRESHOLD = 1.0 # seconds on top of FRAMEWORK
+
+REPEAT = 3 # take the fastest of this many runs
+
+def _import_time(module):
+    code = ('import sys, %s; print(" ".join(name for name in %r if name in sys.modules))'
+            % (module, HEAVY))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=False)
+    if result.returncode:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    total = 0
+    started = False
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        if name == 'site':
+            # interpreter startup is done, now comes our code
+            started = True
+        elif started and not name.startswith(' '):
+            # sum up top-level imports (incl. parent packages)
+            total += int(fields[1])
+    return total / 1e6, result.stdout.split()
+
+def import_time(module):
+    """Import ``module`` in new interpreters, return seconds and heavy modules loaded."""
+    return min(_import_time(module) for _ in range(REPEAT))
+
+def main():
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else THRESHOLD
+    reference, _ = import_time(FRAMEWORK)
+    print("%-20s %5.2f s" % (FRAMEWORK, reference))
+    failed = False
+    for name in MODULES:
+        module = 'ocrd_anybaseocr.cli.ocrd_anybaseocr_' + name
+        try:
+            seconds, heavy = import_time(module)
+        except ImportError as err:
+            print("%-20s skipped (%s)" % (name, err))
+            continue
+        status = 'ok'
+        if seconds - reference > threshold:
+            status = 'SLOW'
+        if heavy:
+            status = 'HEAVY: ' + ', '.join(heavy)
+        failed = failed or status != 'ok'
+        print("%-20s %5.2f s (%+5.2f s)  %s" % (name, seconds, seconds - reference, status))
+    if failed:
+        sys.exit("import time regression (threshold %.1f s)" % threshold)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Synthetic test data for the benchmarks (no OCR-D workspace needed)."""
+
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# A4 page sizes (height, width) in pixels
+PAGE_SIZES = {
+    300: (3508, 2480),
+    600: (7016, 4960),
+}
+
+def synthetic_page(dpi=300, seed=0, gray=True):
+    """Generate a page image with text-like blobs in two columns.
+
+    If ``gray``, return a float image in [0,1] with an uneven paper
+    background and noise (white=1), otherwise a binary uint8 image
+    (foreground=1).
+    """
+    rng = np.random.default_rng(seed)
+    height, width = PAGE_SIZES[dpi]
+    scale = dpi / 300
+    ink = np.zeros((height, width), bool)
+    line_height = int(50 * scale)
+    glyph_height = int(25 * scale)
+    glyph_width = int(18 * scale)
+    margin = int(300 * scale)
+    column_width = (width - 3 * margin) // 2
+    for column in range(2):
+        left = margin + column * (column_width + margin)
+        for top in range(margin, height - margin, line_height):
+            x = left
+            while x < left + column_width - glyph_width:
+                if rng.random() < 0.85:
+                    ink[top:top + glyph_height, x:x + int(glyph_width * rng.uniform(0.5, 1))] = True
+                x += glyph_width
+    if not gray:
+        return ink.astype(np.uint8)
+    ramp = np.linspace(0.75, 0.95, width)[np.newaxis, :]
+    page = np.broadcast_to(ramp, (height, width)).copy()
+    page += rng.normal(0, 0.02, (height, width))
+    page[ink] = 0.15
+    return np.clip(page, 0, 1)
+
+@contextmanager
+def timed(results, key):
+    """Store the wall time of the enclosed block in ``results[key]``."""
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
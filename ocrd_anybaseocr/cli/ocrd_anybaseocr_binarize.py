@@ -38,16 +38,16 @@
 #!/usr/bin/env python
 
 
-import ocrolib
 import os
 
-from pylab import amin, amax, mean, ginput, ones, clip, imshow, median, ion, gray, minimum, array, clf
-from scipy.ndimage import filters, interpolation, morphology
-from scipy import stats
+from scipy.ndimage import filters, interpolation
 import numpy as np
 import click
 
 from ..constants import OCRD_TOOL
+from ..nlbin import estimate_thresholds
+from ..parallel import process_pages
+from ..imagefile import pil2array, save_image_file
 
 from ocrd import Processor
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
@@ -82,7 +82,7 @@ class OcrdAnybaseocrBinarizer(Processor):
     def check_page(self, image):
         if len(image.shape) == 3:
             return "input image is color image %s" % (image.shape,)
-        if mean(image) < median(image):
+        if np.mean(image) < np.median(image):
             return "image may be inverted"
         h, w = image.shape
         if h < 600:
@@ -95,65 +95,84 @@ class OcrdAnybaseocrBinarizer(Processor):
             return "line too wide for a page image %s" % (image.shape,)
         return None
 
-    def dshow(self, image, info):
+    def dshow(self, image, info, **kwargs):
         if self.parameter['debug'] <= 0:
             return
-        ion()
-        gray()
-        imshow(image)
-        ginput(1, self.parameter['debug'])
+        # matplotlib is slow to import, so only load it for debugging
+        import matplotlib.pyplot as plt
+        plt.ion()
+        plt.gray()
+        plt.clf()
+        plt.imshow(image, **kwargs)
+        plt.ginput(1, self.parameter['debug'])
 
     def process(self):
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
+        process_pages(self)
+
+    def process_page(self, n, input_file):
         oplevel = self.parameter['operation_level']
         LOG = getLogger('OcrdAnybaseocrBinarizer')
 
-        for (n, input_file) in enumerate(self.input_files):            
-            file_id = make_file_id(input_file, self.output_file_grp)
-            page_id = input_file.pageId or input_file.ID
-            
-            LOG.info("INPUT FILE %i / %s", n, page_id)
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            pcgts.set_pcGtsId(file_id)
-            self.add_metadata(pcgts)
-
-            page = pcgts.get_Page()
-            page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter="binarized")
-            LOG.info("Binarizing on '%s' level in page '%s'", oplevel, page_id)                    
-            
-            if oplevel=="page":
-                self._process_segment(page_image, page, page_xywh, page_id, input_file, n)
-            else:
-                regions = page.get_TextRegion() + page.get_TableRegion()
-                if not regions:
-                    LOG.warning("Page '%s' contains no text regions", page_id)
-                for (k, region) in enumerate(regions):
-                    region_image, region_xywh = self.workspace.image_from_segment(region, page_image, page_xywh)            
-                    # TODO: not tested on regions
-                    self._process_segment(region_image, page, region_xywh, region.id, input_file, str(n)+"_"+str(k))
-
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
+        page_id = input_file.pageId or input_file.ID
+        
+        LOG.info("INPUT FILE %i / %s", n, page_id)
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+
+        page = pcgts.get_Page()
+        page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter="binarized")
+        LOG.info("Binarizing on '%s' level in page '%s'", oplevel, page_id)                    
+        
+        if oplevel=="page":
+            self._process_segment(page_image, page, page_xywh, page_id, input_file, n)
+        else:
+            regions = page.get_TextRegion() + page.get_TableRegion()
+            if not regions:
+                LOG.warning("Page '%s' contains no text regions", page_id)
+            for (k, region) in enumerate(regions):
+                region_image, region_xywh = self.workspace.image_from_segment(region, page_image, page_xywh)            
+                # TODO: not tested on regions
+                self._process_segment(region_image, page, region_xywh, region.id, input_file, str(n)+"_"+str(k))
+        return pcgts
 
     def _process_segment(self,page_image, page, page_xywh, page_id, input_file, n):
+        bin_image = self.binarize_image(page_image, page_id)
+        if bin_image is None:
+            return
+
+        page_xywh['features'] += ',binarized'  
+        
+        file_id = make_file_id(input_file, self.output_file_grp)
+        file_path = save_image_file(self.workspace, bin_image,
+                                    file_id + '-IMG',
+                                    page_id=page_id,
+                                    file_grp=self.output_file_grp,
+                                    output_format=self.parameter['output_format'],
+                                    compression=self.parameter['compression'])
+        page.add_AlternativeImage(AlternativeImageType(filename=file_path, comments=page_xywh['features']))
+
+    def binarize_image(self, page_image, page_id):
+        """Binarize a PIL image, returning the binarized PIL image (or None if empty).
+
+        All intermediate arrays use the floating-point type of the ``precision``
+        parameter, and arithmetic is done in-place wherever possible.
+        """
+        import ocrolib # pulls in matplotlib
         LOG = getLogger('OcrdAnybaseocrBinarizer')
-        raw = ocrolib.pil2array(page_image)
+        dtype = self.parameter['precision']
+        raw = pil2array(page_image)
         if len(raw.shape) > 2:
-            raw = np.mean(raw, 2)
-        raw = raw.astype("float64")
+            raw = np.mean(raw, 2, dtype=dtype)
         # perform image normalization
-        image = raw-amin(raw)
-        if amax(image) == amin(image):
+        image = raw.astype(dtype, copy=False)
+        del raw
+        image -= np.amin(image)
+        if np.amax(image) == np.amin(image):
             LOG.info("# image is empty: %s" % (page_id))
-            return
-        image /= amax(image)
+            return None
+        image /= np.amax(image)
 
         # check whether the image is already effectively binarized
         if self.parameter['gray']:
@@ -174,73 +193,50 @@ class OcrdAnybaseocrBinarizer(Processor):
             m = filters.percentile_filter(
                 m, self.parameter['perc'], size=(2, self.parameter['range']))
             m = interpolation.zoom(m, 1.0/self.parameter['zoom'])
-            if self.parameter['debug'] > 0:
-                clf()
-                imshow(m, vmin=0, vmax=1)
-                ginput(1, self.parameter['debug'])
-            w, h = minimum(array(image.shape), array(m.shape))
-            flat = clip(image[:w, :h]-m[:w, :h]+1, 0, 1)
-            if self.parameter['debug'] > 0:
-                clf()
-                imshow(flat, vmin=0, vmax=1)
-                ginput(1, self.parameter['debug'])
+            self.dshow(m, 'background', vmin=0, vmax=1)
+            w, h = np.minimum(image.shape, m.shape)
+            # flat = clip(image-m+1, 0, 1), but without temporaries
+            flat = image[:w, :h]
+            flat -= m[:w, :h]
+            del m
+            flat += 1
+            np.clip(flat, 0, 1, out=flat)
+            self.dshow(flat, 'flattened', vmin=0, vmax=1)
 
         # estimate low and high thresholds
         LOG.info("Estimating Thresholds")
-        d0, d1 = flat.shape
-        o0, o1 = int(self.parameter['bignore']
-                     * d0), int(self.parameter['bignore']*d1)
-        est = flat[o0:d0-o0, o1:d1-o1]
-        if self.parameter['escale'] > 0:
-            # by default, we use only regions that contain
-            # significant variance; this makes the percentile
-            # based low and high estimates more reliable
-            e = self.parameter['escale']
-            v = est-filters.gaussian_filter(est, e*20.0)
-            v = filters.gaussian_filter(v**2, e*20.0)**0.5
-            v = (v > 0.3*amax(v))
-            v = morphology.binary_dilation(
-                v, structure=ones((int(e*50), 1)))
-            v = morphology.binary_dilation(
-                v, structure=ones((1, int(e*50))))
-            if self.parameter['debug'] > 0:
-                imshow(v)
-                ginput(1, self.parameter['debug'])
-            est = est[v]
-        lo = stats.scoreatpercentile(est.ravel(), self.parameter['lo'])
-        hi = stats.scoreatpercentile(est.ravel(), self.parameter['hi'])
+        lo, hi = estimate_thresholds(flat,
+                                     bignore=self.parameter['bignore'],
+                                     escale=self.parameter['escale'],
+                                     lo=self.parameter['lo'],
+                                     hi=self.parameter['hi'],
+                                     decimate=self.parameter['decimate'],
+                                     bins=self.parameter['histbins'],
+                                     value_range=(0, 1),
+                                     dshow=self.dshow)
         # rescale the image to get the gray scale image
         LOG.info("Rescaling")
         flat -= lo
         flat /= (hi-lo)
-        flat = clip(flat, 0, 1)
-        if self.parameter['debug'] > 0:
-            imshow(flat, vmin=0, vmax=1)
-            ginput(1, self.parameter['debug'])
-        binarized = 1*(flat > self.parameter['threshold'])
+        np.clip(flat, 0, 1, out=flat)
+        self.dshow(flat, 'rescaled', vmin=0, vmax=1)
+        binarized = np.array(flat > self.parameter['threshold'], 'B')
+        del flat, image
 
         # output the normalized grayscale and the thresholded images
         # print_info("%s lo-hi (%.2f %.2f) angle %4.1f %s" % (fname, lo, hi, angle, comment))
         LOG.info("%s lo-hi (%.2f %.2f) %s" % (page_id, lo, hi, comment))
         LOG.info("writing")
         if self.parameter['debug'] > 0 or self.parameter['show']:
-            clf()
-            gray()
-            imshow(binarized)
-            ginput(1, max(0.1, self.parameter['debug']))
+            import matplotlib.pyplot as plt
+            plt.clf()
+            plt.gray()
+            plt.imshow(binarized)
+            plt.ginput(1, max(0.1, self.parameter['debug']))
         
-        page_xywh['features'] += ',binarized'  
-       
-        bin_array = array(255*(binarized>ocrolib.midrange(binarized)),'B')
-        bin_image = ocrolib.array2pil(bin_array)                            
-        
-        file_id = make_file_id(input_file, self.output_file_grp)
-        file_path = self.workspace.save_image_file(bin_image,
-                                   file_id + '-IMG',
-                                   page_id=page_id,
-                                   file_grp=self.output_file_grp
-            )     
-        page.add_AlternativeImage(AlternativeImageType(filename=file_path, comments=page_xywh['features']))
+        bin_array = np.array(binarized > ocrolib.midrange(binarized), 'B')
+        bin_array *= 255
+        return ocrolib.array2pil(bin_array)
 
 
 @click.command()
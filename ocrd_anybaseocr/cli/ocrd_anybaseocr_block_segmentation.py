@@ -9,8 +9,8 @@ from pkg_resources import resource_filename
 import click
 import cv2
 import numpy as np
+from scipy import ndimage
 from shapely.geometry import Polygon
-import ocrolib
 
 
 from ocrd import Processor
@@ -34,10 +34,10 @@ from ocrd_models.ocrd_page import (
     to_xml,
     RegionRefIndexedType, OrderedGroupType, ReadingOrderType
 )
-from ..mrcnn import model
 from ..mrcnn.config import Config
 from ..constants import OCRD_TOOL
-from ..tensorflow_importer import tf
+from ..parallel import process_pages
+from ..server import RemoteModel, load_model
 
 TOOL = 'ocrd-anybaseocr-block-segmentation'
 CLASS_NAMES = ['BG',
@@ -61,9 +61,307 @@ CLASS_NAMES = ['BG',
                #'graphics'
 ]
 
+def mask_contour(mask, offset, shape, scale):
+    """Find the outer contour of a smoothed instance mask.
+
+    ``mask`` is the (boolean) mask within its bounding box, ``offset``
+    the (y, x) position of the box on the page, and ``shape`` the (height,
+    width) of the page. Dilate the mask with a ``scale`` x ``scale`` kernel,
+    then close it until it has a single outer contour.
+
+    The morphology only operates on the box plus a margin of the extent
+    of the dilation and closing (but cut at the page borders), so
+    the result is the same as on a full page mask.
+
+    Returns the (first) contour as an array of x,y points on the page.
+    """
+    height, width = shape
+    y0, x0 = offset
+    # at most the part of the box within the page
+    mask = mask[:height - y0, :width - x0]
+    margin = 3 * (scale // 2) + 1
+    top, left = max(0, y0 - margin), max(0, x0 - margin)
+    bottom = min(height, y0 + mask.shape[0] + margin)
+    right = min(width, x0 + mask.shape[1] + margin)
+    local = np.zeros((bottom - top, right - left), np.uint8)
+    local[y0 - top:y0 - top + mask.shape[0], x0 - left:x0 - left + mask.shape[1]] = mask
+    kernel = np.ones((scale, scale), np.uint8)
+    local = cv2.dilate(local, kernel)
+    # close mask until we have a single outer contour
+    contours = None
+    for _ in range(10):
+        local = cv2.morphologyEx(local, cv2.MORPH_CLOSE, kernel)
+        contours, _ = cv2.findContours(local,
+                                       cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE,
+                                       offset=(int(left), int(top)))
+        if len(contours) == 1:
+            break
+    return contours[0][:,0,:] # already in x,y order
+
+def extend_rois(foreground, rois, th):
+    """Extend boxes to nearby foreground pixels not covered by any box.
+
+    ``foreground`` is a boolean page mask (e.g. text from tiseg), ``rois``
+    an array of (y1, x1, y2, x2) boxes, which gets modified in place.
+    Each uncovered foreground pixel which is within distance ``th`` of
+    a covered foreground pixel, or of another such pixel in turn, gets
+    assigned to the box of its nearest covered foreground pixel in the
+    same chain, and each box gets extended to include all its assigned
+    pixels.
+
+    Instead of visiting each uncovered pixel in a window search (and
+    repeating until nothing changes), find the chains via connected
+    components after dilation by half the distance, and the nearest
+    covered pixels via a single Euclidean distance transform (repeated
+    only within those chains where it points into another chain).
+    """
+    labels = np.zeros(foreground.shape, np.int32)
+    for i, (min_y, min_x, max_y, max_x) in enumerate(rois):
+        labels[min_y:max_y, min_x:max_x] = i + 1
+    labels[~foreground] = 0
+    seeds = labels > 0
+    leftover = foreground & ~seeds
+    if not seeds.any() or not leftover.any():
+        return rois
+    radius = th // 2
+    disk = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    chains, count = ndimage.label(cv2.dilate(foreground.astype(np.uint8), disk),
+                                  np.ones((3, 3), bool))
+    reached = np.zeros(count + 1, bool)
+    reached[chains[seeds]] = True
+    reached[0] = False
+    leftover &= reached[chains]
+    if not leftover.any():
+        return rois
+    nearest = ndimage.distance_transform_edt(~seeds, return_distances=False, return_indices=True)
+    ys, xs = np.nonzero(leftover)
+    near_ys, near_xs = nearest[0][ys, xs], nearest[1][ys, xs]
+    # the globally nearest covered pixel may lie in another chain,
+    # so search again within the chain of the pixel where needed
+    chain = chains[ys, xs]
+    foreign = chains[near_ys, near_xs] != chain
+    if foreign.any():
+        boxes = ndimage.find_objects(chains)
+        for label in np.unique(chain[foreign]):
+            box = boxes[label - 1]
+            own = seeds[box] & (chains[box] == label)
+            nearest = ndimage.distance_transform_edt(~own, return_distances=False, return_indices=True)
+            select = foreign & (chain == label)
+            local_ys = ys[select] - box[0].start
+            local_xs = xs[select] - box[1].start
+            near_ys[select] = nearest[0][local_ys, local_xs] + box[0].start
+            near_xs[select] = nearest[1][local_ys, local_xs] + box[1].start
+    index = labels[near_ys, near_xs] - 1
+    np.minimum.at(rois[:, 0], index, ys)
+    np.minimum.at(rois[:, 1], index, xs)
+    np.maximum.at(rois[:, 2], index, ys)
+    np.maximum.at(rois[:, 3], index, xs)
+    return rois
+
+def suppress_overlaps(r, use_masks, min_share_drop, min_iou_drop, min_share_merge, min_iou_merge):
+    """Drop or merge overlapping detections until no more changes occur.
+
+    Compare all pairs of detections in ``r`` with overlapping bounding
+    boxes (``rois``): without ``use_masks``, drop the one with the lower
+    score; otherwise compare their hull ``polygons`` by share of the
+    intersection in either area, or by IoU, and drop or merge accordingly
+    (modifying ``r`` in place).
+
+    Overlapping pairs are found by testing the bounding box of each
+    detection against those of all later detections at once. Polygon areas
+    are cached, and pairs which have been compared without effect are only
+    compared again if either of them has been merged with another since.
+
+    Returns the set of indices of dropped (or merged) detections.
+    """
+    LOG = getLogger('processor.AnybaseocrBlockSegmenter')
+    rois = r['rois']
+    worse = set()
+    # incremented whenever a detection gets merged with another
+    version = [0] * len(rois)
+    areas = {}
+    settled = {}
+    def _area(k):
+        if areas.get(k, (None,))[0] != version[k]:
+            areas[k] = (version[k], r['polygons'][k].area)
+        return areas[k][1]
+    def _merge_rois(i, j):
+        """merges i into j"""
+        rois[j][0] = min(rois[i][0], rois[j][0])
+        rois[j][1] = min(rois[i][1], rois[j][1])
+        rois[j][2] = max(rois[i][2], rois[j][2])
+        rois[j][3] = max(rois[i][3], rois[j][3])
+        r['polygons'][j] = r['polygons'][i].union(r['polygons'][j])
+        #r['scores'][j] = max(r['scores'][i], r['scores'][i])
+        version[j] += 1
+    def _overlapping(i, start):
+        """indices from start on whose bounding boxes overlap that of i"""
+        others = rois[start:]
+        cut = ((rois[i][1] > others[:, 3]) | (rois[i][3] < others[:, 1]) |
+               (rois[i][0] > others[:, 2]) | (rois[i][2] < others[:, 0]))
+        return list(start + np.flatnonzero(~cut))
+    # find overlapping pairs
+    active = True
+    while active:
+        active = False
+        for i in range(len(r["class_ids"])):
+            if i in worse:
+                continue
+            candidates = _overlapping(i, i + 1)
+            while candidates:
+                j = candidates.pop(0)
+                if j in worse:
+                    continue
+                iclass = r['class_ids'][i]
+                jclass = r['class_ids'][j]
+                iname = CLASS_NAMES[iclass]
+                jname = CLASS_NAMES[jclass]
+                if (iname == 'drop-capital') != (jname == 'drop-capital'):
+                    # ignore drop-capital overlapping with others
+                    continue
+                # rs todo: lower priority for footnote?
+                iscore = r['scores'][i]
+                jscore = r['scores'][j]
+                if not use_masks:
+                    LOG.debug("roi %d[%s] overlaps roi %d[%s] and %s (replacing)",
+                              i, iname, j, jname,
+                              "looses" if iscore < jscore else "wins")
+                    if iscore < jscore:
+                        worse.add(i)
+                        break
+                    else:
+                        worse.add(j)
+                        continue
+                if settled.get((i, j)) == (version[i], version[j]):
+                    # compared before without effect
+                    continue
+                # compare masks
+                ipoly = r['polygons'][i]
+                jpoly = r['polygons'][j]
+                isize = _area(i)
+                jsize = _area(j)
+                inter = ipoly.intersection(jpoly).area
+                union = ipoly.union(jpoly).area
+                # LOG.debug("%d/%d %dpx/%dpx shared %dpx overall %dpx",
+                #           i, j, isize, jsize, inter, union)
+                if inter / isize > min_share_drop:
+                    LOG.debug("roi %d[%s] contains roi %d[%s] (replacing)",
+                              j, jname, i, iname)
+                    worse.add(i)
+                    break
+                elif inter / jsize > min_share_drop:
+                    LOG.debug("roi %d[%s] contains roi %d[%s] (replacing)",
+                              i, iname, j, jname)
+                    worse.add(j)
+                elif inter / union > min_iou_drop:
+                    LOG.debug("roi %d[%s] heavily overlaps roi %d[%s] and %s (replacing)",
+                              i, iname, j, jname,
+                              "looses" if iscore < jscore else "wins")
+                    if iscore < jscore:
+                        worse.add(i)
+                        break
+                    else:
+                        worse.add(j)
+                elif inter / isize > min_share_merge:
+                    LOG.debug("roi %d[%s] covers roi %d[%s] (merging)",
+                              j, jname, i, iname)
+                    worse.add(i)
+                    _merge_rois(i, j)
+                    active = True
+                    break
+                elif inter / jsize > min_share_merge:
+                    LOG.debug("roi %d[%s] covers roi %d[%s] (merging)",
+                              i, iname, j, jname)
+                    worse.add(j)
+                    _merge_rois(j, i)
+                    active = True
+                    # i has grown, so it may overlap more of the remaining
+                    candidates = _overlapping(i, j + 1)
+                elif inter / union > min_iou_merge:
+                    LOG.debug("roi %d[%s] slightly overlaps roi %d[%s] and %s (merging)",
+                              i, iname, j, jname,
+                              "looses" if iscore < jscore else "wins")
+                    if iscore < jscore:
+                        worse.add(i)
+                        _merge_rois(i, j)
+                        active = True
+                        break
+                    else:
+                        worse.add(j)
+                        _merge_rois(j, i)
+                        active = True
+                        candidates = _overlapping(i, j + 1)
+                else:
+                    settled[i, j] = (version[i], version[j])
+    return worse
+
+def compute_reading_order(rois):
+    """Sort regions into reading order on the basis of their bounding boxes.
+
+    ``rois`` is an array of (y1, x1, y2, x2) boxes. Among horizontally
+    overlapping boxes, the upper one comes first. Among horizontally
+    disjoint boxes with no other box in between, a box completely below
+    the middle of the other comes after it, otherwise the left one comes
+    first. The resulting partial order is sorted topologically by
+    iterative depth-first search (so there is no recursion limit).
+
+    Since both boxes of a pair lie within their hull themselves, the
+    "no other box in between" condition can only hold for pairs of
+    degenerate (empty) boxes, so the search over all boxes (which made
+    this cubic in the number of regions) is only done for those.
+
+    Returns the list of region indices in reading order.
+    """
+    rois = np.asarray(rois).reshape(-1, 4)
+    min_y, min_x, max_y, max_x = (rois[:, k] for k in range(4))
+    xoverlaps = ((min_x[:, np.newaxis] < max_x[np.newaxis, :]) &
+                 (max_x[:, np.newaxis] > min_x[np.newaxis, :]))
+    partial_order = xoverlaps & (min_y[:, np.newaxis] < min_y[np.newaxis, :])
+    degenerate = (min_y >= max_y) | (min_x >= max_x)
+    for i, j in zip(*np.nonzero(~xoverlaps &
+                                degenerate[:, np.newaxis] &
+                                degenerate[np.newaxis, :])):
+        hull_min_y = min(min_y[i], min_y[j])
+        hull_max_y = max(max_y[i], max_y[j])
+        hull_min_x = min(min_x[i], min_x[j])
+        hull_max_x = max(max_x[i], max_x[j])
+        if np.any((min_y < hull_max_y) & (max_y > hull_min_y) &
+                  (min_x < hull_max_x) & (max_x > hull_min_x)):
+            continue
+        # no k in between
+        if ((min_y[j] + max_y[j])/2 < min_y[i] and
+            (min_y[i] + max_y[i])/2 > max_y[j]):
+            # vertically unrelated
+            partial_order[j, i] = True
+        elif max_x[i] < min_x[j]:
+            partial_order[i, j] = True
+    # depth-first post-order: each region after all its predecessors
+    visited = np.zeros(len(rois), bool)
+    result = list()
+    for k in range(len(rois)):
+        if visited[k]:
+            continue
+        visited[k] = True
+        stack = [(k, iter(np.flatnonzero(partial_order[:, k])))]
+        while stack:
+            node, predecessors = stack[-1]
+            for l in predecessors:
+                if not visited[l]:
+                    visited[l] = True
+                    stack.append((l, iter(np.flatnonzero(partial_order[:, l]))))
+                    break
+            else:
+                stack.pop()
+                result.append(node)
+    return [int(k) for k in result]
+
 class InferenceConfig(Config):
 
-    def __init__(self, confidence):
+    def __init__(self, confidence, batch_size=1, resize_fast=False):
+        # the inference graph is built for a fixed batch size
+        self.IMAGES_PER_GPU = batch_size
+        self.IMAGE_RESIZE_FAST = resize_fast
         Config.__init__(self, confidence)
 
     NAME = "block"
@@ -73,6 +371,24 @@ class InferenceConfig(Config):
 #     NUM_CLASSES = 1 + 14
 #     DETECTION_MIN_CONFIDENCE = 0.9 # needs to be changed back to parameter
 
+def load_mrcnn(model_dir, weights, confidence, batch_size, resize_fast=False):
+    """Build the Mask R-CNN inference graph and load the ``weights`` file.
+
+    If ``weights`` is a graph exported by ``ocrd-anybaseocr-block-segmentation-export``
+    (``.pb``), then load that instead of building the Keras model.
+    If ``resize_fast``, then resize pages for the model with area interpolation
+    into a reused float32 buffer (see ``Config.IMAGE_RESIZE_FAST``).
+    """
+    config = InferenceConfig(confidence, batch_size, resize_fast)
+    if weights.endswith('.pb'):
+        from ..mrcnn.export import FrozenMaskRCNN
+        return FrozenMaskRCNN(weights, config)
+    # only load TensorFlow when processing
+    from ..mrcnn import model
+    mrcnn_model = model.MaskRCNN(mode="inference", model_dir=model_dir, config=config)
+    mrcnn_model.load_weights(weights, by_name=True)
+    return mrcnn_model
+
 class OcrdAnybaseocrBlockSegmenter(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -84,61 +400,89 @@ class OcrdAnybaseocrBlockSegmenter(Processor):
             self.setup()
 
     def setup(self):
-        LOG = getLogger('processor.AnybaseocrBlockSegmenter')
         #self.reading_order = []
         self.order = 0
         model_path = resource_filename(__name__, '../mrcnn')
         model_weights = Path(self.resolve_resource(self.parameter['block_segmentation_weights']))
 
-        confidence = self.parameter['min_confidence']
-        config = InferenceConfig(confidence)
-        self.mrcnn_model = model.MaskRCNN(mode="inference", model_dir=str(model_path), config=config)
-        self.mrcnn_model.load_weights(str(model_weights), by_name=True)
-    
+        self.mrcnn_model = load_model(__name__ + ':load_mrcnn',
+                                      model_dir=str(model_path),
+                                      weights=str(model_weights),
+                                      confidence=self.parameter['min_confidence'],
+                                      batch_size=max(1, self.parameter['batch_size']),
+                                      resize_fast=self.parameter['resize_fast'])
+
     def process(self):
         """Segment pages into regions using a Mask R-CNN model."""
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
         LOG = getLogger('processor.AnybaseocrBlockSegmenter')
-        if not tf.test.is_gpu_available():
-            LOG.warning("Tensorflow cannot detect CUDA installation. Running without GPU will be slow.")
-
-        for input_file in self.input_files:
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-            page = pcgts.get_Page()
-            page_id = input_file.pageId or input_file.ID
-
-            # todo rs: why not cropped?
-            page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter='binarized,deskewed,cropped,clipped,non_text')
-            # try to load pixel masks
-            try:
-                # todo rs: this combination only works for tiseg with use_deeplr=true
-                mask_image, _, _ = self.workspace.image_from_page(page, page_id, feature_selector='clipped', feature_filter='binarized,deskewed,cropped,non_text')
-            except:
-                mask_image = None
-            if page_image_info.resolution != 1:
-                dpi = page_image_info.resolution
-                if page_image_info.resolutionUnit == 'cm':
-                    dpi = round(dpi * 2.54)
-            else:
-                dpi = None
-
-            self._process_segment(page_image, page, page_xywh, page_id, input_file, mask_image, dpi)
-
-            file_id = make_file_id(input_file, self.output_file_grp)
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
-
-    def _process_segment(self, page_image, page, page_xywh, page_id, input_file, mask, dpi):
+        if not isinstance(self.mrcnn_model, RemoteModel):
+            from ..tensorflow_importer import tf
+            if not tf.test.is_gpu_available():
+                LOG.warning("Tensorflow cannot detect CUDA installation. Running without GPU will be slow.")
+
+        process_pages(self)
+
+    def load_page(self, n, input_file):
+        """Load the page image (and mask) as model input."""
+        import ocrolib # pulls in matplotlib
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+        page = pcgts.get_Page()
+        page_id = input_file.pageId or input_file.ID
+
+        # todo rs: why not cropped?
+        page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter='binarized,deskewed,cropped,clipped,non_text')
+        # try to load pixel masks
+        try:
+            # todo rs: this combination only works for tiseg with use_deeplr=true
+            mask_image, _, _ = self.workspace.image_from_page(page, page_id, feature_selector='clipped', feature_filter='binarized,deskewed,cropped,non_text')
+        except:
+            mask_image = None
+        if page_image_info.resolution != 1:
+            dpi = page_image_info.resolution
+            if page_image_info.resolutionUnit == 'cm':
+                dpi = round(dpi * 2.54)
+        else:
+            dpi = None
+        img_array = ocrolib.pil2array(page_image)
+        if len(img_array.shape) <= 2:
+            img_array = np.stack((img_array,)*3, axis=-1)
+        return pcgts, page_image, page, page_xywh, page_id, input_file, mask_image, dpi, img_array
+
+    def predict_pages(self, states):
+        """Detect regions on the loaded pages, in batches of ``batch_size``."""
+        results = self._detect([state[-1] for state in states])
+        return [state + (r,) for state, r in zip(states, results)]
+
+    def write_page(self, state):
+        """Post-process the detections and annotate them as regions."""
+        self._process_segment(*state[1:])
+        return state[0]
+
+    def _detect(self, img_arrays):
+        """Run the model on batches of page images, return one result per page."""
+        LOG = getLogger('processor.AnybaseocrBlockSegmenter')
+        batch_size = max(1, self.parameter['batch_size'])
+        # convert to incidence matrix
+        class_ids = np.array([[1 if category in self.parameter['active_classes'] else 0
+                               for category in CLASS_NAMES]], dtype=np.int32)
+        class_ids = np.repeat(class_ids, batch_size, axis=0)
+        results = []
+        for start in range(0, len(img_arrays), batch_size):
+            batch = img_arrays[start:start + batch_size]
+            LOG.info('detecting regions on %d pages', len(batch))
+            # fill up the last batch (the graph has a fixed batch size)
+            padding = [batch[-1]] * (batch_size - len(batch))
+            results.extend(self.mrcnn_model.detect(batch + padding, verbose=0,
+                                                   active_class_ids=class_ids,
+                                                   compact_masks=True)[:len(batch)])
+        return results
+
+    def _process_segment(self, page_image, page, page_xywh, page_id, input_file, mask, dpi, img_array, r):
+        import ocrolib # pulls in matplotlib
         LOG = getLogger('processor.AnybaseocrBlockSegmenter')
         # check for existing text regions and whether to overwrite them
         if page.get_TextRegion() or page.get_TableRegion():
@@ -154,15 +498,6 @@ class OcrdAnybaseocrBlockSegmenter(Processor):
             border_points = polygon_from_points(border_coords.get_points())
             border_polygon = Polygon(border_points)
 
-        LOG.info('detecting regions on page "%s"', page_id)
-        img_array = ocrolib.pil2array(page_image)
-        if len(img_array.shape) <= 2:
-            img_array = np.stack((img_array,)*3, axis=-1)
-        # convert to incidence matrix
-        class_ids = np.array([[1 if category in self.parameter['active_classes'] else 0
-                               for category in CLASS_NAMES]], dtype=np.int32)
-        results = self.mrcnn_model.detect([img_array], verbose=0, active_class_ids=class_ids)
-        r = results[0]
         LOG.info('found %d candidates on page "%s"', len(r['rois']), page_id)
 
         th = self.parameter['th']
@@ -172,45 +507,8 @@ class OcrdAnybaseocrBlockSegmenter(Processor):
             mask = ocrolib.pil2array(mask)
             mask = mask//255
             mask = 1-mask
-            # multiply all the bounding box part with 2
-            for i in range(len(r['rois'])):
-
-                min_y, min_x, max_y, max_x = r['rois'][i]
-                mask[min_y:max_y, min_x:max_x] *= i+2
-
-            # check for left over pixels and add them to the bounding boxes
-            pixel_added = True
-
-            while pixel_added:
-
-                pixel_added = False
-                left_over = np.where(mask == 1)
-                for y, x in zip(left_over[0], left_over[1]):
-                    local_mask = mask[y-th:y+th, x-th:x+th]
-                    candidates = np.where(local_mask > 1)
-                    candidates = [k for k in zip(candidates[0], candidates[1])]
-                    if len(candidates) > 0:
-                        pixel_added = True
-                        # find closest pixel with x>1
-                        candidates.sort(key=lambda j: np.sqrt((j[0]-th)**2+(j[1]-th)**2))
-                        index = local_mask[candidates[0]]-2
-
-                        # add pixel to mask/bbox
-                        # y,x to bbox with index
-                        if y < r['rois'][index][0]:
-                            r['rois'][index][0] = y
-
-                        elif y > r['rois'][index][2]:
-                            r['rois'][index][2] = y
-
-                        if x < r['rois'][index][1]:
-                            r['rois'][index][1] = x
-
-                        elif x > r['rois'][index][3]:
-                            r['rois'][index][3] = x
-
-                        # update the mask
-                        mask[y, x] = index + 2
+            # add left over pixels to the bounding boxes
+            extend_rois(mask == 1, r['rois'], th)
 
         for i in range(len(r['rois'])):
             class_id = r['class_ids'][i]
@@ -223,162 +521,24 @@ class OcrdAnybaseocrBlockSegmenter(Processor):
             # estimate glyph scale (roughly)
             scale = int(dpi / 6)
             scale = scale + (scale+1)%2 # odd
-            for i in range(len(r['rois'])):
-                mask = r['masks'][:,:,i]
-                mask = cv2.dilate(mask.astype(np.uint8),
-                                  np.ones((scale,scale), np.uint8)) > 0
-                # close mask until we have a single outer contour
-                contours = None
-                for _ in range(10):
-                    mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_CLOSE,
-                                            np.ones((scale,scale), np.uint8)) > 0
-                    contours, _ = cv2.findContours(mask.astype(np.uint8),
-                                                   cv2.RETR_EXTERNAL,
-                                                   cv2.CHAIN_APPROX_SIMPLE)
-                    if len(contours) == 1:
-                        break
-                r['polygons'].append(Polygon(contours[0][:,0,:])) # already in x,y order
+            for mask, offset in zip(r['masks'], r['mask_offsets']):
+                contour = mask_contour(mask, offset, img_array.shape[:2], scale)
+                r['polygons'].append(Polygon(contour))
 
         # to reduce overlaps, apply IoU-based non-maximum suppression
         # (and other post-processing against overlaps) across classes,
         # but not on the raw pixels, but the smoothed hull polygons
         LOG.info('post-processing detections on page "%s"', page_id)
-        worse = []
+        worse = set()
         if self.parameter['post_process']:
-            active = True
-            def _merge_rois(i, j):
-                """merges i into j"""
-                nonlocal r, active
-                r['rois'][j][0] = min(r['rois'][i][0], r['rois'][j][0])
-                r['rois'][j][1] = min(r['rois'][i][1], r['rois'][j][1])
-                r['rois'][j][2] = max(r['rois'][i][2], r['rois'][j][2])
-                r['rois'][j][3] = max(r['rois'][i][3], r['rois'][j][3])
-                r['polygons'][j] = r['polygons'][i].union(r['polygons'][j])
-                #r['scores'][j] = max(r['scores'][i], r['scores'][i])
-                active = True
-            # find overlapping pairs
-            while active:
-                active = False
-                for i in range(len(r["class_ids"])):
-                    if i in worse:
-                        continue
-                    for j in range(i + 1, len(r['class_ids'])):
-                        if j in worse:
-                            continue
-                        iclass = r['class_ids'][i]
-                        jclass = r['class_ids'][j]
-                        iname = CLASS_NAMES[iclass]
-                        jname = CLASS_NAMES[jclass]
-                        if (iname == 'drop-capital') != (jname == 'drop-capital'):
-                            # ignore drop-capital overlapping with others
-                            continue
-                        # rs todo: lower priority for footnote?
-                        if (r['rois'][i][1] > r['rois'][j][3] or
-                            r['rois'][i][3] < r['rois'][j][1] or
-                            r['rois'][i][0] > r['rois'][j][2] or
-                            r['rois'][i][2] < r['rois'][j][0]):
-                            # no overlap (cut)
-                            continue
-                        iscore = r['scores'][i]
-                        jscore = r['scores'][j]
-                        if not self.parameter['use_masks']:
-                            LOG.debug("roi %d[%s] overlaps roi %d[%s] and %s (replacing)",
-                                      i, iname, j, jname,
-                                      "looses" if iscore < jscore else "wins")
-                            if iscore < jscore:
-                                worse.append(i)
-                                break
-                            else:
-                                worse.append(j)
-                                continue
-                        # compare masks
-                        ipoly = r['polygons'][i]
-                        jpoly = r['polygons'][j]
-                        isize = ipoly.area
-                        jsize = jpoly.area
-                        inter = ipoly.intersection(jpoly).area
-                        union = ipoly.union(jpoly).area
-                        # LOG.debug("%d/%d %dpx/%dpx shared %dpx overall %dpx",
-                        #           i, j, isize, jsize, inter, union)
-                        if inter / isize > self.parameter['min_share_drop']:
-                            LOG.debug("roi %d[%s] contains roi %d[%s] (replacing)",
-                                      j, jname, i, iname)
-                            worse.append(i)
-                            break
-                        elif inter / jsize > self.parameter['min_share_drop']:
-                            LOG.debug("roi %d[%s] contains roi %d[%s] (replacing)",
-                                      i, iname, j, jname)
-                            worse.append(j)
-                        elif inter / union > self.parameter['min_iou_drop']:
-                            LOG.debug("roi %d[%s] heavily overlaps roi %d[%s] and %s (replacing)",
-                                      i, iname, j, jname,
-                                      "looses" if iscore < jscore else "wins")
-                            if iscore < jscore:
-                                worse.append(i)
-                                break
-                            else:
-                                worse.append(j)
-                        elif inter / isize > self.parameter['min_share_merge']:
-                            LOG.debug("roi %d[%s] covers roi %d[%s] (merging)",
-                                      j, jname, i, iname)
-                            worse.append(i)
-                            _merge_rois(i, j)
-                            break
-                        elif inter / jsize > self.parameter['min_share_merge']:
-                            LOG.debug("roi %d[%s] covers roi %d[%s] (merging)",
-                                      i, iname, j, jname)
-                            worse.append(j)
-                            _merge_rois(j, i)
-                        elif inter / union > self.parameter['min_iou_merge']:
-                            LOG.debug("roi %d[%s] slightly overlaps roi %d[%s] and %s (merging)",
-                                      i, iname, j, jname,
-                                      "looses" if iscore < jscore else "wins")
-                            if iscore < jscore:
-                                worse.append(i)
-                                _merge_rois(i, j)
-                                break
-                            else:
-                                worse.append(j)
-                                _merge_rois(j, i)
+            worse = suppress_overlaps(r, self.parameter['use_masks'],
+                                      self.parameter['min_share_drop'],
+                                      self.parameter['min_iou_drop'],
+                                      self.parameter['min_share_merge'],
+                                      self.parameter['min_iou_merge'])
 
         # define reading order on basis of coordinates
-        partial_order = np.zeros((len(r['rois']), len(r['rois'])), np.uint8)
-        for i, (min_y_i, min_x_i, max_y_i, max_x_i) in enumerate(r['rois']):
-            for j, (min_y_j, min_x_j, max_y_j, max_x_j) in enumerate(r['rois']):
-                if min_x_i < max_x_j and max_x_i > min_x_j:
-                    # xoverlaps
-                    if min_y_i < min_y_j:
-                        partial_order[i, j] = 1
-                else:
-                    min_y = min(min_y_i, min_y_j)
-                    max_y = max(max_y_i, max_y_j)
-                    min_x = min(min_x_i, min_x_j)
-                    max_x = max(max_x_i, max_x_j)
-                    if next((False for (min_y_k, min_x_k, max_y_k, max_x_k) in r['rois']
-                             if (min_y_k < max_y and max_y_k > min_y and
-                                 min_x_k < max_x and max_x_k > min_x)),
-                            True):
-                        # no k in between
-                        if ((min_y_j + max_y_j)/2 < min_y_i and
-                            (min_y_i + max_y_i)/2 > max_y_j):
-                            # vertically unrelated
-                            partial_order[j, i] = 1
-                        elif max_x_i < min_x_j:
-                            partial_order[i, j] = 1
-        def _topsort(po):
-            visited = np.zeros(po.shape[0], bool)
-            result = list()
-            def _visit(k):
-                if visited[k]:
-                    return
-                visited[k] = True
-                for l in np.nonzero(po[:, k])[0]:
-                    _visit(l)
-                result.append(k)
-            for k in range(po.shape[0]):
-                _visit(k)
-            return result
-        reading_order = _topsort(partial_order)
+        reading_order = compute_reading_order(r['rois'])
 
         # Creating Reading Order object in PageXML
         order_group = OrderedGroupType(caption="Regions reading order", id=page_id)
@@ -0,0 +1,31 @@
+# pylint: disable=missing-module-docstring, import-outside-toplevel
+import click
+
+from ocrd_utils import initLogging, getLogger
+
+@click.command()
+@click.argument('weights', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('-b', '--batch-size', default=1, show_default=True,
+              help="Number of pages per model run (must match the processor's batch_size)")
+@click.option('-c', '--min-confidence', default=0.5, show_default=True,
+              help="Lowest min_confidence the processor may use with the exported model")
+@click.option('--optimize/--no-optimize', default=True, show_default=True,
+              help="Optimize the graph for CPU inference (fold constants and batch normalization, fuse operators)")
+def cli(weights, output, batch_size, min_confidence, optimize):
+    """Export the block segmentation model as a frozen graph.
+
+    Reads the Keras WEIGHTS (HDF5) and writes the inference graph with all
+    weights to OUTPUT (which should end in ``.pb``). Pass OUTPUT as the
+    ``block_segmentation_weights`` parameter of ``ocrd-anybaseocr-block-segmentation``
+    to use it instead of building the Keras model.
+    """
+    initLogging()
+    from .ocrd_anybaseocr_block_segmentation import load_mrcnn
+    from ..mrcnn.export import export_frozen
+    from pkg_resources import resource_filename
+    LOG = getLogger('processor.AnybaseocrBlockSegmenter')
+    mrcnn_model = load_mrcnn(resource_filename(__name__, '../mrcnn'), weights,
+                             min_confidence, batch_size)
+    info = export_frozen(mrcnn_model, output, optimize=optimize)
+    LOG.info("exported %s to '%s'", info, output)
@@ -25,12 +25,12 @@ from shapely.geometry import Polygon
 import cv2
 from PIL import Image
 from scipy.spatial import distance_matrix
-from scipy.stats import linregress
 
 import click
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
 
 from ..constants import OCRD_TOOL
+from ..parallel import process_pages
 from ocrd import Processor
 from ocrd_modelfactory import page_from_file
 from ocrd_utils import (
@@ -216,6 +216,7 @@ class OcrdAnybaseocrCropper(Processor):
                         max_start=None, # end of allowed range (straight axis)
                         min_pos=None, # start of forbidden range (perpendicular axis)
                         max_pos=None): # end of forbidden range (perpendicular axis)
+        from scipy.stats import linregress # slow to import
         imgHeight, imgWidth, _ = arg.shape
         if not lines:
             return []
@@ -758,49 +759,44 @@ class OcrdAnybaseocrCropper(Processor):
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
+        process_pages(self)
+
+    def process_page(self, n, input_file):
         self.logger = getLogger('processor.AnybaseocrCropper')
 
-        for (n, input_file) in enumerate(self.input_files):
-            page_id = input_file.pageId or input_file.ID
-            self.logger.info("INPUT FILE %i / %s", n, page_id)
-
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-            page = pcgts.get_Page()
-            # Check for existing Border --> already cropped
-            border = page.get_Border()
-            if border:
-                left, top, right, bottom = bbox_from_points(
-                    border.get_Coords().points)
-                self.logger.warning('Overwriting existing Border: %i:%i,%i:%i',
-                                    left, top, right, bottom)
-
-            page = pcgts.get_Page()
-            page_image, page_coords, page_image_info = self.workspace.image_from_page(
-                page, page_id, # should be deskewed already
-                feature_filter='cropped,binarized,grayscale_normalized')
-            if self.parameter['dpi'] > 0:
-                zoom = 300.0/self.parameter['dpi']
-            elif page_image_info.resolution != 1:
-                dpi = page_image_info.resolution
-                if page_image_info.resolutionUnit == 'cm':
-                    dpi *= 2.54
-                self.logger.info('Page "%s" uses %f DPI', page_id, dpi)
-                zoom = 300.0/dpi
-            else:
-                zoom = 1
-
-            self._process_page(page, page_image, page_coords, input_file, zoom)
-            file_id = make_file_id(input_file, self.output_file_grp)
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
+        page_id = input_file.pageId or input_file.ID
+        self.logger.info("INPUT FILE %i / %s", n, page_id)
+
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+        page = pcgts.get_Page()
+        self.crop_page(page, page_id, input_file)
+        return pcgts
+
+    def crop_page(self, page, page_id, input_file):
+        # Check for existing Border --> already cropped
+        border = page.get_Border()
+        if border:
+            left, top, right, bottom = bbox_from_points(
+                border.get_Coords().points)
+            self.logger.warning('Overwriting existing Border: %i:%i,%i:%i',
+                                left, top, right, bottom)
+
+        page_image, page_coords, page_image_info = self.workspace.image_from_page(
+            page, page_id, # should be deskewed already
+            feature_filter='cropped,binarized,grayscale_normalized')
+        if self.parameter['dpi'] > 0:
+            zoom = 300.0/self.parameter['dpi']
+        elif page_image_info.resolution != 1:
+            dpi = page_image_info.resolution
+            if page_image_info.resolutionUnit == 'cm':
+                dpi *= 2.54
+            self.logger.info('Page "%s" uses %f DPI', page_id, dpi)
+            zoom = 300.0/dpi
+        else:
+            zoom = 1
+
+        self._process_page(page, page_image, page_coords, input_file, zoom)
 
     def _process_page(self, page, page_image, page_xywh, input_file, zoom=1.0):
         padding = self.parameter['padding']
@@ -44,11 +44,11 @@
 
 import os
 import numpy as np
-from pylab import amin,array, amax, linspace, mean, var, plot, ginput, ones, clip, imshow
-from scipy.ndimage import filters, interpolation, morphology
-from scipy import stats
-import ocrolib
+from scipy.ndimage import interpolation
 from ..constants import OCRD_TOOL
+from ..nlbin import estimate_thresholds
+from ..parallel import process_pages
+from ..imagefile import pil2array, save_image_file
 import click
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
 
@@ -68,6 +68,39 @@ from ocrd_utils import (
 
 TOOL = 'ocrd-anybaseocr-deskew'
 
+def projection_skew_estimates(image, angles):
+    """Compute the row profile variance of ``image`` for each of ``angles``.
+
+    Equivalent to ``var(mean(interpolation.rotate(image, a, order=0), axis=1))``,
+    but instead of rotating the whole image for each candidate angle, only
+    the coordinates of non-zero pixels get projected onto the rows of the
+    (reshaped) output geometry of ``rotate``, and accumulated with their
+    intensity as weight. (Forward mapping may assign a few pixels to the
+    neighbouring row, so the maximum can deviate by at most one step.)
+
+    Returns a list of (variance, angle) pairs.
+    """
+    in_shape = np.array(image.shape)
+    rows, cols = np.nonzero(image)
+    weights = image[rows, cols]
+    # coordinates relative to the rotation center
+    rows = rows - (in_shape[0] - 1) / 2
+    cols = cols - (in_shape[1] - 1) / 2
+    estimates = []
+    for a in angles:
+        c, s = np.cos(np.deg2rad(a)), np.sin(np.deg2rad(a))
+        # same output shape as interpolation.rotate(..., reshape=True)
+        rot = np.array([[c, s], [-s, c]])
+        bounds = rot @ [[0, 0, in_shape[0], in_shape[0]],
+                        [0, in_shape[1], 0, in_shape[1]]]
+        out_h, out_w = (np.ptp(bounds, axis=1) + 0.5).astype(int)
+        out_rows = np.rint(c * rows - s * cols + (out_h - 1) / 2).astype(np.intp)
+        valid = (out_rows >= 0) & (out_rows < out_h)
+        profile = np.bincount(out_rows[valid], weights=weights[valid],
+                              minlength=out_h) / out_w
+        estimates.append((np.var(profile), a))
+    return estimates
+
 class OcrdAnybaseocrDeskewer(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -75,18 +108,29 @@ class OcrdAnybaseocrDeskewer(Processor):
         kwargs['version'] = OCRD_TOOL['version']
         super(OcrdAnybaseocrDeskewer, self).__init__(*args, **kwargs)
 
+    def dshow(self, image, info, **kwargs):
+        if self.parameter['debug'] <= 0:
+            return
+        # matplotlib is slow to import, so only load it for debugging
+        import matplotlib.pyplot as plt
+        plt.imshow(image, **kwargs)
+        plt.ginput(1, self.parameter['debug'])
+
     def estimate_skew_angle(self, image, angles):
         
-        estimates = []
-        
-        for a in angles:
-            v = mean(interpolation.rotate(
-                image, a, order=0, mode='constant'), axis=1)
-            v = var(v)
-            estimates.append((v, a))
+        if self.parameter['skewmethod'] == 'projection':
+            estimates = projection_skew_estimates(image, angles)
+        else:
+            estimates = []
+            for a in angles:
+                v = np.mean(interpolation.rotate(
+                    image, a, order=0, mode='constant'), axis=1)
+                v = np.var(v)
+                estimates.append((v, a))
         if self.parameter['debug'] > 0:
-            plot([y for x, y in estimates], [x for x, y in estimates])
-            ginput(1, self.parameter['debug'])
+            import matplotlib.pyplot as plt
+            plt.plot([y for x, y in estimates], [x for x, y in estimates])
+            plt.ginput(1, self.parameter['debug'])
         _, a = max(estimates)
         return a
 
@@ -97,40 +141,55 @@ class OcrdAnybaseocrDeskewer(Processor):
 
         LOG = getLogger('OcrdAnybaseocrDeskewer')
 
-        for (n, input_file) in enumerate(self.input_files):
-            page_id = input_file.pageId or input_file.ID 
-            
-            LOG.info("INPUT FILE %i / %s", n, page_id)
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-            page = pcgts.get_Page()
-            angle = page.get_orientation()
-            if angle:
-                LOG.warning('Overwriting existing deskewing angle: %i', angle)
-            page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter='deskewed',feature_selector='binarized')
-            
-                        
-            if oplevel=="page":
-                self._process_segment(page_image, page, page_xywh, page_id, input_file, n) 
-            else:
-                LOG.warning('Operation level %s, but should be "page".', oplevel)
-                break
-            
-            file_id = make_file_id(input_file, self.output_file_grp)
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
+        if oplevel != "page":
+            LOG.warning('Operation level %s, but should be "page".', oplevel)
+            return
+        process_pages(self)
+
+    def process_page(self, n, input_file):
+        LOG = getLogger('OcrdAnybaseocrDeskewer')
+
+        page_id = input_file.pageId or input_file.ID 
+        
+        LOG.info("INPUT FILE %i / %s", n, page_id)
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+        page = pcgts.get_Page()
+        angle = page.get_orientation()
+        if angle:
+            LOG.warning('Overwriting existing deskewing angle: %i', angle)
+        page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_filter='deskewed',feature_selector='binarized')
+        
+        self._process_segment(page_image, page, page_xywh, page_id, input_file, n) 
+        return pcgts
     
     def _process_segment(self,page_image, page, page_xywh, page_id, input_file, n):                
+        page_image, angle = self.deskew_image(page_image, page_id)
+
+        page.set_orientation(angle)
+        
+        page_xywh['features'] += ',deskewed'
+        
+        file_id = make_file_id(input_file, self.output_file_grp)
+        file_path = save_image_file(self.workspace, page_image,
+                                    file_id + '-IMG',
+                                    page_id=page_id,
+                                    file_grp=self.output_file_grp,
+                                    output_format=self.parameter['output_format'],
+                                    compression=self.parameter['compression'])
+        page.add_AlternativeImage(AlternativeImageType(filename=file_path, comments=page_xywh['features']))
+
+    def deskew_image(self, page_image, page_id):
+        """Deskew and re-binarize a PIL image, returning the resulting PIL image and the skew angle.
+
+        All intermediate arrays use the floating-point type of the ``precision``
+        parameter, and arithmetic is done in-place wherever possible.
+        """
+        import ocrolib # pulls in matplotlib
         LOG = getLogger('OcrdAnybaseocrDeskewer')
-        raw = ocrolib.pil2array(page_image)
-        flat = raw.astype("float64")
+        raw = pil2array(page_image)
+        flat = raw.astype(self.parameter['precision'])
+        del raw
 
         # estimate skew angle and rotate
         if self.parameter['maxskew'] > 0:
@@ -138,15 +197,16 @@ class OcrdAnybaseocrDeskewer(Processor):
                 LOG.info("Estimating Skew Angle")
             d0, d1 = flat.shape
             o0, o1 = int(self.parameter['bignore']*d0), int(self.parameter['bignore']*d1)
-            flat = amax(flat)-flat
-            flat -= amin(flat)
+            np.subtract(np.amax(flat), flat, out=flat)
+            flat -= np.amin(flat)
             est = flat[o0:d0-o0, o1:d1-o1]
             ma = self.parameter['maxskew']
             ms = int(2*self.parameter['maxskew']*self.parameter['skewsteps'])
-            angle = self.estimate_skew_angle(est, linspace(-ma, ma, ms+1))
+            angle = self.estimate_skew_angle(est, np.linspace(-ma, ma, ms+1))
+            del est
             flat = interpolation.rotate(
                 flat, angle, mode='constant', reshape=0)
-            flat = amax(flat)-flat
+            np.subtract(np.amax(flat), flat, out=flat)
         else:
             angle = 0
 
@@ -154,38 +214,23 @@ class OcrdAnybaseocrDeskewer(Processor):
         # estimate low and high thresholds
         if self.parameter['parallel'] < 2:
             LOG.info("Estimating Thresholds")
-        d0, d1 = flat.shape
-        o0, o1 = int(self.parameter['bignore']*d0), int(self.parameter['bignore']*d1)
-        est = flat[o0:d0-o0, o1:d1-o1]
-        if self.parameter['escale'] > 0:
-            # by default, we use only regions that contain
-            # significant variance; this makes the percentile
-            # based low and high estimates more reliable
-            e = self.parameter['escale']
-            v = est-filters.gaussian_filter(est, e*20.0)
-            v = filters.gaussian_filter(v**2, e*20.0)**0.5
-            v = (v > 0.3*amax(v))
-            v = morphology.binary_dilation(
-                v, structure=ones((int(e*50), 1)))
-            v = morphology.binary_dilation(
-                v, structure=ones((1, int(e*50))))
-            if self.parameter['debug'] > 0:
-                imshow(v)
-                ginput(1, self.parameter['debug'])
-            est = est[v]
-        lo = stats.scoreatpercentile(est.ravel(), self.parameter['lo'])
-        hi = stats.scoreatpercentile(est.ravel(), self.parameter['hi'])
+        lo, hi = estimate_thresholds(flat,
+                                     bignore=self.parameter['bignore'],
+                                     escale=self.parameter['escale'],
+                                     lo=self.parameter['lo'],
+                                     hi=self.parameter['hi'],
+                                     bins=self.parameter['histbins'],
+                                     dshow=self.dshow)
 
         # rescale the image to get the gray scale image
         if self.parameter['parallel'] < 2:
             LOG.info("Rescaling")
         flat -= lo
         flat /= (hi-lo)
-        flat = clip(flat, 0, 1)
-        if self.parameter['debug'] > 0:
-            imshow(flat, vmin=0, vmax=1)
-            ginput(1, self.parameter['debug'])
-        deskewed = 1*(flat > self.parameter['threshold'])
+        np.clip(flat, 0, 1, out=flat)
+        self.dshow(flat, 'rescaled', vmin=0, vmax=1)
+        deskewed = np.array(flat > self.parameter['threshold'], 'B')
+        del flat
 
         # output the normalized grayscale and the thresholded images
         #LOG.info("%s lo-hi (%.2f %.2f) angle %4.1f" %(lo, hi, angle))
@@ -197,19 +242,9 @@ class OcrdAnybaseocrDeskewer(Processor):
         if angle is None: # FIXME: quick fix to prevent angle of "none"
             angle = 0
         
-        page.set_orientation(angle)
-        
-        page_xywh['features'] += ',deskewed'
-        bin_array = array(255*(deskewed>ocrolib.midrange(deskewed)),'B')
-        page_image = ocrolib.array2pil(bin_array)
-        
-        file_id = make_file_id(input_file, self.output_file_grp)
-        file_path = self.workspace.save_image_file(page_image,
-                               file_id + '-IMG',
-                               page_id=page_id,
-                               file_grp=self.output_file_grp
-        )        
-        page.add_AlternativeImage(AlternativeImageType(filename=file_path, comments=page_xywh['features']))
+        bin_array = np.array(deskewed > ocrolib.midrange(deskewed), 'B')
+        bin_array *= 255
+        return ocrolib.array2pil(bin_array), angle
         
         
         
@@ -7,10 +7,8 @@ import os
 from pathlib import Path
 from PIL import Image
 import click
-import torch
 import numpy as np
 
-import ocrolib
 from ocrd import Processor
 from ocrd_models.ocrd_page import to_xml, AlternativeImageType
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
@@ -24,67 +22,12 @@ from ocrd_modelfactory import page_from_file
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
 
 from ..constants import OCRD_TOOL
-from pix2pixhd.options.test_options import TestOptions
-from pix2pixhd.models.models import create_model
-from pix2pixhd.data.base_dataset import BaseDataset, get_params, get_transform
-from pix2pixhd.util.util import tensor2im
+from ..parallel import process_pages
+from ..imagefile import save_image_file
+from ..server import load_model
 
 TOOL = 'ocrd-anybaseocr-dewarp'
 
-class TestDataset(BaseDataset):
-    # adopted from pix2pixhd.data.AlignDataset for our TestOptions
-    # but with in-memory Image
-    def __init__(self, opt, images):
-        super().__init__()
-        self.opt = opt
-        self.images = images
-    def __getitem__(self, index):
-        image = self.images[index]
-        param = get_params(self.opt, image.size)
-        trans = get_transform(self.opt, param)
-        tensor = trans(image.convert('RGB'))
-        return {'label': tensor, 'path': '',
-                'inst': 0, 'image': 0, 'feat': 0}
-    def __len__(self):
-        return len(self.images) // self.opt.batchSize * self.opt.batchSize
-
-def prepare_data(opt, page_img):
-    # todo: make asynchronous (all pages for continuous quasi-parallel decoding)
-    dataset = TestDataset(opt, [page_img])
-    return torch.utils.data.DataLoader(dataset,
-                                       batch_size=opt.batchSize,
-                                       shuffle=not opt.serial_batches,
-                                       num_workers=int(opt.nThreads))
-
-def prepare_options(gpu_id, model_path, resize_or_crop, loadSize, fineSize):
-    LOG = getLogger('OcrdAnybaseocrDewarper')
-    # we cannot use TestOptions instances directly, because its parse()
-    # does some nontrivial postprocessing (which we do not want to redo here)
-    args = []
-    args.extend(['--gpu_ids', str(gpu_id)])
-    args.extend(['--nThreads', str(1)])   # test code only supports nThreads = 1
-    args.extend(['--batchSize', str(1)])  # test code only supports batchSize = 1
-    args.extend(['--serial_batches'])  # no shuffle
-    args.extend(['--no_flip'])  # no flip
-    args.extend(['--checkpoints_dir', str(model_path.parents[1])])
-    args.extend(['--name', model_path.parents[0].name])
-    args.extend(['--label_nc', str(0)]) # number of input label channels (just RGB if zero)
-    args.extend(['--no_instance']) # no instance maps as input
-    args.extend(['--resize_or_crop', resize_or_crop])
-    args.extend(['--n_blocks_global', str(10)])
-    args.extend(['--n_local_enhancers', str(2)])
-    args.extend(['--loadSize', str(loadSize)])
-    args.extend(['--fineSize', str(fineSize)])
-    args.extend(['--model', 'pix2pixHD'])
-    #args.extend(['--verbose'])
-    LOG.debug("Options passed to pix2pixHD: %s", args)
-    opt = TestOptions()
-    opt = opt.parse(args=args, save=False, silent=True)
-
-    model = create_model(opt)
-
-    return opt, model
-
 class OcrdAnybaseocrDewarper(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -96,22 +39,22 @@ class OcrdAnybaseocrDewarper(Processor):
             self.setup()
 
     def setup(self):
+        # torch and pix2pixHD only get loaded along with the model
+        # (by the model server, if running)
         LOG = getLogger('OcrdAnybaseocrDewarper')
-        if self.parameter['gpu_id'] > -1 and not torch.cuda.is_available():
-            LOG.warning("torch cannot detect CUDA installation.")
-            self.parameter['gpu_id'] = -1
-
         model_path = Path(self.resolve_resource(self.parameter['model_path']))
         if not model_path.is_file():
             LOG.error("pix2pixHD model file was not found at '%s'", model_path)
             sys.exit(1)
-        self.opt, self.model = prepare_options(
-            gpu_id=self.parameter['gpu_id'],
-            model_path=model_path,
-            resize_or_crop=self.parameter['resize_mode'],
-            loadSize=self.parameter['resize_height'],
-            fineSize=self.parameter['resize_width'],
-        )
+        self.model = load_model('ocrd_anybaseocr.pix2pixhd_model:load_dewarper',
+                                gpu_id=self.parameter['gpu_id'],
+                                model_path=str(model_path),
+                                resize_or_crop=self.parameter['resize_mode'],
+                                loadSize=self.parameter['resize_height'],
+                                fineSize=self.parameter['resize_width'],
+                                compiled=self.parameter['compiled'],
+                                precision=self.parameter['precision'],
+                                quantize=self.parameter['quantize'])
 
     def process(self):
         """Dewarp pages of the workspace via pix2pixHD (conditional GANs)
@@ -127,7 +70,14 @@ class OcrdAnybaseocrDewarper(Processor):
         Then pass the image to the preloaded pix2pixHD model for inference.
         (It will be resized and/or cropped according to ``resize_width``,
         ``resize_height`` and ``resize_mode`` prior to decoding, and the
-        result will be resized to match the original.)
+        result will be resized to match the original. Alternatively, if
+        ``tile_size`` is positive, it will be decoded at its original
+        resolution in overlapping tiles of that size, which get blended
+        across ``tile_overlap`` pixels.)
+
+        If ``compiled``, then the generator gets traced with TorchScript
+        (once, cached next to ``model_path``), optionally in reduced
+        ``precision`` or with dynamically ``quantize``d convolutions.
 
         After decoding, add the new image file to the output fileGrp for
         the same pageId (using a file ID with suffix ``.IMG-DEW``).
@@ -135,76 +85,84 @@ class OcrdAnybaseocrDewarper(Processor):
 
         Produce a new output file by serialising the resulting hierarchy.
         """
-        LOG = getLogger('OcrdAnybaseocrDewarper')
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
+        process_pages(self)
+
+    def load_page(self, n, input_file):
+        """Load the page (or region) images."""
+        LOG = getLogger('OcrdAnybaseocrDewarper')
         oplevel = self.parameter['operation_level']
-        for input_file in self.input_files:
-            page_id = input_file.pageId or input_file.ID
-            file_id = make_file_id(input_file, self.output_file_grp)
-            LOG.info("INPUT FILE %s", page_id)
-
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-            page = pcgts.get_Page()
-
-            page_image, page_xywh, _ = self.workspace.image_from_page(
-                page, page_id,
-                # images SHOULD be deskewed and cropped, and MUST be binarized
-                feature_filter='dewarped', feature_selector='binarized')
-            if oplevel == 'page':
-                self._process_segment(
-                    prepare_data(self.opt, page_image), page, page_xywh, page_image.size, 
+        page_id = input_file.pageId or input_file.ID
+        LOG.info("INPUT FILE %s", page_id)
+
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+        page = pcgts.get_Page()
+
+        page_image, page_xywh, _ = self.workspace.image_from_page(
+            page, page_id,
+            # images SHOULD be deskewed and cropped, and MUST be binarized
+            feature_filter='dewarped', feature_selector='binarized')
+        segments = []
+        if oplevel == 'page':
+            segments.append((page_image, page, page_xywh, page_image.size,
+                             input_file.pageId,
+                             make_file_id(input_file, self.output_file_grp) + '.IMG-DEW'))
+        else:
+            regions = page.get_TextRegion() + page.get_TableRegion()  # get all regions?
+            if not regions:
+                LOG.warning("Page '%s' contains no text regions", page_id)
+            for _, region in enumerate(regions):
+                region_image, region_xywh = self.workspace.image_from_segment(
+                    region, page_image, page_xywh,
+                    # images SHOULD be deskewed and cropped, and MUST be binarized
+                    feature_filter='dewarped', feature_selector='binarized')
+                segments.append((region_image, region, region_xywh, region_image.size,
                                  input_file.pageId,
-                                 make_file_id(input_file, self.output_file_grp) + '.IMG-DEW')
-            else:
-                regions = page.get_TextRegion() + page.get_TableRegion()  # get all regions?
-                if not regions:
-                    LOG.warning("Page '%s' contains no text regions", page_id)
-                for _, region in enumerate(regions):
-                    region_image, region_xywh = self.workspace.image_from_segment(
-                        region, page_image, page_xywh,
-                        # images SHOULD be deskewed and cropped, and MUST be binarized
-                        feature_filter='dewarped', feature_selector='binarized')
-                    self._process_segment(
-                        prepare_data(self.opt, region_image), region, region_xywh, region_image.size,
-                                     input_file.pageId, 
-                                     make_file_id(input_file, self.output_file_grp) + '_' + region.id + '.IMG-DEW')
-
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
-
-    def _process_segment(self, dataset, segment, coords, orig_img_size, page_id, file_id):
-        for _, data in enumerate(dataset):
-            w, h = orig_img_size
-            generated = self.model.inference(data['label'], data['inst'], data['image'])
-            #dewarped = generated.data[0].permute(1, 2, 0).detach().cpu().numpy()
-            ## convert RGB float to uint8 (clipping negative)
-            #dewarped = Image.fromarray(np.array(np.maximum(0, dewarped) * 255, dtype=np.uint8))
-            # zzz: strictly, we should try to invert the dataset's input transform here
-            dewarped = Image.fromarray(tensor2im(generated.data[0]))
+                                 make_file_id(input_file, self.output_file_grp) + '_' + region.id + '.IMG-DEW'))
+        return pcgts, segments
+
+    def predict_pages(self, states):
+        """Run the model on all segments of the loaded pages in batches."""
+        images = [segment[0] for _, segments in states for segment in segments]
+        dewarped = iter(self.model.predict(images,
+                                           batch_size=max(1, self.parameter['batch_size']),
+                                           num_workers=self.parameter['num_workers'],
+                                           tile_size=self.parameter['tile_size'],
+                                           tile_overlap=self.parameter['tile_overlap'],
+                                           num_threads=self.parameter['num_threads']))
+        results = []
+        for pcgts, segments in states:
+            results.append((pcgts, [(next(dewarped),) + segment[1:] for segment in segments]))
+        return results
+
+    def write_page(self, state):
+        """Post-process and save the dewarped images, and reference them in the segments."""
+        pcgts, segments = state
+        for segment in segments:
+            self._process_segment(*segment)
+        return pcgts
+
+    def _process_segment(self, dewarped, segment, coords, orig_img_size, page_id, file_id):
+        w, h = orig_img_size
+        # dewarped is uint8 grayscale already (only one channel to resize)
+        if dewarped.shape != (h, w):
             # resize using high-quality interpolation
-            dewarped = dewarped.resize((w, h), Image.BICUBIC)
-            # re-binarize
-            dewarped = np.array(dewarped)
-            dewarped = np.mean(dewarped, axis=2) > ocrolib.midrange(dewarped)
-            dewarped = Image.fromarray(dewarped)
-            coords['features'] += ',dewarped'
-            file_path = self.workspace.save_image_file(dewarped,
-                                                       file_id,
-                                                       page_id=page_id,
-                                                       file_grp=self.output_file_grp,
-            )
-            segment.add_AlternativeImage(AlternativeImageType(
-                filename=file_path, comments=coords['features']))
+            dewarped = np.asarray(Image.fromarray(dewarped).resize((w, h), Image.BICUBIC))
+        # re-binarize at the midrange (to a mode "1" image, saved with 1 bit per pixel)
+        threshold = (int(dewarped.min()) + int(dewarped.max())) / 2
+        dewarped = Image.fromarray(dewarped > threshold)
+        coords['features'] += ',dewarped'
+        file_path = save_image_file(self.workspace, dewarped,
+                                    file_id,
+                                    page_id=page_id,
+                                    file_grp=self.output_file_grp,
+                                    output_format=self.parameter['output_format'],
+                                    compression=self.parameter['compression'])
+        segment.add_AlternativeImage(AlternativeImageType(
+            filename=file_path, comments=coords['features']))
 
 @click.command()
 @ocrd_cli_options
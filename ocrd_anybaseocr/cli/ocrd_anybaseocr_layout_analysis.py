@@ -4,7 +4,10 @@ import numpy as np
 import warnings
 warnings.filterwarnings('ignore',category=FutureWarning) 
 from collections import defaultdict
+from contextlib import nullcontext
 from ..constants import OCRD_TOOL
+from ..pipeline import LockedWorkspace, run_pipeline
+from ..server import load_model
 
 import click
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
@@ -16,7 +19,6 @@ from ocrd_utils import getLogger, assert_file_grp_cardinality
 from ocrd_models import ocrd_mets
 
 from pathlib import Path
-import ocrolib
 from PIL import Image
 
 from lxml import etree as ET
@@ -37,10 +39,6 @@ from ocrd_models.constants import (
     METS_XML_EMPTY,
 )
 
-from ..tensorflow_importer import tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-
 TAG_METS_STRUCTLINK = '{%s}structLink' % NS['mets']
 TAG_METS_SMLINK = '{%s}smLink' % NS['mets']
 
@@ -48,6 +46,12 @@ TAG_METS_SMLINK = '{%s}smLink' % NS['mets']
 TOOL = 'ocrd-anybaseocr-layout-analysis'
 
 
+def load_keras_model(path):
+    '''load Tensorflow model from path (in graph mode)'''
+    # only load TensorFlow when processing
+    from ..tensorflow_importer import keras
+    return keras.models.load_model(path)
+
 class OcrdAnybaseocrLayoutAnalyser(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -83,7 +87,7 @@ class OcrdAnybaseocrLayoutAnalyser(Processor):
     def create_model(self, path):
         #model_name='inception_v3', def_weights=True, num_classes=34, input_size=(600, 500, 1)):
         '''load Tensorflow model from path'''
-        return load_model(path)
+        return load_model(__name__ + ':load_keras_model', path=path)
 
     def predict(self, img_array):
         # shape should be 1,600,500 for keras
@@ -220,26 +224,67 @@ class OcrdAnybaseocrLayoutAnalyser(Processor):
         self.log_map = log_map                        
 
     def process(self):
+        from ..tensorflow_importer import tf
         LOG = getLogger('OcrdAnybaseocrLayoutAnalyser')
         if not tf.test.is_gpu_available():
             LOG.error("Your system has no CUDA installed. No GPU detected.")
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
-        for input_file in self.input_files:
-            page_id = input_file.pageId or input_file.ID
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            page = pcgts.get_Page()
-            LOG.info("INPUT FILE %s", page_id)
-            page_image, page_coords, _ = self.workspace.image_from_page(page, page_id, feature_selector='binarized')
-            img_array = ocrolib.pil2array(page_image.resize((500, 600), Image.LANCZOS))
-            img_array = img_array / 255
-            img_array = img_array[np.newaxis, :, :, np.newaxis]            
-            results = self.predict(img_array)
-            LOG.info(results)
+        items = list(enumerate(self.input_files))
+        prefetch = self.parameter['prefetch']
+        if prefetch > 0:
+            # load the next pages while classifying this one
+            workspace = self.workspace
+            self.workspace = LockedWorkspace(workspace)
+            try:
+                timings = run_pipeline(items, self.load_page, self.predict_pages, self.write_page,
+                                       depth=prefetch)
+            finally:
+                self.workspace = workspace
+            LOG.info("pipeline of %d pages took %.1fs: load %.1fs, predict %.1fs (idle %.1fs), write %.1fs",
+                     len(items), timings['total'], timings['load'],
+                     timings['predict'], timings['idle'], timings['write'])
+            self.pipeline_timings = timings
+        else:
+            for n, input_file in items:
+                self.write_page(self.predict_pages([self.load_page(n, input_file)])[0])
+
+    def load_page(self, n, input_file):
+        """Load the page image and convert it to model input."""
+        import ocrolib # pulls in matplotlib
+        LOG = getLogger('OcrdAnybaseocrLayoutAnalyser')
+        page_id = input_file.pageId or input_file.ID
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        page = pcgts.get_Page()
+        LOG.info("INPUT FILE %s", page_id)
+        page_image, page_coords, _ = self.workspace.image_from_page(page, page_id, feature_selector='binarized')
+        if page_image.mode == '1':
+            # PIL resizes bilevel images without interpolation
+            page_image = page_image.convert('L')
+        img_array = ocrolib.pil2array(page_image.resize((500, 600), Image.LANCZOS))
+        img_array = img_array / 255
+        img_array = img_array[np.newaxis, :, :, np.newaxis]
+        return input_file, pcgts, img_array
+
+    def predict_pages(self, states):
+        """Classify the loaded pages."""
+        LOG = getLogger('OcrdAnybaseocrLayoutAnalyser')
+        results = []
+        for input_file, pcgts, img_array in states:
+            result = self.predict(img_array)
+            LOG.info(result)
+            results.append((input_file, pcgts, result))
+        return results
+
+    def write_page(self, state):
+        """Add the classification of the page to the logical structMap."""
+        input_file, pcgts, result = state
+        # the METS gets modified directly
+        with getattr(self.workspace, 'lock', nullcontext()):
             #self.workspace.mets.set_physical_page_for_file(input_file.pageId, input_file)
             self.create_logmap_smlink(pcgts)
-            self.write_to_mets(results, input_file.pageId)
+            self.write_to_mets(result, input_file.pageId)
 
 @click.command()
 @ocrd_cli_options
@@ -0,0 +1,145 @@
+# Combined binarization, deskewing and cropping in a single pass.
+#
+# Runs the ocrd-anybaseocr-binarize, -deskew and -crop steps on each page
+# one after the other, keeping the page image in memory between them.
+# The result is the same as running the three processors in sequence:
+# each step still annotates its AlternativeImage (and Border) and writes
+# its image and PAGE files to its own output fileGrp, but the METS and
+# PAGE are parsed only once, and no image needs to be decoded again.
+
+# Apache License 2.0
+
+import click
+
+from ocrd import Processor, Workspace
+from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
+from ocrd_modelfactory import page_from_file
+from ocrd_utils import (
+    getLogger,
+    assert_file_grp_cardinality
+)
+
+from ..constants import OCRD_TOOL
+from ..parallel import add_page, process_pages
+from .ocrd_anybaseocr_binarize import OcrdAnybaseocrBinarizer
+from .ocrd_anybaseocr_deskew import OcrdAnybaseocrDeskewer
+from .ocrd_anybaseocr_cropping import OcrdAnybaseocrCropper
+
+TOOL = 'ocrd-anybaseocr-preprocess'
+
+class ImageCachingWorkspace:
+    """Proxy to a workspace which keeps all images it saves or loads in memory.
+
+    Image extraction (``image_from_page``, ``image_from_segment``) then only
+    needs to decode each file once.
+    """
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.images = {}
+
+    def __getattr__(self, name):
+        return getattr(self.workspace, name)
+
+    def save_image_file(self, image, file_id, file_grp, **kwargs):
+        file_path = self.workspace.save_image_file(image, file_id, file_grp, **kwargs)
+        self.cache_image(file_path, image)
+        return file_path
+
+    def cache_image(self, file_path, image):
+        """Keep ``image`` as content of ``file_path`` (also used by :py:func:`~ocrd_anybaseocr.imagefile.save_image_file`)."""
+        self.images[file_path] = image
+
+    def _resolve_image_as_pil(self, image_url, coords=None):
+        if coords is not None:
+            return self.workspace._resolve_image_as_pil(image_url, coords)
+        if image_url not in self.images:
+            self.images[image_url] = self.workspace._resolve_image_as_pil(image_url)
+        # callers may annotate (but never modify) the result
+        return self.images[image_url].copy()
+
+    def image_from_page(self, *args, **kwargs):
+        return Workspace.image_from_page(self, *args, **kwargs)
+
+    def image_from_segment(self, *args, **kwargs):
+        return Workspace.image_from_segment(self, *args, **kwargs)
+
+class OcrdAnybaseocrPreprocessor(Processor):
+
+    def __init__(self, *args, **kwargs):
+        kwargs['ocrd_tool'] = OCRD_TOOL['tools'][TOOL]
+        kwargs['version'] = OCRD_TOOL['version']
+        self.stages = None
+        super(OcrdAnybaseocrPreprocessor, self).__init__(*args, **kwargs)
+
+    def setup_stages(self):
+        """Instantiate the binarizer, deskewer and cropper with their parameters."""
+        self.stages = []
+        for name, processor_class in [('binarize', OcrdAnybaseocrBinarizer),
+                                      ('deskew', OcrdAnybaseocrDeskewer),
+                                      ('crop', OcrdAnybaseocrCropper)]:
+            parameter = dict(self.parameter[name])
+            parameter.setdefault('parallel', self.parameter['parallel'])
+            self.stages.append(processor_class(None, parameter=parameter))
+        self.stages[2].logger = getLogger('processor.AnybaseocrCropper')
+
+    def process(self):
+        """Performs binarization, deskewing and cropping on the workspace in one pass.
+
+        Open and deserialize PAGE input files and their respective images,
+        then for each page, in memory:
+
+        - binarize the page image like ``ocrd-anybaseocr-binarize``
+          (with the parameters given in ``binarize``),
+        - deskew the binarized image like ``ocrd-anybaseocr-deskew``
+          (with the parameters given in ``deskew``),
+        - detect the page frame on the deskewed raw image like ``ocrd-anybaseocr-crop``
+          (with the parameters given in ``crop``).
+
+        After each step, add the new image file to the workspace along with the
+        respective output fileGrp (i.e. binarized, deskewed, cropped), reference
+        it as AlternativeImage in the Page element, and produce a new PAGE output
+        file by serialising the resulting hierarchy to the same fileGrp.
+        """
+        assert_file_grp_cardinality(self.input_file_grp, 1)
+        assert_file_grp_cardinality(self.output_file_grp, 3)
+
+        process_pages(self)
+
+    def process_page(self, n, input_file):
+        LOG = getLogger('OcrdAnybaseocrPreprocessor')
+        if self.stages is None:
+            self.setup_stages()
+        binarizer, deskewer, cropper = self.stages
+        workspace = ImageCachingWorkspace(self.workspace)
+        for stage, file_grp in zip(self.stages, self.output_file_grp.split(',')):
+            stage.workspace = workspace
+            stage.input_file_grp = self.input_file_grp
+            stage.output_file_grp = file_grp
+            stage.page_id = self.page_id
+
+        page_id = input_file.pageId or input_file.ID
+        LOG.info("INPUT FILE %i / %s", n, page_id)
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        page = pcgts.get_Page()
+
+        binarizer.add_metadata(pcgts)
+        page_image, page_xywh, _ = workspace.image_from_page(
+            page, page_id, feature_filter='binarized')
+        binarizer._process_segment(page_image, page, page_xywh, page_id, input_file, n)
+        add_page(self.workspace, input_file, pcgts, binarizer.output_file_grp)
+
+        deskewer.add_metadata(pcgts)
+        page_image, page_xywh, _ = workspace.image_from_page(
+            page, page_id, feature_filter='deskewed', feature_selector='binarized')
+        deskewer._process_segment(page_image, page, page_xywh, page_id, input_file, n)
+        add_page(self.workspace, input_file, pcgts, deskewer.output_file_grp)
+
+        cropper.add_metadata(pcgts)
+        cropper.crop_page(page, page_id, input_file)
+        return pcgts
+
+@click.command()
+@ocrd_cli_options
+def cli(*args, **kwargs):
+    return ocrd_cli_wrap_processor(OcrdAnybaseocrPreprocessor, *args, **kwargs)
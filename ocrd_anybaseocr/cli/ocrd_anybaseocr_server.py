@@ -0,0 +1,23 @@
+# pylint: disable=missing-module-docstring
+import click
+
+from ocrd_utils import initLogging, setOverrideLogLevel
+
+from ..server import serve, socket_path
+
+@click.command()
+@click.option('-s', '--socket', default=None,
+              help="Path of the Unix socket to listen on [default: $OCRD_ANYBASEOCR_SERVER or %s]" % socket_path())
+@click.option('-l', '--log-level', default='INFO',
+              type=click.Choice(['OFF', 'ERROR', 'WARN', 'INFO', 'DEBUG', 'TRACE']),
+              help="Log level")
+def cli(socket, log_level):
+    """Keep the models of the anybaseocr processors loaded between runs.
+
+    Serves the models of the block-segmentation, dewarp, layout-analysis
+    and tiseg processors (loaded on first use) to all processor runs of
+    the same user, until interrupted.
+    """
+    initLogging()
+    setOverrideLogLevel(log_level)
+    serve(socket)
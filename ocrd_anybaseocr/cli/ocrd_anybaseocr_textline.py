@@ -1,24 +1,20 @@
 import sys
 import os
 import re
+import importlib
 import glob
 from PIL import Image, ImageDraw
-import ocrolib
 from re import split
 import os.path
 import json
 import numpy as np
-import cv2
-import imageio
 from ..constants import OCRD_TOOL
-from shapely.geometry import MultiPoint
+from ..parallel import process_pages
+from ..imagefile import pil2array, save_image_file
 
 import click
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
 
-import subprocess
-
-from ocrolib import psegutils, morph, sl
 from scipy.ndimage.filters import gaussian_filter, uniform_filter, maximum_filter
 from ocrd import Processor
 from ocrd_modelfactory import page_from_file
@@ -41,6 +37,109 @@ from ocrd_models.ocrd_page import (
     
 TOOL = 'ocrd-anybaseocr-textline'
 
+class _LazyModule:
+    """Module which gets imported on first attribute access.
+
+    ocrolib pulls in matplotlib, so only import it when processing.
+    """
+    def __init__(self, name):
+        self._name = name
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+ocrolib = _LazyModule('ocrolib')
+morph = _LazyModule('ocrolib.morph')
+psegutils = _LazyModule('ocrolib.psegutils')
+sl = _LazyModule('ocrolib.sl')
+
+def fill_gaps(image, maxgap, axis=1):
+    """Set runs of at most ``maxgap`` non-1 values along ``axis`` to 1 (in-place).
+
+    Only runs which are followed by a 1 get closed. For each line, the
+    runs get found at once from the differences of the (padded) gap mask,
+    and painted via a cumulative sum of start/stop markers.
+
+    Equivalent to scanning each line and closing gaps as they end, including
+    a quirk of that scan: when a leading run is closed, its fill range
+    starts at index -1, so the last value of the line is set to 1, too,
+    which in turn closes a trailing run (if short enough).
+
+    Returns ``image``.
+    """
+    lines = np.moveaxis(image, axis, -1)
+    gap = lines != 1
+    n = gap.shape[-1]
+    if n < 2:
+        return image
+    padded = np.zeros(gap.shape[:-1] + (n + 2,), bool)
+    padded[..., 1:-1] = gap
+    edges = np.diff(padded.view(np.int8), axis=-1)
+    # starts (inclusive) and ends (exclusive) of runs, paired in line order
+    *line, start = np.nonzero(edges == 1)
+    *_, stop = np.nonzero(edges == -1)
+    line = tuple(line)
+    length = stop - start
+    closed = (stop < n) & (length <= maxgap)
+    # leading runs wrap around to the last value
+    wrapped = closed & (start == 0)
+    wrapped_lines = tuple(l[wrapped] for l in line)
+    is_wrapped = np.zeros(gap.shape[:-1], bool)
+    is_wrapped[wrapped_lines] = True
+    trailing = (stop == n) & is_wrapped[line]
+    closed |= trailing & (length - 1 <= maxgap)
+    closed_lines = tuple(l[closed] for l in line)
+    marks = np.zeros(gap.shape[:-1] + (n + 1,), np.int8)
+    marks[closed_lines + (start[closed],)] = 1
+    marks[closed_lines + (stop[closed],)] = -1
+    fill = np.cumsum(marks[..., :-1], axis=-1, dtype=np.int8) > 0
+    lines[fill] = 1
+    lines[wrapped_lines + (-1,)] = 1
+    return image
+
+def mark_line_seeds(bmarked, tmarked, delta, maxheight):
+    """Mark line seeds between baseline and xheight candidates in each column.
+
+    For each baseline candidate (true in ``bmarked``), mark ``delta`` pixels
+    above it. If the next candidate above is an xheight candidate (true in
+    ``tmarked``, or the top of the image) less than ``maxheight`` pixels
+    away, then also mark everything in between.
+
+    Instead of sorting transitions column by column, all candidates of
+    all columns get enumerated in one go as a single sorted event array
+    (by column, then from bottom to top, baselines before xheights on the
+    same row), so each baseline event can be paired with its successor at
+    once. The resulting intervals are painted via a cumulative sum of
+    start/stop markers.
+
+    Returns an int array with 1 for seeds and 0 elsewhere.
+    """
+    height, width = bmarked.shape
+    # events indexed by column, row from the bottom, and kind
+    # (nonzero enumerates them in sorted order, so no need for lexsort)
+    events = np.stack([bmarked.T[:, ::-1], tmarked.T[:, ::-1]], axis=-1)
+    # the top of each column acts as an xheight candidate, too,
+    # so each baseline has a successor within its column
+    events[:, -1, 1] = True
+    xs, ys, kinds = np.nonzero(events)
+    ys = height - 1 - ys
+    base = np.nonzero(kinds == 0)[0]
+    y0, x0 = ys[base], xs[base]
+    # seeds[y0-delta:y0] (with Python's semantics for negative start)
+    above = y0 - delta
+    above = np.where(above < 0, np.maximum(above + height, 0), above)
+    y1 = ys[base + 1]
+    between = (kinds[base + 1] == 1) & (y0 - y1 < maxheight)
+    starts = np.concatenate([above, y1[between]])
+    stops = np.concatenate([y0, y0[between]])
+    cols = np.concatenate([x0, x0[between]])
+    valid = starts < stops
+    size = (height + 1) * width
+    marks = (np.bincount(starts[valid] * width + cols[valid], minlength=size) -
+             np.bincount(stops[valid] * width + cols[valid], minlength=size))
+    marks = marks.reshape(height + 1, width)
+    np.cumsum(marks, axis=0, out=marks)
+    return np.array(marks[:-1] > 0, 'i')
+
 class OcrdAnybaseocrTextline(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -60,48 +159,40 @@ class OcrdAnybaseocrTextline(Processor):
             F.write(d)    
     
     def process(self):
-        LOG = getLogger('OcrdAnybaseocrTextline')
-
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
+        process_pages(self)
+
+    def process_page(self, n, input_file):
+        LOG = getLogger('OcrdAnybaseocrTextline')
+
         oplevel = self.parameter['operation_level']
         
-        for (n, input_file) in enumerate(self.input_files):
-            page_id = input_file.pageId or input_file.ID
-            
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-            page = pcgts.get_Page()
-            LOG.info("INPUT FILE %s", input_file.pageId or input_file.ID)
-            
-            page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_selector='binarized,deskewed')
-            
-            if oplevel == 'page':
-                LOG.warning("Operation level should be region.")
-                self._process_segment(page_image, page,None, page_xywh, page_id, input_file, n)
-                
-            else:
-                regions = page.get_TextRegion()
-                if not regions:
-                    LOG.warning("Page '%s' contains no text regions", page_id)
-                    continue
-                for (k, region) in enumerate(regions):
-                                       
-                    region_image, region_xywh = self.workspace.image_from_segment(region, page_image, page_xywh)
+        page_id = input_file.pageId or input_file.ID
         
-                    self._process_segment(region_image, page, region, region_xywh, region.id, input_file, k)
-
-            file_id = make_file_id(input_file, self.output_file_grp)
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8')
-            )
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+        page = pcgts.get_Page()
+        LOG.info("INPUT FILE %s", input_file.pageId or input_file.ID)
+        
+        page_image, page_xywh, page_image_info = self.workspace.image_from_page(page, page_id, feature_selector='binarized,deskewed')
+        
+        if oplevel == 'page':
+            LOG.warning("Operation level should be region.")
+            self._process_segment(page_image, page,None, page_xywh, page_id, input_file, n)
+            
+        else:
+            regions = page.get_TextRegion()
+            if not regions:
+                LOG.warning("Page '%s' contains no text regions", page_id)
+                return None
+            for (k, region) in enumerate(regions):
+                                   
+                region_image, region_xywh = self.workspace.image_from_segment(region, page_image, page_xywh)
+    
+                self._process_segment(region_image, page, region, region_xywh, region.id, input_file, k)
+        return pcgts
 
     def _process_segment(self, page_image, page, textregion, region_xywh, page_id, input_file, n):
         LOG = getLogger('OcrdAnybaseocrTextline')
@@ -114,7 +205,7 @@ class OcrdAnybaseocrTextline(Processor):
                 LOG.warning('keeping existing TextLines in region "%s"', page_id)
                 return
         
-        binary = ocrolib.pil2array(page_image)
+        binary = pil2array(page_image)
 
         
         if len(binary.shape) > 2:
@@ -174,11 +265,12 @@ class OcrdAnybaseocrTextline(Processor):
             img = ocrolib.array2pil(img)
            
             file_id = make_file_id(input_file, self.output_file_grp)
-            file_path = self.workspace.save_image_file(img,
-                                   file_id+"_"+str(n)+"_"+str(i),
-                                   page_id=page_id,
-                                   file_grp=self.output_file_grp
-            )
+            file_path = save_image_file(self.workspace, img,
+                                        file_id+"_"+str(n)+"_"+str(i),
+                                        page_id=page_id,
+                                        file_grp=self.output_file_grp,
+                                        output_format=self.parameter['output_format'],
+                                        compression=self.parameter['compression'])
             ai = AlternativeImageType(filename=file_path, comments=region_xywh['features'])
             line_id = '%s_line%04d' % (page_id, i)
             line = TextLineType(custom='readingOrder {index:'+str(i)+';}', id=line_id, Coords=CoordsType(line_points))
@@ -249,18 +341,8 @@ class OcrdAnybaseocrTextline(Processor):
 
         x = (1-thresh)*(1-grad1)
         thresh11 = (1-thresh)*x
-        
-        for r in range(0, len(thresh11)):
-            count = 0
-            for c in range(0, len(thresh11[0])):
-                if(thresh11[r][c] == 1):
-                    continue
-                count += 1
-                if(c != len(thresh11[0])-1 and thresh11[r][c+1] == 1):
-                    if(count <= 50):
-                        for z in range(c-count, c+1):
-                            thresh11[r][z] = 1
-                    count = 0
+        # close horizontal gaps
+        fill_gaps(thresh11, 50, axis=1)
 
         y = 1-(thresh11*(1-thresh))
         
@@ -275,38 +357,13 @@ class OcrdAnybaseocrTextline(Processor):
         seps1 = 1-seps1
     
         seps1 = (grad)*seps1
-    
-        for c in range(0, len(seps1[0])):
-            count = 0
-            for r in range(0, len(seps1)):
-                if(seps1[r][c] == 1):
-                    continue
-                count += 1
-                if(r != len(seps1)-1 and seps1[r+1][c] == 1):
-                    if(count <= 400):  # by making it 300 u can improve
-                        for z in range(r-count, r+1):
-                            seps1[z][c] = 1
-                    count = 0
-
+        # close vertical gaps
+        fill_gaps(seps1, 400, axis=0) # by making it 300 u can improve
     
         seps1 = morph.select_regions(seps1, sl.dim0, min=self.parameter['csminheight']*scale, nbest=self.parameter['maxcolseps']+10)
         seps1 = (seps1*(1-y))+seps1
-        for c in range(0, len(seps1[0])):
-            for r in range(0, len(seps1)):
-                if(seps1[r][c] != 0):
-                    seps1[r][c] = 1
-
-        for c in range(0, len(seps1[0])):
-            count = 0
-            for r in range(0, len(seps1)):
-                if(seps1[r][c] == 1):
-                    continue
-                count += 1
-                if(r != len(seps1)-1 and seps1[r+1][c] == 1):
-                    if(count <= 350):
-                        for z in range(r-count, r+1):
-                            seps1[z][c] = 1
-                    count = 0
+        seps1[seps1 != 0] = 1
+        fill_gaps(seps1, 350, axis=0)
 
         return seps1
 
@@ -358,20 +415,8 @@ class OcrdAnybaseocrTextline(Processor):
         tmarked = maximum_filter(top == maximum_filter(top, (vrange, 0)), (2, 2))
         tmarked *= np.array((top > t*np.amax(top)*t/2)*(1-colseps), dtype=bool)
         tmarked = maximum_filter(tmarked, (1, 20))
-        testseeds = np.zeros(binary.shape, 'i')
-        seeds = np.zeros(binary.shape, 'i')
         delta = max(3, int(scale/2))
-        for x in range(bmarked.shape[1]):
-            transitions = sorted([(y, 1) for y in psegutils.find(bmarked[:, x])]+[(y, 0) for y in psegutils.find(tmarked[:, x])])[::-1]
-            transitions += [(0, 0)]
-            for l in range(len(transitions)-1):
-                y0, s0 = transitions[l]
-                if s0 == 0:
-                    continue
-                seeds[y0-delta:y0, x] = 1
-                y1, s1 = transitions[l+1]
-                if s1 == 0 and (y0-y1) < 5*scale:
-                    seeds[y1:y0, x] = 1
+        seeds = mark_line_seeds(bmarked, tmarked, delta, 5*scale)
         seeds = maximum_filter(seeds, (1, int(1+scale)))
         seeds *= (1-colseps)
         seeds, _ = morph.label(seeds)
@@ -8,7 +8,6 @@
 # URL - https://www.dfki.de/fileadmin/user_upload/import/9512_ICDAR2017_anyOCR.pdf
 
 
-import copy
 import json
 import os
 from pathlib import Path
@@ -18,9 +17,6 @@ import click
 from PIL import Image
 from scipy import ndimage
 import numpy as np
-import shapely
-import ocrolib
-from tensorflow.keras.models import load_model
 #from keras_segmentation.models.unet import resnet50_unet
 from ocrd import Processor
 from ocrd_modelfactory import page_from_file
@@ -36,9 +32,25 @@ from ocrd_utils import (
 )
 from ocrd.decorators import ocrd_cli_options, ocrd_cli_wrap_processor
 from ..constants import OCRD_TOOL
+from ..parallel import process_pages
+from ..imagefile import pil2array, save_image_file
+from ..server import load_model
+from ..morphology import (
+    seedfill_binary,
+    pack_binary,
+    unpack_binary,
+    reduce_rank_binary2,
+    expand_replicate_binary,
+)
 
 TOOL = 'ocrd-anybaseocr-tiseg'
 
+def load_segmentation_model(path):
+    """Load the Keras segmentation model from ``path`` (in eager mode)."""
+    # only load TensorFlow when needed
+    from tensorflow.keras.models import load_model as load_keras_model
+    return load_keras_model(path)
+
 class OcrdAnybaseocrTiseg(Processor):
 
     def __init__(self, *args, **kwargs):
@@ -53,59 +65,67 @@ class OcrdAnybaseocrTiseg(Processor):
         LOG = getLogger('OcrdAnybaseocrTiseg')
         self.model = None
         if self.parameter['use_deeplr']:
-
             model_weights = self.resolve_resource(self.parameter['seg_weights'])
             #model = resnet50_unet(n_classes=self.parameter['classes'], input_height=self.parameter['height'], input_width=self.parameter['width'])
             #model.load_weights(model_weights)
-            self.model = load_model(model_weights)
+            self.model = load_model(__name__ + ':load_segmentation_model', path=str(model_weights))
             LOG.info('Loaded segmentation model')
             
     def process(self):
-        LOG = getLogger('OcrdAnybaseocrTiseg')
-
         assert_file_grp_cardinality(self.input_file_grp, 1)
         assert_file_grp_cardinality(self.output_file_grp, 1)
 
-        for input_file in self.input_files:
-            page_id = input_file.pageId or input_file.ID
-
-            pcgts = page_from_file(self.workspace.download_file(input_file))
-            self.add_metadata(pcgts)
-
-            page = pcgts.get_Page()
-            LOG.info("INPUT FILE %s", input_file.pageId or input_file.ID)
-
-            if self.parameter['use_deeplr']:
-                kwargs = {'feature_filter': 'binarized,deskewed,cropped'}
-            else:
-                # _should_ also be deskewed and cropped, but no need to enforce that here
-                kwargs = {'feature_selector': 'binarized'}
-            page_image, page_coords, page_image_info = self.workspace.image_from_page(
-                page, page_id, **kwargs)
-
-            self._process_segment(page, page_image, page_coords, page_id, input_file)
-
-            file_id = make_file_id(input_file, self.output_file_grp)
-            pcgts.set_pcGtsId(file_id)
-            self.workspace.add_file(
-                ID=file_id,
-                file_grp=self.output_file_grp,
-                pageId=input_file.pageId,
-                mimetype=MIMETYPE_PAGE,
-                local_filename=os.path.join(self.output_file_grp, file_id + '.xml'),
-                content=to_xml(pcgts).encode('utf-8'),
-            )
-
-    def _process_segment(self, page, page_image, page_coords, page_id, input_file):
+        process_pages(self)
+
+    def load_page(self, n, input_file):
+        """Load the page image and convert it to model input."""
         LOG = getLogger('OcrdAnybaseocrTiseg')
+        page_id = input_file.pageId or input_file.ID
 
-        if self.model:
+        pcgts = page_from_file(self.workspace.download_file(input_file))
+        self.add_metadata(pcgts)
+
+        page = pcgts.get_Page()
+        LOG.info("INPUT FILE %s", input_file.pageId or input_file.ID)
+
+        if self.parameter['use_deeplr']:
+            kwargs = {'feature_filter': 'binarized,deskewed,cropped'}
+        else:
+            # _should_ also be deskewed and cropped, but no need to enforce that here
+            kwargs = {'feature_selector': 'binarized'}
+        page_image, page_coords, page_image_info = self.workspace.image_from_page(
+            page, page_id, **kwargs)
 
-            I = ocrolib.pil2array(page_image.resize((800, 1024), Image.LANCZOS))
+        if self.model:
+            if page_image.mode == '1':
+                # PIL resizes bilevel images without interpolation
+                page_image = page_image.convert('L')
+            I = pil2array(page_image.resize((800, 1024), Image.LANCZOS))
             I = np.array(I)[np.newaxis, :, :, :]
             LOG.info('I shape %s', I.shape)
             if len(I.shape)<3:
                 print('Wrong input shape. Image should have 3 channel')
+        else:
+            I = pil2array(page_image)
+
+            if len(I.shape) > 2:
+                I = np.mean(I, 2)
+            I = 1-I/I.max()
+        return pcgts, page, page_image, page_coords, page_id, input_file, I
+
+    def predict_pages(self, states):
+        """Segment the loaded pages into non-text and text parts."""
+        return [state[:-1] + self._segment(state[-1]) for state in states]
+
+    def write_page(self, state):
+        """Save the non-text and text images and reference them in the page."""
+        self._process_segment(*state[1:])
+        return state[0]
+
+    def _segment(self, I):
+        LOG = getLogger('OcrdAnybaseocrTiseg')
+
+        if self.model:
 
             # get prediction
             #out = self.model.predict_segmentation(
@@ -123,18 +143,7 @@ class OcrdAnybaseocrTiseg(Processor):
             image_part[np.where(out==2)] = 0
             LOG.info('image: %d percent', 100 * (1 - np.count_nonzero(image_part) / np.prod(out.shape)))
 
-            image_part = ocrolib.array2pil(image_part)
-            text_part = ocrolib.array2pil(text_part)
-
-            image_part = image_part.resize(page_image.size, Image.BICUBIC)
-            text_part = text_part.resize(page_image.size, Image.BICUBIC)
-
         else:
-            I = ocrolib.pil2array(page_image)
-
-            if len(I.shape) > 2:
-                I = np.mean(I, 2)
-            I = 1-I/I.max()
             rows, cols = I.shape
 
             # Generate Mask and Seed Images
@@ -151,92 +160,74 @@ class OcrdAnybaseocrTiseg(Processor):
             Iseedfill = self.expansion(Iseedfill, (rows, cols))
 
             # Write Text and Non-Text images
-            image_part = np.array(255*(1-I*Iseedfill), dtype='B')
-            text_part = np.array(255*(1-I*(1-Iseedfill)), dtype='B')
+            ink = np.array(255*(1-I), dtype='B')
+            image_part = np.where(Iseedfill, ink, np.uint8(255))
+            text_part = np.where(Iseedfill, np.uint8(255), ink)
             LOG.info('text: %d percent', 100 * (1 - np.count_nonzero(text_part) / np.prod(I.shape)))
             LOG.info('image: %d percent', 100 * (1 - np.count_nonzero(image_part) / np.prod(I.shape)))
 
-            image_part = ocrolib.array2pil(image_part)
-            text_part = ocrolib.array2pil(text_part)
+        return image_part, text_part
+
+    def _process_segment(self, page, page_image, page_coords, page_id, input_file, image_part, text_part):
+        import ocrolib # pulls in matplotlib
+        image_part = ocrolib.array2pil(image_part)
+        text_part = ocrolib.array2pil(text_part)
+        if self.model:
+            image_part = image_part.resize(page_image.size, Image.BICUBIC)
+            text_part = text_part.resize(page_image.size, Image.BICUBIC)
 
         file_id = make_file_id(input_file, self.output_file_grp)
-        file_path = self.workspace.save_image_file(image_part,
-                                   file_id+"_img",
-                                   page_id=input_file.pageId,
-                                   file_grp=self.output_file_grp,
-            )
+        file_path = save_image_file(self.workspace, image_part,
+                                    file_id+"_img",
+                                    page_id=input_file.pageId,
+                                    file_grp=self.output_file_grp,
+                                    output_format=self.parameter['output_format'],
+                                    compression=self.parameter['compression'])
         page.add_AlternativeImage(AlternativeImageType(
             filename=file_path, comments=page_coords['features'] + ',non_text'))
 
-        file_path = self.workspace.save_image_file(text_part,
-                                   file_id+"_txt",
-                                   page_id=input_file.pageId,
-                                   file_grp=self.output_file_grp,
-            )
+        file_path = save_image_file(self.workspace, text_part,
+                                    file_id+"_txt",
+                                    page_id=input_file.pageId,
+                                    file_grp=self.output_file_grp,
+                                    output_format=self.parameter['output_format'],
+                                    compression=self.parameter['compression'])
         page.add_AlternativeImage(AlternativeImageType(
             filename=file_path, comments=page_coords['features'] + ',clipped'))
 
     def pixMorphSequence_mask_seed_fill_holes(self, I):
-        Imask = self.reduction_T_1(I)
-        Imask = self.reduction_T_1(Imask)
+        # reduce and expand bit-packed (8 pixels per byte)
+        Imask = reduce_rank_binary2(pack_binary(I), 1)
+        Imask = reduce_rank_binary2(Imask, 1)
+        Imask = unpack_binary(Imask, I.shape[1] // 4)
         Imask = ndimage.binary_fill_holes(Imask)
-        Iseed = self.reduction_T_4(Imask)
-        Iseed = self.reduction_T_3(Iseed)
+        Iseed = reduce_rank_binary2(pack_binary(Imask), 4)
+        Iseed = reduce_rank_binary2(Iseed, 3)
+        width = Imask.shape[1] // 4
+        Iseed = unpack_binary(Iseed, width)
         mask = np.array(np.ones((5, 5)), dtype=int)
         Iseed = ndimage.binary_opening(Iseed, mask)
         Iseed = self.expansion(Iseed, Imask.shape)
         return Imask, Iseed
 
     def pixSeedfillBinary(self, Imask, Iseed):
-        Iseedfill = copy.deepcopy(Iseed)
-        s = np.ones((3, 3))
-        Ijmask, k = ndimage.label(Imask, s)
-        Ijmask2 = Ijmask * Iseedfill
-        A = list(np.unique(Ijmask2))
-        A.remove(0)
-        for i in range(0, len(A)):
-            x, y = np.where(Ijmask == A[i])
-            Iseedfill[x, y] = 1
-        return Iseedfill
+        return seedfill_binary(Imask, Iseed)
 
     def reduction_T_1(self, I):
-        A = np.logical_or(I[0:-1:2, :], I[1::2, :])
-        A = np.logical_or(A[:, 0:-1:2], A[:, 1::2])
-        return A
+        return unpack_binary(reduce_rank_binary2(pack_binary(I), 1), I.shape[1] // 2)
 
     def reduction_T_2(self, I):
-        A = np.logical_or(I[0:-1:2, :], I[1::2, :])
-        A = np.logical_and(A[:, 0:-1:2], A[:, 1::2])
-        B = np.logical_and(I[0:-1:2, :], I[1::2, :])
-        B = np.logical_or(B[:, 0:-1:2], B[:, 1::2])
-        C = np.logical_or(A, B)
-        return C
+        return unpack_binary(reduce_rank_binary2(pack_binary(I), 2), I.shape[1] // 2)
 
     def reduction_T_3(self, I):
-        A = np.logical_or(I[0:-1:2, :], I[1::2, :])
-        A = np.logical_and(A[:, 0:-1:2], A[:, 1::2])
-        B = np.logical_and(I[0:-1:2, :], I[1::2, :])
-        B = np.logical_or(B[:, 0:-1:2], B[:, 1::2])
-        C = np.logical_and(A, B)
-        return C
+        return unpack_binary(reduce_rank_binary2(pack_binary(I), 3), I.shape[1] // 2)
 
     def reduction_T_4(self, I):
-        A = np.logical_and(I[0:-1:2, :], I[1::2, :])
-        A = np.logical_and(A[:, 0:-1:2], A[:, 1::2])
-        return A
+        return unpack_binary(reduce_rank_binary2(pack_binary(I), 4), I.shape[1] // 2)
 
     def expansion(self, I, rows_cols):
-        r, c = I.shape
-        rows, cols = rows_cols
-        A = np.zeros((rows, cols))
-        A[0:4*r:4, 0:4*c:4] = I
-        A[1:4*r:4, :] = A[0:4*r:4, :]
-        A[2:4*r:4, :] = A[0:4*r:4, :]
-        A[3:4*r:4, :] = A[0:4*r:4, :]
-        A[:, 1:4*c:4] = A[:, 0:4*c:4]
-        A[:, 2:4*c:4] = A[:, 0:4*c:4]
-        A[:, 3:4*c:4] = A[:, 0:4*c:4]
-        return A
+        return unpack_binary(expand_replicate_binary(pack_binary(I), I.shape[1], rows_cols),
+                             rows_cols[1])
 
     def alpha_shape(self, coords, alpha):
         import shapely.geometry as geometry
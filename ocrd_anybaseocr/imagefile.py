@@ -0,0 +1,102 @@
+"""Encoding of derived images, and decoding of input images as arrays.
+
+Most derived images (binarized, deskewed, dewarped, line and
+text/non-text images) only have two levels, but PNG files with 8 bit
+per pixel are large and slow to compress (and to decompress by the next
+processor). So :py:func:`save_image_file` can instead write them as
+bilevel (mode ``1``) images, either as PNG with 1 bit per pixel, or as
+TIFF with CCITT Group 4 compression, depending on the ``output_format``:
+
+- ``png``: as PNG, in the mode of the image (as before),
+- ``png-1bit``: as PNG with 1 bit per pixel,
+- ``tiff-g4``: as TIFF with CCITT Group 4 compression.
+
+For the bilevel formats, images get thresholded at 50% gray (which is
+lossless for images with only black and white pixels).
+
+On the input side, :py:func:`pil2array` converts images to arrays without
+converting bilevel images to 8 bit in PIL first.
+"""
+
+import io
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from ocrd_utils import MIME_TO_EXT
+
+__all__ = ['OUTPUT_FORMATS', 'encode_image', 'save_image_file', 'pil2array']
+
+# output format: (mimetype, bilevel)
+OUTPUT_FORMATS = {
+    'png': ('image/png', False),
+    'png-1bit': ('image/png', True),
+    'tiff-g4': ('image/tiff', True),
+}
+
+def encode_image(image, output_format='png', compression=6):
+    """Serialise ``image`` in ``output_format`` (one of :py:data:`OUTPUT_FORMATS`).
+
+    ``compression`` is the zlib level of PNG output (0 to 9, where 1 is
+    fastest and 9 smallest).
+
+    Returns the file content and its mimetype.
+    """
+    return _encode(_convert(image, output_format), output_format, compression)
+
+def _convert(image, output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("output format must be one of %s, not '%s'" % (
+            list(OUTPUT_FORMATS), output_format))
+    if OUTPUT_FORMATS[output_format][1] and image.mode != '1':
+        # threshold instead of dithering
+        image = image.convert('L').point(lambda x: 255 if x >= 128 else 0, mode='1')
+    return image
+
+def _encode(image, output_format, compression):
+    mimetype = OUTPUT_FORMATS[output_format][0]
+    image_bytes = io.BytesIO()
+    if mimetype == 'image/tiff':
+        image.save(image_bytes, format='TIFF', compression='group4')
+    else:
+        image.save(image_bytes, format='PNG', compress_level=compression)
+    return image_bytes.getvalue(), mimetype
+
+def save_image_file(workspace, image, file_id, file_grp, page_id=None,
+                    output_format='png', compression=6, force=False):
+    """Like :py:meth:`ocrd.Workspace.save_image_file`, but with :py:func:`encode_image`.
+
+    If ``workspace`` has a ``cache_image`` method, then pass it the file
+    path and image (as converted for the output format).
+
+    Returns the path of the new file.
+    """
+    image = _convert(image, output_format)
+    content, mimetype = _encode(image, output_format, compression)
+    file_path = str(Path(file_grp, '%s%s' % (file_id, MIME_TO_EXT[mimetype])))
+    workspace.add_file(file_grp,
+                       ID=file_id,
+                       pageId=page_id,
+                       local_filename=file_path,
+                       mimetype=mimetype,
+                       content=content,
+                       force=force or getattr(workspace, 'overwrite_mode', False))
+    if hasattr(workspace, 'cache_image'):
+        workspace.cache_image(file_path, image)
+    return file_path
+
+def pil2array(image):
+    """Convert ``image`` to a uint8 array, like :py:func:`ocrolib.pil2array`.
+
+    Bilevel images become 0 and 255 without an intermediate 8 bit image.
+    """
+    if image.mode == '1':
+        array = np.asarray(image).astype(np.uint8)
+        array *= 255
+        return array
+    if image.mode in ('L', 'RGB'):
+        return np.array(image)
+    if image.mode == 'RGBA':
+        return np.array(image)[:, :, :3]
+    return np.array(image.convert('L'))
@@ -0,0 +1,137 @@
+# Binary morphology routines (after Leptonica), used by the
+# text/image segmentation component.
+
+# Apache License 2.0
+
+import numpy as np
+from scipy import ndimage
+
+__all__ = [
+    'seedfill_binary',
+    'pack_binary',
+    'unpack_binary',
+    'reduce_rank_binary2',
+    'expand_replicate_binary',
+]
+
+def seedfill_binary(mask, seed, connectivity=8):
+    """Fill all connected components of ``mask`` which intersect ``seed``.
+
+    Equivalent to Leptonica's ``pixSeedfillBinary`` (i.e. morphological
+    reconstruction by dilation of ``seed`` under ``mask``), united with
+    ``seed`` itself. Instead of reconstructing iteratively or scanning the
+    whole image once per seeded component, label ``mask`` once, mark the
+    labels hit by any seed pixel in a lookup table, and map the labels
+    through that table, so time is linear in the number of pixels
+    (regardless of the number of components).
+
+    ``connectivity`` is either 4 or 8. Neither input gets modified.
+
+    Returns a boolean array.
+    """
+    if connectivity == 8:
+        structure = np.ones((3, 3), bool)
+    elif connectivity == 4:
+        structure = ndimage.generate_binary_structure(2, 1)
+    else:
+        raise ValueError("connectivity must be 4 or 8, not %r" % connectivity)
+    seed = seed != 0
+    labels, count = ndimage.label(mask, structure)
+    seeded = np.zeros(count + 1, bool)
+    seeded[labels[seed]] = True
+    seeded[0] = False
+    fill = seeded[labels]
+    fill |= seed
+    return fill
+
+# Bit-packed binary images: 8 pixels per byte along each row
+# (most significant bit first), as produced by np.packbits(image, axis=1).
+# Bits beyond the actual width of the image are not guaranteed to be 0,
+# so the width has to be passed explicitly when unpacking.
+
+def _pairs_table(op):
+    """For each byte value, the 4 bits from ``op`` on its adjacent bit pairs."""
+    values = np.arange(256, dtype=np.uint8)
+    table = np.zeros(256, np.uint8)
+    for pair in range(4):
+        high = (values >> (7 - 2 * pair)) & 1
+        low = (values >> (6 - 2 * pair)) & 1
+        table |= op(high, low) << (3 - pair)
+    return table
+
+_PAIRS_OR = _pairs_table(np.bitwise_or)
+_PAIRS_AND = _pairs_table(np.bitwise_and)
+
+def _replicate4_table():
+    """For each byte value, the 4 bytes with each of its bits repeated 4 times."""
+    bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1)
+    return np.packbits(np.repeat(bits, 4, axis=1), axis=1)
+
+_REPLICATE4 = _replicate4_table()
+
+def pack_binary(image):
+    """Pack the non-zero pixels of a 2D ``image`` into bits along its rows."""
+    return np.packbits(np.asarray(image) != 0, axis=1)
+
+def unpack_binary(packed, width):
+    """Unpack the first ``width`` bits of each row of ``packed`` into a boolean image."""
+    return np.unpackbits(packed, axis=1, count=width).view(bool)
+
+def _reduce_pairs(packed, table):
+    # horizontal: 2 bytes (16 pixels) become 1 byte (8 pixels)
+    if packed.shape[1] % 2:
+        packed = np.pad(packed, ((0, 0), (0, 1)))
+    reduced = table[packed[:, 0::2]]
+    reduced <<= 4
+    reduced |= table[packed[:, 1::2]]
+    return reduced
+
+def reduce_rank_binary2(packed, level):
+    """Reduce a bit-packed image by 2x in both directions by rank thresholding.
+
+    Like Leptonica's ``pixReduceRankBinary2``, each 2x2 block of pixels
+    becomes one pixel, which is set if at least ``level`` (1 to 4) of
+    the block's pixels are set. Rows are combined bytewise, columns
+    8 pixels at a time via lookup tables. (As in the unpacked
+    ``reduction_T_*``, a trailing odd row or column gets discarded.)
+
+    Returns the packed reduced image.
+    """
+    top, bottom = packed[0:-1:2], packed[1::2]
+    if level == 1:
+        return _reduce_pairs(top | bottom, _PAIRS_OR)
+    if level == 4:
+        return _reduce_pairs(top & bottom, _PAIRS_AND)
+    if level not in (2, 3):
+        raise ValueError("level must be 1, 2, 3 or 4, not %r" % level)
+    # at least 2 (or 3) of 4 iff either both columns of the block
+    # have at least 1 pixel, or/and one column has 2 pixels
+    across = _reduce_pairs(top | bottom, _PAIRS_AND)
+    along = _reduce_pairs(top & bottom, _PAIRS_OR)
+    if level == 2:
+        return across | along
+    return across & along
+
+def expand_replicate_binary(packed, width, shape):
+    """Expand a bit-packed image of ``width`` columns by 4x in both directions.
+
+    Like Leptonica's ``pixExpandReplicate`` with factor 4, each pixel
+    becomes a block of 4x4 pixels (each byte 4 bytes via a lookup table).
+    The result is cut or padded with zeros to ``shape`` (in pixels),
+    like the unpacked ``expansion``.
+
+    Returns the packed expanded image.
+    """
+    rows, cols = shape
+    height = min(4 * len(packed), rows)
+    width = min(4 * width, cols)
+    expanded = np.zeros((rows, (cols + 7) // 8), np.uint8)
+    if height and width:
+        columns = (width + 7) // 8
+        replicated = _REPLICATE4[packed[:(height + 3) // 4]]
+        replicated = replicated.reshape(len(replicated), -1)[:, :columns]
+        if width % 8:
+            # clear the bits beyond the expanded width
+            replicated[:, -1] &= np.uint8(0xff << (8 - width % 8) & 0xff)
+        expanded[:height, :columns] = np.repeat(replicated, 4, axis=0)[:height]
+    return expanded
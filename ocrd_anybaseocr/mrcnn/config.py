@@ -131,6 +131,11 @@ class Config(object):
     # the width and height, or more, even if MIN_IMAGE_DIM doesn't require it.
     # However, in 'square' mode, it can be overruled by IMAGE_MAX_DIM.
     IMAGE_MIN_SCALE = 0
+    # In inference, resize uint8 images with area interpolation (OpenCV)
+    # directly into a float32 input buffer, which is reused across calls,
+    # instead of resizing in float64 and molding each image separately.
+    # Only for the "square" mode.
+    IMAGE_RESIZE_FAST = False
     # Number of color channels per image. RGB = 3, grayscale = 1, RGB-D = 4
     # Changing this requires other changes in the code. See the WIKI for more
     # details: https://github.com/matterport/Mask_RCNN/wiki
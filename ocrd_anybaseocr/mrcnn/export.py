@@ -0,0 +1,248 @@
+"""
+Mask R-CNN
+Export of the inference model as a frozen (and optimized) TensorFlow graph.
+
+Building the Keras model and loading its HDF5 weights takes long, and
+the graph as built still contains training-time structure (variables,
+unfolded batch normalization). :py:func:`export_frozen` instead writes
+a single GraphDef file with all weights as constants, which can be
+optimized for CPU inference (constant folding, batch normalization
+folded into the convolutions, fused operators) and optionally gets its
+weights quantized (to float16 or 8 bit, which mostly reduces file size
+and memory traffic, while computation stays float32). Quantization is
+experimental (and not offered by ``ocrd-anybaseocr-block-segmentation-export``):
+its effect on the detections of the trained model has not been measured yet.
+
+:py:class:`FrozenMaskRCNN` loads such a file and provides the same
+``detect`` as :py:class:`~ocrd_anybaseocr.mrcnn.model.MaskRCNN` in
+inference mode. The graph has a fixed batch size, and its minimum
+detection confidence is the lowest usable one (higher ones get applied
+by filtering the results, which is equivalent, since both non-maximum
+suppression and the limit on detections proceed by descending score).
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from ..tensorflow_importer import tf
+from . import model as modellib
+
+__all__ = ['export_frozen', 'quantize_weights', 'FrozenMaskRCNN']
+
+# name of the constant node holding the export metadata
+INFO_NODE = 'anybaseocr_export_info'
+
+QUANTIZATIONS = ['float16', 'int8']
+
+def _optimize(graph_def, input_names, output_names):
+    """Fold constants and batch normalization, fuse operators (for CPU)."""
+    # pylint: disable=import-outside-toplevel
+    from tensorflow.python.grappler import tf_optimizer
+    from tensorflow.python.tools import optimize_for_inference_lib
+    graph_def = optimize_for_inference_lib.optimize_for_inference(
+        graph_def, input_names, output_names,
+        [tf.float32.as_datatype_enum] * len(input_names))
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+        meta_graph = tf.train.export_meta_graph(graph_def=graph.as_graph_def(), graph=graph)
+    # outputs must be kept
+    meta_graph.collection_def['train_op'].node_list.value.extend(output_names)
+    config = tf.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.extend(['constfold', 'arithmetic', 'dependency', 'remap'])
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+def _const_node(name, value, dtype=None, device=''):
+    node = tf.NodeDef(name=name, op='Const', device=device)
+    tensor = tf.make_tensor_proto(value, dtype=dtype)
+    node.attr['dtype'].type = tensor.dtype
+    node.attr['value'].tensor.CopyFrom(tensor)
+    return node
+
+# ops which can pass a resource variable handle on to its ReadVariableOp
+_HANDLE_OPS = ['Identity', 'Enter', 'Exit', 'Switch', 'Merge', 'NextIteration']
+
+def _freeze(session, graph_def, output_names):
+    """Replace the variables needed for ``output_names`` by constants of their current values.
+
+    Like ``tf.graph_util.convert_variables_to_constants``, but also for
+    resource variables read within control flow (like in the while loops
+    of ``TimeDistributed`` layers), which TensorFlow before 1.15 cannot
+    convert.
+    """
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+    nodes = {node.name: node for node in graph_def.node}
+    variables = [node.name for node in graph_def.node
+                 if node.op in ['VarHandleOp', 'VariableV2']]
+    values = session.run([name + ('/Read/ReadVariableOp:0' if nodes[name].op == 'VarHandleOp'
+                                  else ':0')
+                          for name in variables])
+    values = dict(zip(variables, values))
+    # nodes between a VarHandleOp and its ReadVariableOp, with the variable's dtype
+    handle_types = {}
+    for node in graph_def.node:
+        if node.op != 'ReadVariableOp':
+            continue
+        sources = [node.input[0]]
+        while sources:
+            source = nodes[sources.pop().split(':')[0].lstrip('^')]
+            if source.op not in _HANDLE_OPS or source.name in handle_types:
+                continue
+            handle_types[source.name] = node.attr['dtype'].type
+            # Merge gets the handle from outside and from NextIteration
+            sources.extend(source.input if source.op == 'Merge' else source.input[:1])
+    result = tf.GraphDef()
+    result.versions.CopyFrom(graph_def.versions)
+    result.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.name in values:
+            result.node.extend([_const_node(node.name, values[node.name],
+                                            dtype=node.attr['dtype'].type, device=node.device)])
+            continue
+        new = result.node.add()
+        new.CopyFrom(node)
+        if node.name in handle_types:
+            new.attr['T'].type = handle_types[node.name]
+            if '_output_shapes' in new.attr:
+                del new.attr['_output_shapes']
+        elif node.op == 'ReadVariableOp':
+            new.op = 'Identity'
+            new.attr['T'].type = node.attr['dtype'].type
+            del new.attr['dtype']
+    return result
+
+def quantize_weights(graph_def, mode, minimum_size=1024):
+    """Store float32 constants of at least ``minimum_size`` elements quantized.
+
+    If ``mode`` is ``float16``, convert them to half precision (followed by
+    a ``Cast``), if ``int8``, to 8 bit per tensor between its minimum and
+    maximum (followed by a ``Dequantize``). The replacement keeps the name
+    of the constant, so its consumers remain unchanged.
+    """
+    if mode not in QUANTIZATIONS:
+        raise ValueError("quantization must be one of %s, not '%s'" % (QUANTIZATIONS, mode))
+    result = tf.GraphDef()
+    result.versions.CopyFrom(graph_def.versions)
+    result.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if (node.op != 'Const' or
+                node.attr['dtype'].type != tf.float32.as_datatype_enum):
+            result.node.add().CopyFrom(node)
+            continue
+        value = tf.make_ndarray(node.attr['value'].tensor)
+        if value.size < minimum_size:
+            result.node.add().CopyFrom(node)
+            continue
+        if mode == 'float16':
+            stored = _const_node(node.name + '/float16', value.astype(np.float16), device=node.device)
+            restore = tf.NodeDef(name=node.name, op='Cast', input=[stored.name], device=node.device)
+            restore.attr['SrcT'].type = tf.float16.as_datatype_enum
+            restore.attr['DstT'].type = tf.float32.as_datatype_enum
+            result.node.extend([stored, restore])
+        else:
+            minimum, maximum = float(value.min()), float(value.max())
+            maximum = max(maximum, minimum + 1e-6)
+            quantized = np.round((value - minimum) / (maximum - minimum) * 255).astype(np.uint8)
+            stored = _const_node(node.name + '/quint8', quantized, dtype=tf.quint8, device=node.device)
+            lower = _const_node(node.name + '/min', np.float32(minimum), device=node.device)
+            upper = _const_node(node.name + '/max', np.float32(maximum), device=node.device)
+            restore = tf.NodeDef(name=node.name, op='Dequantize',
+                                 input=[stored.name, lower.name, upper.name], device=node.device)
+            restore.attr['T'].type = tf.quint8.as_datatype_enum
+            restore.attr['mode'].s = b'MIN_COMBINED'
+            result.node.extend([stored, lower, upper, restore])
+    return result
+
+def export_frozen(mrcnn_model, path, optimize=True, quantize=None):
+    """Write the graph of ``mrcnn_model`` (in inference mode) with its current weights to ``path``.
+
+    If ``optimize``, then optimize the graph for CPU inference.
+    If ``quantize`` is ``float16`` or ``int8``, then store weights quantized.
+
+    Returns the export metadata (which also gets stored in the graph).
+    """
+    assert mrcnn_model.mode == "inference", "Create model in inference mode."
+    keras_model = mrcnn_model.keras_model
+    input_names = [tensor.op.name for tensor in keras_model.inputs]
+    output_names = [tensor.op.name for tensor in keras_model.outputs]
+    session = tf.keras.backend.get_session()
+    graph_def = _freeze(session, session.graph.as_graph_def(), output_names)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=output_names)
+    if optimize:
+        graph_def = _optimize(graph_def, input_names, output_names)
+    if quantize:
+        graph_def = quantize_weights(graph_def, quantize)
+    info = {
+        'inputs': [name + ':0' for name in input_names],
+        'outputs': [name + ':0' for name in output_names],
+        'batch_size': mrcnn_model.config.BATCH_SIZE,
+        'image_shape': [int(dim) for dim in mrcnn_model.config.IMAGE_SHAPE],
+        'num_classes': mrcnn_model.config.NUM_CLASSES,
+        'min_confidence': mrcnn_model.config.DETECTION_MIN_CONFIDENCE,
+        'optimized': bool(optimize),
+        'quantized': quantize or 'none',
+    }
+    graph_def.node.extend([_const_node(INFO_NODE, json.dumps(info))])
+    Path(path).write_bytes(graph_def.SerializeToString())
+    return info
+
+class _GraphPredictor:
+    """Runs a frozen graph in place of ``keras_model.predict``."""
+
+    def __init__(self, graph_def, inputs, outputs):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.inputs = [self.graph.get_tensor_by_name(name) for name in inputs]
+        self.outputs = [self.graph.get_tensor_by_name(name) for name in outputs]
+        self.session = tf.Session(graph=self.graph)
+
+    def predict(self, inputs, verbose=0): # pylint: disable=unused-argument
+        return self.session.run(self.outputs, feed_dict=dict(zip(self.inputs, inputs)))
+
+class FrozenMaskRCNN(modellib.MaskRCNN):
+    """Mask R-CNN inference from a graph file written by :py:func:`export_frozen`."""
+
+    def __init__(self, path, config): # pylint: disable=super-init-not-called
+        graph_def = tf.GraphDef()
+        graph_def.ParseFromString(Path(path).read_bytes())
+        info = next((node for node in graph_def.node if node.name == INFO_NODE), None)
+        if info is None:
+            raise ValueError("'%s' is not an exported Mask R-CNN graph" % path)
+        self.export_info = json.loads(tf.make_ndarray(info.attr['value'].tensor).item())
+        if self.export_info['batch_size'] != config.BATCH_SIZE:
+            raise ValueError("'%s' was exported for batch size %d, not %d" % (
+                path, self.export_info['batch_size'], config.BATCH_SIZE))
+        if self.export_info['num_classes'] != config.NUM_CLASSES:
+            raise ValueError("'%s' was exported for %d classes, not %d" % (
+                path, self.export_info['num_classes'], config.NUM_CLASSES))
+        if self.export_info['min_confidence'] > config.DETECTION_MIN_CONFIDENCE:
+            raise ValueError("'%s' was exported for a minimum confidence of %g, higher than %g" % (
+                path, self.export_info['min_confidence'], config.DETECTION_MIN_CONFIDENCE))
+        self.mode = "inference"
+        self.config = config
+        self.model_dir = str(Path(path).parent)
+        self.keras_model = _GraphPredictor(graph_def,
+                                           self.export_info['inputs'],
+                                           self.export_info['outputs'])
+
+    def detect(self, images, verbose=0, active_class_ids=None, compact_masks=False):
+        """Like MaskRCNN.detect, but filtering by the configured minimum confidence."""
+        results = super().detect(images, verbose=verbose,
+                                 active_class_ids=active_class_ids,
+                                 compact_masks=compact_masks)
+        if self.export_info['min_confidence'] == self.config.DETECTION_MIN_CONFIDENCE:
+            return results
+        for result in results:
+            keep = result['scores'] >= self.config.DETECTION_MIN_CONFIDENCE
+            for key in ['rois', 'class_ids', 'scores', 'mask_offsets']:
+                if key in result:
+                    result[key] = result[key][keep]
+            if compact_masks:
+                result['masks'] = [mask for mask, kept in zip(result['masks'], keep) if kept]
+            else:
+                result['masks'] = result['masks'][:, :, keep]
+        return results
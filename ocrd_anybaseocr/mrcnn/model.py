@@ -15,6 +15,7 @@ import math
 import logging
 from collections import OrderedDict
 import multiprocessing
+import cv2
 import numpy as np
 #import tensorflow as tf
 import tensorflow.compat.v1 as tf
@@ -706,12 +707,12 @@ def refine_detections_graph(rois, probs, deltas, window, active_class_ids, confi
         coordinates are normalized.
     """
     # Suppress scores for inactive classes
-    probs = tf.where(tf.cast(K.tile(K.expand_dims(active_class_ids, 0), (probs.shape[0],1)), tf.bool),
+    probs = tf.where(tf.cast(K.tile(K.expand_dims(active_class_ids, 0), (tf.shape(probs)[0], 1)), tf.bool),
                      x=probs, y=K.zeros_like(probs))
     # Class IDs per ROI
     class_ids = tf.argmax(probs, axis=1, output_type=tf.int32)
     # Class probability of the top class of each ROI
-    indices = tf.stack([tf.range(probs.shape[0]), class_ids], axis=1)
+    indices = tf.stack([tf.range(tf.shape(probs)[0]), class_ids], axis=1)
     class_scores = tf.gather_nd(probs, indices)
     # Class-specific bounding box deltas
     deltas_specific = tf.gather_nd(deltas, indices)
@@ -960,8 +961,9 @@ def fpn_classifier_graph(rois, feature_maps, image_meta,
     x = KL.TimeDistributed(KL.Dense(num_classes * 4, activation='linear'),
                            name='mrcnn_bbox_fc')(shared)
     # Reshape to [batch, num_rois, NUM_CLASSES, (dy, dx, log(dh), log(dw))]
+    # (tf.keras does not know the number of ROIs here)
     s = K.int_shape(x)
-    mrcnn_bbox = KL.Reshape((s[1], num_classes, 4), name="mrcnn_bbox")(x)
+    mrcnn_bbox = KL.Reshape((s[1] or -1, num_classes, 4), name="mrcnn_bbox")(x)
 
     return mrcnn_class_logits, mrcnn_probs, mrcnn_bbox
 
@@ -2405,6 +2407,10 @@ class MaskRCNN():
         else:
             active_classes = np.ones([self.config.NUM_CLASSES], dtype=np.int32)
             active_classes = np.tile(active_classes, (len(images), 1))
+        if (self.config.IMAGE_RESIZE_FAST and
+                self.config.IMAGE_RESIZE_MODE == "square" and
+                all(image.dtype == np.uint8 and image.ndim == 3 for image in images)):
+            return self.mold_inputs_fast(images, active_classes)
         for i, image in enumerate(images):
             # Resize image
             # TODO: move resizing to mold_image()
@@ -2418,7 +2424,7 @@ class MaskRCNN():
             # Build image_meta
             image_meta = compose_image_meta(
                 0, image.shape, molded_image.shape, window, scale,
-                active_class_ids[i])
+                active_classes[i])
             # Append
             molded_images.append(molded_image)
             windows.append(window)
@@ -2429,8 +2435,51 @@ class MaskRCNN():
         windows = np.stack(windows)
         return molded_images, image_metas, windows
 
+    def mold_inputs_fast(self, images, active_classes):
+        """Like mold_inputs() for uint8 images in "square" mode, but
+        resizing each image with area interpolation directly into a
+        preallocated float32 batch (padding and mean subtraction included).
+
+        The batch array is reused by the next call, so it must not be
+        kept beyond the current detection.
+
+        active_classes: boolean matrix [images, classes].
+        """
+        max_dim = self.config.IMAGE_MAX_DIM
+        shape = (len(images), max_dim, max_dim, self.config.IMAGE_CHANNEL_COUNT)
+        molded_images = getattr(self, "_molded_images", None)
+        if molded_images is None or molded_images.shape != shape:
+            molded_images = self._molded_images = np.empty(shape, np.float32)
+        mean_pixel = self.config.MEAN_PIXEL.astype(np.float32)
+        image_metas = []
+        windows = []
+        for i, image in enumerate(images):
+            h, w = image.shape[:2]
+            # same scale as utils.resize_image()
+            scale = 1
+            if self.config.IMAGE_MIN_DIM:
+                scale = max(1, self.config.IMAGE_MIN_DIM / min(h, w))
+            if self.config.IMAGE_MIN_SCALE and scale < self.config.IMAGE_MIN_SCALE:
+                scale = self.config.IMAGE_MIN_SCALE
+            if round(max(h, w) * scale) > max_dim:
+                scale = max_dim / max(h, w)
+            if scale != 1:
+                h, w = round(h * scale), round(w * scale)
+                image = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA)
+            top, left = (max_dim - h) // 2, (max_dim - w) // 2
+            window = (top, left, top + h, left + w)
+            # padding is zero before molding
+            molded_images[i] = -mean_pixel
+            np.subtract(image.reshape(h, w, -1), mean_pixel,
+                        out=molded_images[i, top:top + h, left:left + w])
+            image_metas.append(compose_image_meta(
+                0, images[i].shape, molded_images[i].shape, window, scale,
+                active_classes[i]))
+            windows.append(window)
+        return molded_images, np.stack(image_metas), np.stack(windows)
+
     def unmold_detections(self, detections, mrcnn_mask, original_image_shape,
-                          image_shape, window):
+                          image_shape, window, compact_masks=False):
         """Reformats the detections of one image from the format of the neural
         network output to a format suitable for use in the rest of the
         application.
@@ -2441,12 +2490,18 @@ class MaskRCNN():
         image_shape: [H, W, C] Shape of the image after resizing and padding
         window: [y1, x1, y2, x2] Pixel coordinates of box in the image where the real
                 image is excluding the padding.
+        compact_masks: If True, do not place the masks in full size images,
+                but keep each within its bounding box (so memory scales with
+                the total box area instead of the number of instances times
+                the image area).
 
         Returns:
         boxes: [N, (y1, x1, y2, x2)] Bounding boxes in pixels
         class_ids: [N] Integer class IDs for each bounding box
         scores: [N] Float probability scores of the class_id
         masks: [height, width, num_instances] Instance masks
+               (or if compact_masks, a list of [y2 - y1, x2 - x1] masks
+               at the top left corner of each box)
         """
         # How many detections do we have?
         # Detections array is padded with zeros. Find the first class_id == 0.
@@ -2483,6 +2538,11 @@ class MaskRCNN():
             masks = np.delete(masks, exclude_ix, axis=0)
             N = class_ids.shape[0]
 
+        if compact_masks:
+            # Resize masks to box size and set boundary threshold.
+            box_masks = [utils.unmold_mask_in_box(masks[i], boxes[i]) for i in range(N)]
+            return boxes, class_ids, scores, box_masks
+
         # Resize masks to original image size and set boundary threshold.
         full_masks = []
         for i in range(N):
@@ -2494,18 +2554,23 @@ class MaskRCNN():
 
         return boxes, class_ids, scores, full_masks
 
-    def detect(self, images, verbose=0, active_class_ids=None):
+    def detect(self, images, verbose=0, active_class_ids=None, compact_masks=False):
         """Runs the detection pipeline.
 
         images: List of images, potentially of different sizes.
         active_class_ids: List of class_ids allowed for the given images. Or
                           Boolean matrix [images, classes].
+        compact_masks: If True, return each instance mask only within its
+                       bounding box (see unmold_detections).
 
         Returns a list of dicts, one dict per image. The dict contains:
         rois: [N, (y1, x1, y2, x2)] detection bounding boxes
         class_ids: [N] int class IDs
         scores: [N] float probability scores for the class IDs
         masks: [H, W, N] instance binary masks
+               (or if compact_masks, a list of N box-sized binary masks)
+        mask_offsets: [N, (y1, x1)] position of each mask in the image
+                      (only if compact_masks)
         """
         assert self.mode == "inference", "Create model in inference mode."
         assert len(
@@ -2526,11 +2591,8 @@ class MaskRCNN():
             assert g.shape == image_shape,\
                 "After resizing, all images must have the same size. Check IMAGE_RESIZE_MODE and image sizes."
 
-        # Anchors
-        anchors = self.get_anchors(image_shape)
-        # Duplicate across the batch dimension because Keras requires it
-        # TODO: can this be optimized to avoid duplicating the anchors?
-        anchors = np.broadcast_to(anchors, (self.config.BATCH_SIZE,) + anchors.shape)
+        # Anchors (duplicated across the batch dimension because Keras requires it)
+        anchors = self.get_batch_anchors(image_shape)
 
         if verbose:
             log("molded_images", molded_images)
@@ -2545,13 +2607,17 @@ class MaskRCNN():
             final_rois, final_class_ids, final_scores, final_masks =\
                 self.unmold_detections(detections[i], mrcnn_mask[i],
                                        image.shape, molded_images[i].shape,
-                                       windows[i])
-            results.append({
+                                       windows[i], compact_masks=compact_masks)
+            result = {
                 "rois": final_rois,
                 "class_ids": final_class_ids,
                 "scores": final_scores,
                 "masks": final_masks,
-            })
+            }
+            if compact_masks:
+                # rois may get modified by the caller
+                result["mask_offsets"] = final_rois[:, :2].copy()
+            results.append(result)
         return results
 
     def detect_molded(self, molded_images, image_metas, verbose=0):
@@ -2583,11 +2649,8 @@ class MaskRCNN():
         for g in molded_images[1:]:
             assert g.shape == image_shape, "Images must have the same size"
 
-        # Anchors
-        anchors = self.get_anchors(image_shape)
-        # Duplicate across the batch dimension because Keras requires it
-        # TODO: can this be optimized to avoid duplicating the anchors?
-        anchors = np.broadcast_to(anchors, (self.config.BATCH_SIZE,) + anchors.shape)
+        # Anchors (duplicated across the batch dimension because Keras requires it)
+        anchors = self.get_batch_anchors(image_shape)
 
         if verbose:
             log("molded_images", molded_images)
@@ -2634,6 +2697,19 @@ class MaskRCNN():
             self._anchor_cache[tuple(image_shape)] = utils.norm_boxes(a, image_shape[:2])
         return self._anchor_cache[tuple(image_shape)]
 
+    def get_batch_anchors(self, image_shape):
+        """Returns the anchor pyramid for the given image size, duplicated
+        for each image in a batch (as a float32 array kept across calls)."""
+        key = (tuple(image_shape), self.config.BATCH_SIZE)
+        cache = getattr(self, "_batch_anchor_cache", None)
+        if cache is None or cache[0] != key:
+            anchors = self.get_anchors(image_shape).astype(np.float32)
+            anchors = np.ascontiguousarray(np.broadcast_to(
+                anchors, (self.config.BATCH_SIZE,) + anchors.shape))
+            anchors.flags.writeable = False
+            cache = self._batch_anchor_cache = (key, anchors)
+        return cache[1]
+
     def ancestor(self, tensor, name, checked=None):
         """Finds the ancestor of a TF tensor in the computation graph.
         tensor: TensorFlow symbolic tensor.
@@ -2715,11 +2791,8 @@ class MaskRCNN():
         else:
             molded_images = images
         image_shape = molded_images[0].shape
-        # Anchors
-        anchors = self.get_anchors(image_shape)
-        # Duplicate across the batch dimension because Keras requires it
-        # TODO: can this be optimized to avoid duplicating the anchors?
-        anchors = np.broadcast_to(anchors, (self.config.BATCH_SIZE,) + anchors.shape)
+        # Anchors (duplicated across the batch dimension because Keras requires it)
+        anchors = self.get_batch_anchors(image_shape)
         model_in = [molded_images, image_metas, anchors]
 
         # Run inference
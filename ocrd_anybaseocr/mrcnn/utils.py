@@ -541,6 +541,18 @@ def mold_mask(mask, config):
     pass    
 
 
+def unmold_mask_in_box(mask, bbox):
+    """Converts a mask generated by the neural network to a binary mask
+    of the size of its bounding box.
+    mask: [height, width] of type float. A small, typically 28x28 mask.
+    bbox: [y1, x1, y2, x2]. The box to fit the mask in.
+    Returns a binary mask of shape [y2 - y1, x2 - x1].
+    """
+    threshold = 0.5
+    y1, x1, y2, x2 = bbox
+    mask = resize(mask, (y2 - y1, x2 - x1))
+    return np.where(mask >= threshold, 1, 0).astype(bool)
+
 def unmold_mask(mask, bbox, image_shape):   
     """Converts a mask generated by the neural network to a format similar  
     to its original shape.  
@@ -548,10 +560,8 @@ def unmold_mask(mask, bbox, image_shape):
     bbox: [y1, x1, y2, x2]. The box to fit the mask in. 
     Returns a binary mask with the same size as the original image. 
     """ 
-    threshold = 0.5 
     y1, x1, y2, x2 = bbox   
-    mask = resize(mask, (y2 - y1, x2 - x1)) 
-    mask = np.where(mask >= threshold, 1, 0).astype(bool)    
+    mask = unmold_mask_in_box(mask, bbox)
 
     # Put the mask in the right location.   
     full_mask = np.zeros(image_shape[:2], dtype=bool)    
@@ -0,0 +1,96 @@
+# Shared routines from ocropus-nlbin (https://github.com/tmbdev/ocropy/),
+# used by both the binarization and the skew correction component.
+
+# Copyright 2014 Thomas M. Breuel
+# Apache License 2.0
+
+import numpy as np
+from scipy.ndimage import filters, morphology
+
+def histogram_percentiles(values, percentiles, bins=1024, value_range=None, mask=None):
+    """Estimate several percentiles of ``values`` from a single histogram.
+
+    Instead of sorting (or partitioning) all values once per percentile,
+    build one histogram with ``bins`` equally sized bins over ``value_range``
+    (default: minimum and maximum of ``values``) and read each percentile
+    off its cumulative distribution, interpolating linearly within the bin.
+    If ``mask`` is given (a boolean array of the same shape), only count
+    the values where it is true. The histogram is accumulated in blocks of
+    rows, so no full-size copy of ``values`` is needed.
+
+    The result falls into the same bin as the exact percentile (up to the
+    interpolation between adjacent samples), so the absolute error is
+    bounded by the bin width ``(value_range[1]-value_range[0])/bins``
+    (i.e. 0.001 for 1024 bins over [0,1]).
+
+    Returns a list of estimates in the order of ``percentiles``.
+    """
+    if value_range is None:
+        value_range = (np.amin(values), np.amax(values))
+    if value_range[0] == value_range[1]:
+        return [float(value_range[0])] * len(percentiles)
+    hist = np.zeros(bins, np.int64)
+    block = 256
+    for start in range(0, len(values), block):
+        chunk = values[start:start+block]
+        if mask is not None:
+            chunk = chunk[mask[start:start+block]]
+        hist += np.histogram(chunk, bins=bins, range=value_range)[0]
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+    cdf = np.cumsum(hist)
+    results = []
+    for perc in percentiles:
+        # fractional rank of the percentile among the counted samples
+        rank = perc / 100.0 * cdf[-1]
+        k = min(np.searchsorted(cdf, rank, side='left'), bins - 1)
+        below = cdf[k - 1] if k > 0 else 0
+        frac = (rank - below) / hist[k] if hist[k] > 0 else 0
+        results.append(edges[k] + frac * (edges[k + 1] - edges[k]))
+    return results
+
+def estimate_thresholds(flat, bignore=0.1, escale=1.0, lo=5, hi=90, decimate=1,
+                        bins=0, value_range=None, dshow=None):
+    """Estimate low and high thresholds of a flattened image.
+
+    Ignore ``bignore`` of the border on each side. Unless ``escale`` is zero,
+    use only regions that contain significant variance; this makes the
+    percentile based low and high estimates more reliable.
+
+    If ``decimate`` is larger than 1, then compute both the variance mask and
+    the percentiles on every ``decimate``-th row and column only (with filter
+    sizes scaled accordingly). Since percentiles depend on the distribution
+    of intensities rather than their spatial arrangement, the drift in ``lo``
+    and ``hi`` stays small, while the cost of the filters and dilations
+    drops quadratically.
+
+    If ``bins`` is larger than 0, then read both percentiles from a single
+    histogram with that many bins over ``value_range`` (see
+    :py:func:`histogram_percentiles`), otherwise sort exactly.
+
+    If ``dshow`` is given, call it on the mask for debugging.
+
+    Returns the ``lo`` and ``hi`` percentile estimates.
+    """
+    d0, d1 = flat.shape
+    o0, o1 = int(bignore*d0), int(bignore*d1)
+    est = flat[o0:d0-o0:decimate, o1:d1-o1:decimate]
+    v = None
+    if escale > 0:
+        e = escale/decimate
+        v = est-filters.gaussian_filter(est, e*20.0)
+        v = filters.gaussian_filter(v**2, e*20.0)**0.5
+        v = (v > 0.3*np.amax(v))
+        v = morphology.binary_dilation(
+            v, structure=np.ones((max(1, int(e*50)), 1)))
+        v = morphology.binary_dilation(
+            v, structure=np.ones((1, max(1, int(e*50)))))
+        if dshow:
+            dshow(v, 'mask')
+    if bins > 0:
+        return tuple(histogram_percentiles(est, [lo, hi], bins=bins,
+                                           value_range=value_range, mask=v))
+    if v is not None:
+        est = est[v]
+    # same as scipy.stats.scoreatpercentile, without importing scipy.stats
+    lo, hi = np.percentile(est.ravel(), [lo, hi])
+    return lo, hi
@@ -0,0 +1,221 @@
+"""Page-parallel execution of processors across a pool of worker processes.
+
+Processors implement ``process_page(n, input_file)``, which loads the
+PAGE and image of the ``n``-th input file, processes it, saves derived
+images and returns the resulting PAGE object (or None to skip the page),
+which gets written to the (last) output fileGrp.
+:py:func:`process_pages` then either calls that sequentially, or (if the
+processor's ``parallel`` parameter is larger than 1) fans out the pages
+to a pool of worker processes.
+
+Model-based processors can instead split processing into three stages:
+
+- ``load_page(n, input_file)`` loads the PAGE and images and prepares the
+  model input, returning some state (or None to skip the page),
+- ``predict_pages(states)`` runs the model on a list of such states
+  (of up to the processor's ``batch_size`` parameter), returning a list
+  of new states in the same order,
+- ``write_page(state)`` post-processes the prediction, saves derived
+  images and returns the resulting PAGE object (or None).
+
+When processing sequentially with a ``prefetch`` parameter larger than 0,
+these stages then overlap in a thread pipeline (see
+:py:mod:`ocrd_anybaseocr.pipeline`), with up to that many pages queued
+between stages.
+
+Workers create their own instance of the processor class (including its
+models) on the same workspace. Images and PAGE output files get written
+to the filesystem by the workers, but their METS ``file`` entries are
+added by the parent process only, in the order of the input files.
+Thus, the result is the same as for sequential processing.
+"""
+
+import io
+import os
+import multiprocessing as mp
+from pathlib import Path
+
+from ocrd import Resolver
+from ocrd_models.ocrd_page import to_xml
+from ocrd_utils import (
+    getLogger,
+    initLogging,
+    make_file_id,
+    MIMETYPE_PAGE,
+    MIME_TO_EXT,
+    MIME_TO_PIL,
+)
+
+from .pipeline import LockedWorkspace, run_pipeline
+
+__all__ = ['add_page', 'process_pages']
+
+class DeferredWorkspace:
+    """Proxy to a workspace which writes files, but only records their METS entries."""
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.added_files = []
+
+    def __getattr__(self, name):
+        return getattr(self.workspace, name)
+
+    def add_file(self, file_grp, content=None, **kwargs):
+        """Write ``content`` to ``local_filename``, but defer the METS entry."""
+        if content is not None:
+            path = Path(self.workspace.directory, kwargs['local_filename'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            path.write_bytes(content)
+        self.added_files.append((file_grp, kwargs))
+
+    def save_image_file(self, image, file_id, file_grp, page_id=None,
+                        mimetype='image/png', force=False):
+        """Like :py:meth:`ocrd.Workspace.save_image_file`, but deferring the METS entry."""
+        image_bytes = io.BytesIO()
+        image.save(image_bytes, format=MIME_TO_PIL[mimetype])
+        file_path = str(Path(file_grp, '%s%s' % (file_id, MIME_TO_EXT[mimetype])))
+        self.add_file(file_grp,
+                      ID=file_id,
+                      pageId=page_id,
+                      local_filename=file_path,
+                      mimetype=mimetype,
+                      content=image_bytes.getvalue(),
+                      force=force)
+        return file_path
+
+    def pop_added_files(self):
+        added_files = self.added_files
+        self.added_files = []
+        return added_files
+
+# processor instance of the current worker process
+_WORKER = None
+
+def _init_worker(processor_class, mets_url, parameter, input_file_grp, output_file_grp, page_id):
+    global _WORKER
+    initLogging()
+    workspace = Resolver().workspace_from_url(mets_url)
+    _WORKER = processor_class(workspace,
+                              parameter=parameter,
+                              input_file_grp=input_file_grp,
+                              output_file_grp=output_file_grp,
+                              page_id=page_id)
+    _WORKER.workspace = DeferredWorkspace(workspace)
+
+def _has_stages(processor):
+    return hasattr(processor, 'predict_pages')
+
+def _predict_pages(processor, states):
+    # skipped pages do not get passed to the model
+    valid = [state for state in states if state is not None]
+    results = iter(processor.predict_pages(valid) if valid else [])
+    return [None if state is None else next(results) for state in states]
+
+def _write_page(processor, state):
+    return None if state is None else processor.write_page(state)
+
+def _process_batch(processor, items):
+    if not _has_stages(processor):
+        return [processor.process_page(n, input_file) for n, input_file in items]
+    states = [processor.load_page(n, input_file) for n, input_file in items]
+    return [_write_page(processor, state) for state in _predict_pages(processor, states)]
+
+def _process_pages(ns):
+    input_files = _WORKER.input_files
+    pcgts_list = _process_batch(_WORKER, [(n, input_files[n]) for n in ns])
+    # PAGE objects parsed from files cannot be pickled, so serialise here
+    for n, pcgts in zip(ns, pcgts_list):
+        if pcgts is not None:
+            _add_page(_WORKER, input_files[n], pcgts)
+    return _WORKER.workspace.pop_added_files()
+
+def add_page(workspace, input_file, pcgts, file_grp):
+    """Serialise ``pcgts`` as PAGE output file for ``input_file`` in ``file_grp``."""
+    file_id = make_file_id(input_file, file_grp)
+    pcgts.set_pcGtsId(file_id)
+    workspace.add_file(
+        ID=file_id,
+        file_grp=file_grp,
+        pageId=input_file.pageId,
+        mimetype=MIMETYPE_PAGE,
+        local_filename=os.path.join(file_grp, file_id + '.xml'),
+        content=to_xml(pcgts).encode('utf-8')
+    )
+
+def _add_page(processor, input_file, pcgts):
+    # processors with multiple output fileGrps (pipelines) return the PAGE of the last one
+    file_grp = processor.output_file_grp.split(',')[-1]
+    add_page(processor.workspace, input_file, pcgts, file_grp)
+
+def process_pages(processor):
+    """Run ``processor.process_page`` on all input files, and add the resulting PAGE files.
+
+    If the processor's ``parallel`` parameter is larger than 1, use that
+    many worker processes. If the processor implements the stages
+    ``load_page``, ``predict_pages`` and ``write_page``, pass the model
+    batches of ``batch_size`` pages, and (when sequential) run the stages
+    in a pipeline with ``prefetch`` pages queued between them.
+    """
+    LOG = getLogger('ocrd_anybaseocr.parallel')
+    input_files = list(processor.input_files)
+    batch_size = 1
+    if _has_stages(processor):
+        batch_size = max(1, processor.parameter.get('batch_size', 1))
+    batches = [list(range(start, min(start + batch_size, len(input_files))))
+               for start in range(0, len(input_files), batch_size)]
+    workers = min(processor.parameter.get('parallel', 0), len(batches))
+    prefetch = processor.parameter.get('prefetch', 0)
+    if workers < 2 and _has_stages(processor) and prefetch > 0:
+        _pipeline_pages(processor, input_files, batch_size, prefetch)
+        return
+    if workers < 2:
+        for ns in batches:
+            pcgts_list = _process_batch(processor, [(n, input_files[n]) for n in ns])
+            for n, pcgts in zip(ns, pcgts_list):
+                if pcgts is not None:
+                    _add_page(processor, input_files[n], pcgts)
+        return
+    LOG.info("processing %d pages with %d worker processes", len(input_files), workers)
+    # workers must not inherit any model or thread state, so spawn fresh interpreters
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(
+            processor.__class__,
+            processor.workspace.mets_target,
+            dict(processor.parameter),
+            processor.input_file_grp,
+            processor.output_file_grp,
+            processor.page_id)) as pool:
+        # imap preserves input order, so METS entries are deterministic
+        for added_files in pool.imap(_process_pages, batches):
+            for file_grp, kwargs in added_files:
+                processor.workspace.add_file(file_grp, **kwargs)
+
+def _pipeline_pages(processor, input_files, batch_size, prefetch):
+    LOG = getLogger('ocrd_anybaseocr.parallel')
+
+    def _load(input_file, n):
+        return input_file, processor.load_page(n, input_file)
+
+    def _predict(batch):
+        states = _predict_pages(processor, [state for _, state in batch])
+        return [(input_file, state) for (input_file, _), state in zip(batch, states)]
+
+    def _write(result):
+        input_file, state = result
+        pcgts = _write_page(processor, state)
+        if pcgts is not None:
+            _add_page(processor, input_file, pcgts)
+
+    workspace = processor.workspace
+    processor.workspace = LockedWorkspace(workspace)
+    try:
+        timings = run_pipeline([(input_file, n) for n, input_file in enumerate(input_files)],
+                               _load, _predict, _write, depth=prefetch, batch_size=batch_size)
+    finally:
+        processor.workspace = workspace
+    LOG.info("pipeline of %d pages took %.1fs: load %.1fs, predict %.1fs (idle %.1fs), write %.1fs",
+             len(input_files), timings['total'], timings['load'],
+             timings['predict'], timings['idle'], timings['write'])
+    processor.pipeline_timings = timings
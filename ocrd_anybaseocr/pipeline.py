@@ -0,0 +1,163 @@
+"""Overlap page loading, model inference and result writing across threads.
+
+:py:func:`run_pipeline` runs three stages connected by bounded queues:
+
+- a loader thread, which decodes the input (PAGE, images) and prepares
+  the model input of the next pages,
+- the calling thread, which runs the model on batches of loaded pages,
+- a writer thread, which post-processes and saves the results.
+
+So while the model works on page N, page N+1 gets loaded and page N-1
+gets written. (This helps because decoding, numpy, PIL and the model
+libraries release the GIL for most of their work.) All stages process
+the pages in input order, so results are written in the same order as
+without pipelining.
+
+Since loader and writer both access the workspace, the processor's
+workspace is replaced by a :py:class:`LockedWorkspace` while running.
+"""
+
+import queue
+import threading
+import time
+
+__all__ = ['LockedWorkspace', 'run_pipeline']
+
+# end of input marker
+_DONE = object()
+
+class LockedWorkspace:
+    """Proxy to a workspace which serialises all METS access across threads.
+
+    Derived images get encoded by :py:func:`~ocrd_anybaseocr.imagefile.save_image_file`
+    outside the lock, which only covers their ``add_file``.
+    """
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        return getattr(self.workspace, name)
+
+    def download_file(self, *args, **kwargs):
+        with self.lock:
+            return self.workspace.download_file(*args, **kwargs)
+
+    def image_from_page(self, *args, **kwargs):
+        with self.lock:
+            return self.workspace.image_from_page(*args, **kwargs)
+
+    def image_from_segment(self, *args, **kwargs):
+        with self.lock:
+            return self.workspace.image_from_segment(*args, **kwargs)
+
+    def add_file(self, *args, **kwargs):
+        with self.lock:
+            return self.workspace.add_file(*args, **kwargs)
+
+def run_pipeline(items, load, predict, write, depth=2, batch_size=1):
+    """Run ``write(predict(load(*item)))`` on all ``items`` in a thread pipeline.
+
+    ``load`` gets called with each item (a tuple of arguments) in the
+    loader thread, ``predict`` with lists of (up to) ``batch_size``
+    results of ``load`` in the calling thread (returning a list of the
+    same length), and ``write`` with each of these results in the writer
+    thread. At most ``depth`` pages are kept in each of the queues in
+    between (so for full overlap, ``depth`` should be at least ``batch_size``).
+
+    If any stage raises an exception, all stages stop, and the exception
+    gets re-raised.
+
+    Returns a dict with the accumulated time (in seconds) spent in each of
+    the stages ``load``, ``predict`` and ``write``, the time the calling
+    thread spent waiting for the other stages (``idle``), and the overall
+    wall time (``total``).
+    """
+    timings = dict.fromkeys(['load', 'predict', 'write', 'idle'], 0.0)
+    loaded = queue.Queue(max(1, depth))
+    predicted = queue.Queue(max(1, depth))
+    failed = threading.Event()
+    errors = []
+
+    def _put(results, result):
+        # give up if some other stage failed
+        while not failed.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(results):
+        while not failed.is_set():
+            try:
+                return results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _load():
+        for item in items:
+            start = time.perf_counter()
+            result = load(*item)
+            timings['load'] += time.perf_counter() - start
+            if not _put(loaded, result):
+                return
+        _put(loaded, _DONE)
+
+    def _write():
+        while True:
+            result = _get(predicted)
+            if result is _DONE:
+                return
+            start = time.perf_counter()
+            write(result)
+            timings['write'] += time.perf_counter() - start
+
+    def _thread(name, stage):
+        def _run():
+            try:
+                stage()
+            except BaseException as err: # pylint: disable=broad-except
+                errors.append(err)
+                failed.set()
+        return threading.Thread(target=_run, name=name, daemon=True)
+
+    overall = time.perf_counter()
+    threads = [_thread('pipeline-loader', _load), _thread('pipeline-writer', _write)]
+    for thread in threads:
+        thread.start()
+    try:
+        done = False
+        while not done:
+            start = time.perf_counter()
+            batch = []
+            while len(batch) < batch_size:
+                result = _get(loaded)
+                if result is _DONE:
+                    done = True
+                    break
+                batch.append(result)
+            timings['idle'] += time.perf_counter() - start
+            if not batch:
+                break
+            start = time.perf_counter()
+            results = predict(batch)
+            timings['predict'] += time.perf_counter() - start
+            start = time.perf_counter()
+            for result in results:
+                if not _put(predicted, result):
+                    break
+            timings['idle'] += time.perf_counter() - start
+        _put(predicted, _DONE)
+    except BaseException as err: # pylint: disable=broad-except
+        errors.append(err)
+        failed.set()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    timings['total'] = time.perf_counter() - overall
+    return timings
@@ -0,0 +1,345 @@
+"""pix2pixHD model and in-memory dataset for the dewarping processor.
+
+Kept apart from the processor module, so torch and pix2pixHD only get
+imported when actually processing.
+"""
+
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from ocrd_utils import getLogger
+
+from pix2pixhd.options.test_options import TestOptions
+from pix2pixhd.models.models import create_model
+from pix2pixhd.data.base_dataset import BaseDataset, get_params, get_transform
+
+class TestDataset(BaseDataset):
+    # adopted from pix2pixhd.data.AlignDataset for our TestOptions
+    # but with in-memory Image
+    def __init__(self, opt, images):
+        super().__init__()
+        self.opt = opt
+        self.images = images
+    def __getitem__(self, index):
+        image = self.images[index]
+        param = get_params(self.opt, image.size)
+        trans = get_transform(self.opt, param)
+        tensor = trans(image.convert('RGB'))
+        return {'label': tensor, 'path': '', 'index': index,
+                'inst': 0, 'image': 0, 'feat': 0}
+    def __len__(self):
+        return len(self.images)
+
+def collate_by_size(items):
+    """Collate dataset items into batches of equal tensor size (in order of appearance).
+
+    Returns a list of batches, each with the dataset ``index`` of its items.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(tuple(item['label'].shape), []).append(item)
+    return [default_collate(group) for group in groups.values()]
+
+def prepare_data(opt, images, batch_size=1, num_workers=0):
+    """Iterate over ``images`` transformed as model input in (lists of) batches.
+
+    Up to ``batch_size`` images are loaded at once, and grouped by size
+    (see :py:func:`collate_by_size`). If ``num_workers`` is positive, then
+    the transforms run in that many background processes.
+    """
+    dataset = TestDataset(opt, images)
+    return torch.utils.data.DataLoader(dataset,
+                                       batch_size=batch_size,
+                                       shuffle=False,
+                                       num_workers=num_workers,
+                                       collate_fn=collate_by_size)
+
+def tensor2gray(tensor):
+    """Convert generator output (RGB in [-1,1]) to uint8 grayscale (as numpy array).
+
+    Like the channel mean of pix2pixHD's ``tensor2im``, but reducing
+    to one channel before conversion and copying from the device.
+    Works on single images and batches alike.
+    """
+    gray = tensor.float().mean(dim=-3)
+    return gray.add_(1).mul_(127.5).clamp_(0, 255).to(torch.uint8).cpu().numpy()
+
+# input size must be divisible by this (2 local enhancers and
+# 4 downsampling layers of the global generator, each halving)
+TILE_MULTIPLE = 64
+
+def _tile_starts(length, tile_size, step):
+    """Start positions of tiles covering ``length`` (the last one flush with the end)."""
+    if length <= tile_size:
+        return [0]
+    return list(range(0, length - tile_size, step)) + [length - tile_size]
+
+def _tile_weights(tile_size, overlap):
+    """1D blending weights of a tile: linear ramps over the overlap, positive everywhere."""
+    ramp = np.minimum(np.arange(1, tile_size + 1), np.arange(tile_size, 0, -1))
+    return np.minimum(1, ramp / (overlap + 1)).astype(np.float32)
+
+def tiled_inference(model, image, tile_size, overlap, batch_size=1):
+    """Run the generator on overlapping tiles of ``image`` at native resolution.
+
+    Tiles of ``tile_size`` (a multiple of :py:data:`TILE_MULTIPLE`) are
+    taken every ``tile_size - overlap`` pixels in both directions (padded
+    white beyond the image), and run through ``model`` in batches of
+    ``batch_size``. The outputs get reduced to grayscale and blended
+    with linear ramps across the overlaps. Results are accumulated
+    in a band of ``tile_size`` rows only, moving down the image, so
+    (apart from input and output) memory does not depend on the image
+    height, and only linearly on its width.
+
+    Returns a uint8 grayscale array of the image size (like the channel
+    mean of ``tensor2im`` on the untiled output).
+    """
+    width, height = image.size
+    step = tile_size - overlap
+    if tile_size % TILE_MULTIPLE or step <= 0:
+        raise ValueError("tile size %d must be a multiple of %d and larger than the overlap %d" % (
+            tile_size, TILE_MULTIPLE, overlap))
+    weights = _tile_weights(tile_size, overlap)
+    weights = weights[:, np.newaxis] * weights[np.newaxis, :]
+    result = np.empty((height, width), np.uint8)
+    band = np.zeros((tile_size, max(width, tile_size)), np.float32)
+    band_weights = np.zeros_like(band)
+    starts = _tile_starts(height, tile_size, step)
+    for row, top in enumerate(starts):
+        lefts = _tile_starts(width, tile_size, step)
+        for first in range(0, len(lefts), batch_size):
+            batch = lefts[first:first + batch_size]
+            tiles = []
+            for left in batch:
+                tile = image.crop((left, top, left + tile_size, top + tile_size)).convert('RGB')
+                # crop pads with black beyond the image, but pages are white
+                tile = np.array(tile, np.float32)
+                tile[max(0, height - top):] = 255
+                tile[:, max(0, width - left):] = 255
+                tiles.append(torch.from_numpy(tile).permute(2, 0, 1) / 127.5 - 1)
+            label = torch.stack(tiles)
+            zeros = torch.zeros(len(tiles), dtype=torch.long)
+            generated = model.inference(label, zeros, zeros)
+            gray = generated.data.float().mean(dim=1).cpu().numpy()
+            for left, output in zip(batch, gray):
+                band[:, left:left + tile_size] += weights * output
+                band_weights[:, left:left + tile_size] += weights
+        # rows above the next band are final
+        done = (starts[row + 1] if row + 1 < len(starts) else height) - top
+        done = min(done, height - top)
+        final = band[:done, :width] / band_weights[:done, :width]
+        result[top:top + done] = np.clip((final + 1) / 2 * 255, 0, 255).astype(np.uint8)
+        band[:tile_size - done] = band[done:]
+        band[tile_size - done:] = 0
+        band_weights[:tile_size - done] = band_weights[done:]
+        band_weights[tile_size - done:] = 0
+    return result
+
+def prepare_options(gpu_id, model_path, resize_or_crop, loadSize, fineSize):
+    model_path = Path(model_path)
+    LOG = getLogger('OcrdAnybaseocrDewarper')
+    # we cannot use TestOptions instances directly, because its parse()
+    # does some nontrivial postprocessing (which we do not want to redo here)
+    args = []
+    args.extend(['--gpu_ids', str(gpu_id)])
+    # unused: batches and loader workers are set up by prepare_data
+    args.extend(['--nThreads', str(1)])
+    args.extend(['--batchSize', str(1)])
+    args.extend(['--serial_batches'])  # no shuffle
+    args.extend(['--no_flip'])  # no flip
+    args.extend(['--checkpoints_dir', str(model_path.parents[1])])
+    args.extend(['--name', model_path.parents[0].name])
+    args.extend(['--label_nc', str(0)]) # number of input label channels (just RGB if zero)
+    args.extend(['--no_instance']) # no instance maps as input
+    args.extend(['--resize_or_crop', resize_or_crop])
+    args.extend(['--n_blocks_global', str(10)])
+    args.extend(['--n_local_enhancers', str(2)])
+    args.extend(['--loadSize', str(loadSize)])
+    args.extend(['--fineSize', str(fineSize)])
+    args.extend(['--model', 'pix2pixHD'])
+    #args.extend(['--verbose'])
+    LOG.debug("Options passed to pix2pixHD: %s", args)
+    opt = TestOptions()
+    opt = opt.parse(args=args, save=False, silent=True)
+    return opt
+
+PRECISIONS = ['float32', 'bfloat16', 'float16']
+
+def _precision_supported(precision, device):
+    if precision == 'float32':
+        return True
+    if device.type == 'cuda':
+        return precision == 'float16' or torch.cuda.is_bf16_supported()
+    # on CPU only fast with native instructions (AVX512-BF16/FP16, AMX)
+    check = getattr(torch.ops.mkldnn, '_is_mkldnn_%s_supported' % (
+        'bf16' if precision == 'bfloat16' else 'fp16'), None)
+    try:
+        return bool(check and check())
+    except RuntimeError:
+        return False
+
+def _quantize_convolutions(generator):
+    """Replace the convolutions of ``generator`` by dynamically quantized (int8 weight) ones.
+
+    Experimental: the errors of the (per tensor) quantized activations add
+    up across the layers of the generator.
+    """
+    # pylint: disable=import-outside-toplevel
+    from torch.ao.nn.quantized import dynamic as nnqd
+    from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+    mapping = {torch.nn.Conv2d: nnqd.Conv2d,
+               torch.nn.ConvTranspose2d: nnqd.ConvTranspose2d}
+    return quantize_dynamic(generator, qconfig_spec=dict.fromkeys(mapping, default_dynamic_qconfig),
+                            mapping=mapping)
+
+class CompiledGenerator:
+    """TorchScript pix2pixHD generator (in place of the model's ``inference``).
+
+    Inputs get converted to the device and precision of the generator,
+    outputs back to float32.
+    """
+
+    def __init__(self, module, device, dtype):
+        self.module = module
+        self.device = device
+        self.dtype = dtype
+
+    def inference(self, label, inst, image): # pylint: disable=unused-argument
+        with torch.inference_mode():
+            generated = self.module(label.to(self.device, self.dtype))
+            return generated.float()
+
+def compile_model(model, model_path, device, precision='float32', quantize=False):
+    """Trace the generator of ``model`` with TorchScript, cached next to ``model_path``.
+
+    Converts the generator to ``precision`` (falling back to ``float32``
+    if the device lacks native support), or (on CPU) with ``quantize``
+    replaces its convolutions by dynamically quantized ones. The traced
+    and frozen module is saved as ``<model_path stem>.<variant>.ts``
+    and reused as long as it is newer than ``model_path``.
+
+    Returns a :py:class:`CompiledGenerator`.
+    """
+    LOG = getLogger('OcrdAnybaseocrDewarper')
+    if precision not in PRECISIONS:
+        raise ValueError("precision must be one of %s, not '%s'" % (PRECISIONS, precision))
+    if not _precision_supported(precision, device):
+        LOG.warning("no native %s support on %s, using float32", precision, device)
+        precision = 'float32'
+    if quantize and (device.type != 'cpu' or precision != 'float32'):
+        LOG.warning("dynamic quantization is only available on CPU with float32")
+        quantize = False
+    dtype = getattr(torch, precision)
+    model_path = Path(model_path)
+    variant = '%s.%s%s' % (device.type, precision, '.int8' if quantize else '')
+    cache_path = model_path.with_name('%s.%s.ts' % (model_path.stem, variant))
+    if cache_path.is_file() and cache_path.stat().st_mtime >= model_path.stat().st_mtime:
+        LOG.info("loading compiled generator '%s'", cache_path)
+        return CompiledGenerator(torch.jit.load(str(cache_path), map_location=device), device, dtype)
+    LOG.info("compiling generator (%s)", variant)
+    generator = model.netG.eval()
+    if quantize:
+        generator = _quantize_convolutions(generator.cpu())
+    generator = generator.to(device, dtype)
+    example = torch.zeros(1, 3, 256, 256, device=device, dtype=dtype)
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(generator, example))
+    try:
+        # write atomically, in case of concurrent processor runs
+        temp_path = cache_path.with_name(cache_path.name + '.%d.tmp' % os.getpid())
+        torch.jit.save(module, str(temp_path))
+        temp_path.replace(cache_path)
+    except OSError as err:
+        LOG.warning("cannot cache compiled generator at '%s' (%s)", cache_path, err)
+    return CompiledGenerator(module, device, dtype)
+
+def prepare_model(compiled=False, precision='float32', quantize=False, **kwargs):
+    """Load the pix2pixHD generator for :py:func:`prepare_options` (with the other arguments).
+
+    If ``compiled``, then return a TorchScript version (see
+    :py:func:`compile_model`).
+
+    Returns the model and its options.
+    """
+    opt = prepare_options(**kwargs)
+    model = create_model(opt)
+    if not compiled:
+        return model, opt
+    device = torch.device('cuda:%d' % opt.gpu_ids[0] if opt.gpu_ids else 'cpu')
+    return compile_model(model, kwargs['model_path'], device,
+                         precision=precision, quantize=quantize), opt
+
+@contextmanager
+def torch_threads(num_threads):
+    """Limit torch's intra-op parallelism to ``num_threads`` (if positive) within the context.
+
+    The setting is process-wide (shared with other models of a model
+    server), so it gets restored on exit.
+    """
+    if num_threads <= 0:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+class Dewarper:
+    """pix2pixHD model along with its options, dewarping whole images.
+
+    This is the model of the processor, so with a model server, the
+    processor itself does not need torch or pix2pixHD at all.
+    """
+
+    def __init__(self, model, opt):
+        self.model = model
+        self.opt = opt
+
+    def predict(self, images, batch_size=1, num_workers=0, tile_size=0, tile_overlap=0,
+                num_threads=0):
+        """Run the model on ``images`` in batches of ``batch_size``.
+
+        If ``tile_size`` is positive, then see :py:func:`tiled_inference`,
+        otherwise :py:func:`prepare_data`. If ``num_threads`` is positive,
+        then torch uses that many threads during the call (see
+        :py:func:`torch_threads`).
+
+        Returns a uint8 grayscale array for each image, in the same order.
+        """
+        with torch_threads(num_threads):
+            return self._predict(images, batch_size, num_workers, tile_size, tile_overlap)
+
+    def _predict(self, images, batch_size, num_workers, tile_size, tile_overlap):
+        dewarped = [None] * len(images)
+        if tile_size > 0:
+            # at original resolution, one image (but several tiles) at a time
+            for index, image in enumerate(images):
+                dewarped[index] = tiled_inference(self.model, image, tile_size, tile_overlap,
+                                                  batch_size=batch_size)
+            return dewarped
+        for batches in prepare_data(self.opt, images, batch_size=batch_size, num_workers=num_workers):
+            for data in batches:
+                generated = self.model.inference(data['label'], data['inst'], data['image'])
+                # zzz: strictly, we should try to invert the dataset's input transform here
+                for index, image in zip(data['index'].tolist(), tensor2gray(generated.data)):
+                    dewarped[index] = image
+        return dewarped
+
+def load_dewarper(gpu_id=-1, compiled=False, precision='float32', quantize=False, **kwargs):
+    """Load the model of the processor with :py:func:`prepare_model` as :py:class:`Dewarper`.
+
+    Runs on the CPU if CUDA is not available.
+    """
+    if gpu_id > -1 and not torch.cuda.is_available():
+        getLogger('OcrdAnybaseocrDewarper').warning("torch cannot detect CUDA installation.")
+        gpu_id = -1
+    model, opt = prepare_model(compiled=compiled, precision=precision, quantize=quantize,
+                               gpu_id=gpu_id, **kwargs)
+    return Dewarper(model, opt)
@@ -0,0 +1,246 @@
+"""Long-lived model server, so models need not be loaded for every CLI call.
+
+Loading the TensorFlow and PyTorch models (building the graph, reading
+the weights) takes much longer than processing a single document. So
+instead of loading them in each processor run, the model-based
+processors get their models via :py:func:`load_model`, which
+
+- if a model server is listening on the socket (see :py:func:`socket_path`),
+  asks it to load the model (unless it already has), and returns a
+  :py:class:`RemoteModel` proxy, which forwards all method calls (with
+  arguments and results pickled over the socket),
+- otherwise loads the model in-process.
+
+The server gets started with ``ocrd-anybaseocr-server`` and keeps running
+(and keeps all models it was asked for) until interrupted. It runs all
+model loading and inference in its main thread (one call at a time,
+in the order received), while each client connection is served by its
+own thread. So the models only ever get used from the thread which
+loaded them (as TensorFlow's graph mode requires), and do not compete
+for the GPU.
+
+The socket (and a random key next to it, which clients must know to
+connect) are only accessible to the user who started the server, and
+clients only connect to sockets of their own user.
+
+Models are identified by their loader (a function of this package,
+given as ``module:function``) and its keyword arguments, which must
+therefore contain everything determining the model (e.g. resolved paths
+instead of resource names).
+"""
+
+import importlib
+import os
+import queue
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from ocrd_utils import getLogger
+
+__all__ = ['RemoteModel', 'load_model', 'serve', 'socket_path']
+
+def socket_path():
+    """Path of the server socket.
+
+    From the environment variable ``OCRD_ANYBASEOCR_SERVER``, or else
+    a file in ``$XDG_RUNTIME_DIR``, or else in a per-user directory of
+    the temporary directory. (If the variable is set, but empty, then
+    no server will be used.)
+    """
+    path = os.environ.get('OCRD_ANYBASEOCR_SERVER')
+    if path is None:
+        directory = os.environ.get('XDG_RUNTIME_DIR')
+        if not directory:
+            directory = os.path.join(tempfile.gettempdir(), 'ocrd-anybaseocr-%d' % os.getuid())
+        path = os.path.join(directory, 'ocrd-anybaseocr.sock')
+    return path
+
+def _key_path(path):
+    return path + '.key'
+
+def _check_owner(path, mask):
+    """Raise :py:class:`PermissionError` unless ``path`` belongs to the current user
+    and has none of the permission bits in ``mask``."""
+    stat = os.stat(path)
+    if stat.st_uid != os.getuid() or stat.st_mode & mask:
+        raise PermissionError("'%s' must belong to the current user (and not be accessible by others)" % path)
+
+def _import_loader(loader):
+    module, _, function = loader.partition(':')
+    if not (module == __package__ or module.startswith(__package__ + '.')) or not function:
+        raise ValueError("invalid model loader '%s'" % loader)
+    return getattr(importlib.import_module(module), function)
+
+def _portable(result):
+    """Make (tensor) results usable by clients without the same devices."""
+    if hasattr(result, 'detach') and hasattr(result, 'cpu'):
+        # torch tensors could be on the GPU
+        return result.detach().cpu()
+    return result
+
+class RemoteModel:
+    """Proxy to a model on the server, forwarding method calls."""
+
+    def __init__(self, connection, handle, name):
+        self._connection = connection
+        self._handle = handle
+        self._name = name
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        def _call(*args, **kwargs):
+            return self._request('call', self._handle, method, args, kwargs)
+        return _call
+
+    def __repr__(self):
+        return '<RemoteModel %s>' % self._name
+
+    def _request(self, *message):
+        with self._lock:
+            self._connection.send(message)
+            status, result = self._connection.recv()
+        if status == 'error':
+            raise result
+        return result
+
+def load_model(loader, **kwargs):
+    """Get the model ``loader(**kwargs)`` from the server, or else load it in-process.
+
+    ``loader`` is a function of this package as ``module:function``.
+    """
+    LOG = getLogger('processor.AnybaseocrModelServer')
+    path = socket_path()
+    if path and os.path.exists(path):
+        try:
+            # do not send requests to (or unpickle responses of) other users' servers
+            _check_owner(path, 0o077)
+            _check_owner(_key_path(path), 0o077)
+            with open(_key_path(path), 'rb') as key_file:
+                authkey = key_file.read()
+            connection = Client(path, family='AF_UNIX', authkey=authkey)
+        except (OSError, AuthenticationError) as err:
+            LOG.warning("cannot connect to model server at '%s' (%s), loading model in-process",
+                        path, err)
+        else:
+            model = RemoteModel(connection, None, loader)
+            model._handle = model._request('load', loader, kwargs) # pylint: disable=protected-access
+            LOG.info("using model %s of server at '%s'", loader, path)
+            return model
+    return _import_loader(loader)(**kwargs)
+
+class _Server:
+
+    def __init__(self):
+        self.models = {}
+        self.handles = {}
+        self.tasks = queue.Queue()
+
+    def _load(self, loader, kwargs):
+        LOG = getLogger('processor.AnybaseocrModelServer')
+        key = (loader, repr(sorted(kwargs.items())))
+        if key not in self.handles:
+            LOG.info("loading model %s with %s", loader, kwargs)
+            self.models[len(self.models)] = _import_loader(loader)(**kwargs)
+            self.handles[key] = len(self.models) - 1
+        return self.handles[key]
+
+    def _call(self, handle, method, args, kwargs):
+        result = getattr(self.models[handle], method)(*args, **kwargs)
+        if isinstance(result, (list, tuple)):
+            return type(result)(_portable(item) for item in result)
+        return _portable(result)
+
+    def _handle(self, message):
+        """Run the request ``message`` (in the main thread), return the response."""
+        try:
+            if message[0] == 'load':
+                return 'ok', self._load(*message[1:])
+            if message[0] == 'call':
+                return 'ok', self._call(*message[1:])
+            raise ValueError("invalid request '%s'" % message[0])
+        except Exception as err: # pylint: disable=broad-except
+            getLogger('processor.AnybaseocrModelServer').exception("request %s failed", message[0])
+            return 'error', err
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                response = queue.Queue(1)
+                self.tasks.put((message, response))
+                status, result = response.get()
+                try:
+                    connection.send((status, result))
+                except OSError:
+                    return
+                except Exception as err: # pylint: disable=broad-except
+                    # e.g. unpicklable exception
+                    connection.send(('error', RuntimeError(repr(err))))
+
+    def _accept(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except (EOFError, AuthenticationError, ConnectionError):
+                # client without the right key
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+    def run(self, path):
+        LOG = getLogger('processor.AnybaseocrModelServer')
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # others must not be able to replace the socket or key
+        _check_owner(directory, 0o022)
+        if os.path.exists(path):
+            try:
+                Client(path, family='AF_UNIX').close()
+            except OSError:
+                # stale socket file from a previous server
+                os.unlink(path)
+            else:
+                raise RuntimeError("another model server is already running at '%s'" % path)
+        # only accessible to the current user
+        authkey = os.urandom(32)
+        key_path = _key_path(path)
+        if os.path.exists(key_path):
+            os.unlink(key_path)
+        with os.fdopen(os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as key_file:
+            key_file.write(authkey)
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(path, family='AF_UNIX', authkey=authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+            LOG.info("model server listening at '%s'", path)
+            try:
+                while True:
+                    task = self.tasks.get()
+                    if task is None:
+                        break
+                    message, response = task
+                    response.put(self._handle(message))
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(key_path)
+            LOG.info("model server stopped")
+
+    def stop(self):
+        """Make :py:meth:`run` return (after the current request)."""
+        self.tasks.put(None)
+
+def serve(path=None):
+    """Run the model server on the socket ``path`` (default: :py:func:`socket_path`) until interrupted."""
+    _Server().run(path or socket_path())
@@ -23,11 +23,14 @@ setup(
             'ocrd-anybaseocr-binarize           = ocrd_anybaseocr.cli.ocrd_anybaseocr_binarize:cli',
             'ocrd-anybaseocr-deskew             = ocrd_anybaseocr.cli.ocrd_anybaseocr_deskew:cli',
             'ocrd-anybaseocr-crop               = ocrd_anybaseocr.cli.ocrd_anybaseocr_cropping:cli',
+            'ocrd-anybaseocr-preprocess         = ocrd_anybaseocr.cli.ocrd_anybaseocr_preprocess:cli',
             'ocrd-anybaseocr-dewarp             = ocrd_anybaseocr.cli.ocrd_anybaseocr_dewarp:cli',
             'ocrd-anybaseocr-tiseg              = ocrd_anybaseocr.cli.ocrd_anybaseocr_tiseg:cli',
             'ocrd-anybaseocr-textline           = ocrd_anybaseocr.cli.ocrd_anybaseocr_textline:cli',
             'ocrd-anybaseocr-layout-analysis    = ocrd_anybaseocr.cli.ocrd_anybaseocr_layout_analysis:cli',
-            'ocrd-anybaseocr-block-segmentation = ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation:cli'
+            'ocrd-anybaseocr-block-segmentation = ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation:cli',
+            'ocrd-anybaseocr-block-segmentation-export = ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation_export:cli',
+            'ocrd-anybaseocr-server             = ocrd_anybaseocr.cli.ocrd_anybaseocr_server:cli'
         ]
     },
 )
@@ -0,0 +1,392 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from scipy import ndimage
+from shapely.geometry import Polygon, box
+
+from ocrd import Resolver, Workspace
+from ocrd.processor.base import run_processor
+from ocrd_modelfactory import page_from_file
+from ocrd_utils import MIMETYPE_PAGE, pushd_popd
+
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import (
+    CLASS_NAMES, InferenceConfig, OcrdAnybaseocrBlockSegmenter,
+    compute_reading_order, extend_rois, mask_contour, suppress_overlaps)
+
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_tiseg import OcrdAnybaseocrTiseg
+
+from .base import TestCase, assets, main, copy_of_directory
+
+
+def mask_contour_full(mask, scale):
+    """the original contour search on a full page mask"""
+    mask = cv2.dilate(mask.astype(np.uint8),
+                      np.ones((scale,scale), np.uint8)) > 0
+    for _ in range(10):
+        mask = cv2.morphologyEx(mask.astype(np.uint8), cv2.MORPH_CLOSE,
+                                np.ones((scale,scale), np.uint8)) > 0
+        contours, _ = cv2.findContours(mask.astype(np.uint8),
+                                       cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE)
+        if len(contours) == 1:
+            break
+    return contours[0][:,0,:]
+
+def suppress_overlaps_loop(r, use_masks, min_share_drop, min_iou_drop, min_share_merge, min_iou_merge):
+    """the original fixed-point iteration over all pairs"""
+    worse = []
+    active = True
+    def _merge_rois(i, j):
+        """merges i into j"""
+        nonlocal r, active
+        r['rois'][j][0] = min(r['rois'][i][0], r['rois'][j][0])
+        r['rois'][j][1] = min(r['rois'][i][1], r['rois'][j][1])
+        r['rois'][j][2] = max(r['rois'][i][2], r['rois'][j][2])
+        r['rois'][j][3] = max(r['rois'][i][3], r['rois'][j][3])
+        r['polygons'][j] = r['polygons'][i].union(r['polygons'][j])
+        active = True
+    while active:
+        active = False
+        for i in range(len(r["class_ids"])):
+            if i in worse:
+                continue
+            for j in range(i + 1, len(r['class_ids'])):
+                if j in worse:
+                    continue
+                iname = CLASS_NAMES[r['class_ids'][i]]
+                jname = CLASS_NAMES[r['class_ids'][j]]
+                if (iname == 'drop-capital') != (jname == 'drop-capital'):
+                    continue
+                if (r['rois'][i][1] > r['rois'][j][3] or
+                    r['rois'][i][3] < r['rois'][j][1] or
+                    r['rois'][i][0] > r['rois'][j][2] or
+                    r['rois'][i][2] < r['rois'][j][0]):
+                    continue
+                iscore = r['scores'][i]
+                jscore = r['scores'][j]
+                if not use_masks:
+                    if iscore < jscore:
+                        worse.append(i)
+                        break
+                    worse.append(j)
+                    continue
+                ipoly = r['polygons'][i]
+                jpoly = r['polygons'][j]
+                isize = ipoly.area
+                jsize = jpoly.area
+                inter = ipoly.intersection(jpoly).area
+                union = ipoly.union(jpoly).area
+                if inter / isize > min_share_drop:
+                    worse.append(i)
+                    break
+                elif inter / jsize > min_share_drop:
+                    worse.append(j)
+                elif inter / union > min_iou_drop:
+                    if iscore < jscore:
+                        worse.append(i)
+                        break
+                    worse.append(j)
+                elif inter / isize > min_share_merge:
+                    worse.append(i)
+                    _merge_rois(i, j)
+                    break
+                elif inter / jsize > min_share_merge:
+                    worse.append(j)
+                    _merge_rois(j, i)
+                elif inter / union > min_iou_merge:
+                    if iscore < jscore:
+                        worse.append(i)
+                        _merge_rois(i, j)
+                        break
+                    worse.append(j)
+                    _merge_rois(j, i)
+    return set(worse)
+
+def random_detections(rng, count):
+    rois = []
+    polygons = []
+    for _ in range(count):
+        y1, x1 = rng.integers(0, 1000, 2)
+        y2, x2 = y1 + rng.integers(5, 200), x1 + rng.integers(5, 300)
+        rois.append([y1, x1, y2, x2])
+        # some polygon within the box
+        polygons.append(box(x1, y1, x2, y2).buffer(-rng.random() * 2, join_style=2)
+                        if rng.random() < 0.5 else
+                        Polygon([(x1, y1), (x2, y1 + (y2 - y1) // 3), (x2, y2), (x1 + (x2 - x1) // 2, y2)]))
+    return {'rois': np.array(rois, np.int32),
+            'class_ids': rng.integers(1, len(CLASS_NAMES), count),
+            'scores': rng.random(count),
+            'polygons': polygons}
+
+def reading_order_loop(rois):
+    """the original pairwise partial order with recursive topological sort"""
+    partial_order = np.zeros((len(rois), len(rois)), np.uint8)
+    for i, (min_y_i, min_x_i, max_y_i, max_x_i) in enumerate(rois):
+        for j, (min_y_j, min_x_j, max_y_j, max_x_j) in enumerate(rois):
+            if min_x_i < max_x_j and max_x_i > min_x_j:
+                # xoverlaps
+                if min_y_i < min_y_j:
+                    partial_order[i, j] = 1
+            else:
+                min_y = min(min_y_i, min_y_j)
+                max_y = max(max_y_i, max_y_j)
+                min_x = min(min_x_i, min_x_j)
+                max_x = max(max_x_i, max_x_j)
+                if next((False for (min_y_k, min_x_k, max_y_k, max_x_k) in rois
+                         if (min_y_k < max_y and max_y_k > min_y and
+                             min_x_k < max_x and max_x_k > min_x)),
+                        True):
+                    # no k in between
+                    if ((min_y_j + max_y_j)/2 < min_y_i and
+                        (min_y_i + max_y_i)/2 > max_y_j):
+                        # vertically unrelated
+                        partial_order[j, i] = 1
+                    elif max_x_i < min_x_j:
+                        partial_order[i, j] = 1
+    visited = np.zeros(partial_order.shape[0], bool)
+    result = list()
+    def _visit(k):
+        if visited[k]:
+            return
+        visited[k] = True
+        for l in np.nonzero(partial_order[:, k])[0]:
+            _visit(l)
+        result.append(k)
+    for k in range(partial_order.shape[0]):
+        _visit(k)
+    return result
+
+def extend_rois_loop(mask, rois, th):
+    """the original window search for each left over pixel, repeated until no change"""
+    mask = mask.astype(int)
+    for i in range(len(rois)):
+        min_y, min_x, max_y, max_x = rois[i]
+        mask[min_y:max_y, min_x:max_x] *= i+2
+    pixel_added = True
+    while pixel_added:
+        pixel_added = False
+        left_over = np.where(mask == 1)
+        for y, x in zip(left_over[0], left_over[1]):
+            local_mask = mask[y-th:y+th, x-th:x+th]
+            candidates = np.where(local_mask > 1)
+            candidates = [k for k in zip(candidates[0], candidates[1])]
+            if len(candidates) > 0:
+                pixel_added = True
+                candidates.sort(key=lambda j: np.sqrt((j[0]-th)**2+(j[1]-th)**2))
+                index = local_mask[candidates[0]]-2
+                if y < rois[index][0]:
+                    rois[index][0] = y
+                elif y > rois[index][2]:
+                    rois[index][2] = y
+                if x < rois[index][1]:
+                    rois[index][1] = x
+                elif x > rois[index][3]:
+                    rois[index][3] = x
+                mask[y, x] = index + 2
+    return rois
+
+def random_strokes(rng, cells, cell=100, margin=40, length=15, step=3):
+    """boxes in a grid of cells, with strokes of foreground pixels leaving them"""
+    foreground = np.zeros((cells * cell, cells * cell), bool)
+    rois = []
+    for cy in range(cells):
+        for cx in range(cells):
+            y1, x1 = cy * cell + margin, cx * cell + margin
+            y2, x2 = y1 + rng.integers(2, cell - 2 * margin), x1 + rng.integers(2, cell - 2 * margin)
+            rois.append([y1, x1, y2, x2])
+            foreground[y1:y2, x1:x2] = rng.random((y2 - y1, x2 - x1)) < 0.5
+            for _ in range(rng.integers(0, 4)):
+                # random walk from the box outwards
+                y, x = rng.integers(y1, y2), rng.integers(x1, x2)
+                foreground[y, x] = True
+                for _ in range(rng.integers(1, 20)):
+                    y = np.clip(y + rng.integers(-step, step + 1), y1 - length, y2 + length)
+                    x = np.clip(x + rng.integers(-step, step + 1), x1 - length, x2 + length)
+                    foreground[y, x] = True
+            # an isolated pixel far from everything
+            foreground[cy * cell + 1, cx * cell + 1] = True
+    return foreground, np.array(rois, np.int32)
+
+def block_rois(foreground, gap=13, shrink=10):
+    """boxes of text blocks (components closed over ``gap``), shrunk to leave pixels over"""
+    blocks, _ = ndimage.label(cv2.dilate(foreground.astype(np.uint8), np.ones((gap, gap), np.uint8)))
+    rois = [[ys.start + shrink, xs.start + shrink, ys.stop - shrink, xs.stop - shrink]
+            for ys, xs in ndimage.find_objects(blocks)
+            if ys.stop - ys.start > 2 * shrink and xs.stop - xs.start > 2 * shrink]
+    return np.array(rois, np.int32).reshape(-1, 4)
+
+def random_pages(rng, count, height=600, width=400):
+    """white RGB pages with some black blocks of text-like stripes"""
+    pages = []
+    for _ in range(count):
+        page = np.full((height, width), 255, np.uint8)
+        for _ in range(rng.integers(2, 6)):
+            y1, x1 = rng.integers(0, height - 100), rng.integers(0, width - 100)
+            y2, x2 = y1 + rng.integers(20, 100), x1 + rng.integers(20, 100)
+            page[y1:y2:4, x1:x2] = 0
+        pages.append(np.stack((page,) * 3, axis=-1))
+    return pages
+
+class BlockSegmentationTest(TestCase):
+
+    def test_suppress_overlaps(self):
+        rng = np.random.default_rng(0)
+        params = (0.9, 0.8, 0.6, 0.1)
+        for _ in range(30):
+            r = random_detections(rng, rng.integers(1, 80))
+            expected = dict(r, rois=r['rois'].copy(), polygons=list(r['polygons']))
+            for use_masks in (True, False):
+                worse = suppress_overlaps(r, use_masks, *params)
+                self.assertEqual(worse, suppress_overlaps_loop(expected, use_masks, *params))
+                self.assertTrue(np.array_equal(r['rois'], expected['rois']))
+                self.assertEqual([p.wkt for p in r['polygons']],
+                                 [p.wkt for p in expected['polygons']])
+
+    def test_reading_order(self):
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            rois = random_detections(rng, rng.integers(0, 60))['rois']
+            if rng.random() < 0.3:
+                # some empty boxes (lines and points)
+                empty = rng.random(len(rois)) < 0.5
+                rois[empty, 2] = rois[empty, 0] + rng.integers(0, 2, np.count_nonzero(empty))
+                rois[empty, 3] = rois[empty, 1]
+            self.assertEqual(compute_reading_order(rois), reading_order_loop(rois))
+
+    def test_extend_rois(self):
+        rng = np.random.default_rng(0)
+        for _ in range(10):
+            foreground, rois = random_strokes(rng, rng.integers(1, 4))
+            expected = extend_rois_loop(foreground, rois.copy(), 10)
+            self.assertTrue(np.array_equal(extend_rois(foreground, rois, 10), expected))
+        # a dotted chain from box A which ends near box B (but more than th away)
+        # belongs to A only, even though B is nearer to its end than A
+        foreground = np.zeros((100, 350), bool)
+        foreground[20:40, 10:40] = True
+        foreground[30, 40:301:8] = True
+        foreground[60:80, 290:330] = True
+        rois = np.array([[20, 10, 40, 40], [60, 290, 80, 330]])
+        expected = extend_rois_loop(foreground, rois.copy(), 10)
+        self.assertEqual(expected.tolist(), [[20, 10, 40, 296], [60, 290, 80, 330]])
+        self.assertTrue(np.array_equal(extend_rois(foreground, rois, 10), expected))
+
+    def test_extend_rois_tiseg(self):
+        # on the text part of real pages (rule-based tiseg), the distance transform
+        # (with round neighbourhoods) and the window search (square ones) mostly agree
+        with copy_of_directory(assets.path_to('dfki-testdata/data')) as wsdir:
+            resolver = Resolver()
+            run_processor(OcrdAnybaseocrTiseg,
+                          resolver=resolver,
+                          mets_url=str(Path(wsdir, 'mets.xml')),
+                          input_file_grp='BIN',
+                          output_file_grp='TISEG-TEST',
+                          parameter={'use_deeplr': False})
+            ws = Workspace(resolver, wsdir)
+            differences = []
+            with pushd_popd(wsdir):
+                for input_file in ws.mets.find_all_files(fileGrp='TISEG-TEST', mimetype=MIMETYPE_PAGE):
+                    page = page_from_file(ws.download_file(input_file)).get_Page()
+                    text_image, _, _ = ws.image_from_page(page, input_file.pageId, feature_selector='clipped')
+                    # keep the pixel-by-pixel reference fast enough
+                    foreground = (np.array(text_image.convert('L')) < 128)[::2, ::2]
+                    rois = block_rois(foreground)
+                    expected = extend_rois_loop(foreground, rois.copy(), 15)
+                    extended = extend_rois(foreground, rois.copy(), 15)
+                    # both only ever grow the boxes
+                    self.assertTrue(np.all(extended[:, :2] <= rois[:, :2]))
+                    self.assertTrue(np.all(extended[:, 2:] >= rois[:, 2:]))
+                    differences.append(np.abs(extended - expected))
+            differences = np.concatenate(differences)
+            self.assertGreater(len(differences), 0)
+            # at most 1 in 10 boxes with different extents, by at most 3 window sizes
+            self.assertLessEqual(np.mean(differences.any(axis=1)), 0.1)
+            self.assertLessEqual(differences.max(), 45)
+
+    def test_mask_contour(self):
+        rng = np.random.default_rng(0)
+        for _ in range(300):
+            height, width = rng.integers(20, 200, 2)
+            y1, x1 = rng.integers(0, height - 1), rng.integers(0, width - 1)
+            y2, x2 = rng.integers(y1 + 1, height + 1), rng.integers(x1 + 1, width + 1)
+            mask = rng.random((y2 - y1, x2 - x1)) < rng.random() * 0.3
+            mask[rng.integers(0, y2 - y1), rng.integers(0, x2 - x1)] = True
+            full_mask = np.zeros((height, width), bool)
+            full_mask[y1:y2, x1:x2] = mask
+            scale = int(rng.integers(0, 6)) * 2 + 1
+            self.assertTrue(np.array_equal(mask_contour(mask, (y1, x1), (height, width), scale),
+                                           mask_contour_full(full_mask, scale)))
+
+    def test_mold_inputs_fast(self):
+        # same windows and metadata, and close pixels (area instead of bilinear interpolation)
+        pytest.importorskip('tensorflow')
+        from ocrd_anybaseocr.mrcnn import model as modellib
+        self.assertFalse(InferenceConfig(0.9, 1).IMAGE_RESIZE_FAST)
+        self.assertTrue(InferenceConfig(0.9, 1, resize_fast=True).IMAGE_RESIZE_FAST)
+        config = InferenceConfig(0.9, 1)
+        # molding only needs the config
+        mrcnn_model = modellib.MaskRCNN.__new__(modellib.MaskRCNN)
+        mrcnn_model.config = config
+        rng = np.random.default_rng(0)
+        # scaled down, scaled up (to IMAGE_MIN_DIM or IMAGE_MAX_DIM), and not scaled
+        for height, width in [(2200, 1500), (1500, 2300), (300, 200), (500, 700), (1024, 700)]:
+            smooth = ndimage.gaussian_filter(rng.random((height, width, 3)), (8, 8, 0))
+            smooth = (255 * (smooth - smooth.min()) / np.ptp(smooth)).astype(np.uint8)
+            text = random_pages(rng, 1, height, width)[0]
+            for page, tolerance in [(smooth, 8), (text, None)]:
+                config.IMAGE_RESIZE_FAST = False
+                molded, metas, windows = mrcnn_model.mold_inputs([page])
+                config.IMAGE_RESIZE_FAST = True
+                fast_molded, fast_metas, fast_windows = mrcnn_model.mold_inputs([page])
+                self.assertTrue(np.array_equal(windows, fast_windows))
+                self.assertTrue(np.array_equal(metas, fast_metas))
+                self.assertEqual(fast_molded.dtype, np.float32)
+                self.assertEqual(molded.shape, fast_molded.shape)
+                difference = np.abs(molded - fast_molded)[0]
+                y1, x1, y2, x2 = windows[0]
+                # same padding
+                self.assertLess(difference[:y1].max(initial=0), 1e-3)
+                self.assertLess(difference[y2:].max(initial=0), 1e-3)
+                self.assertLess(difference[:, :x1].max(initial=0), 1e-3)
+                self.assertLess(difference[:, x2:].max(initial=0), 1e-3)
+                # skimage interpolates the outermost pixels with the black border
+                difference = difference[y1 + 2:y2 - 2, x1 + 2:x2 - 2]
+                if tolerance:
+                    self.assertLessEqual(difference.max(), tolerance)
+                else:
+                    # sharp edges (and aliasing stripes) differ, but not the local averages
+                    self.assertLess(difference.mean(), 5)
+                    signed = (molded - fast_molded)[0, y1 + 2:y2 - 2, x1 + 2:x2 - 2].mean(axis=-1)
+                    self.assertLess(np.abs(ndimage.uniform_filter(signed, 16)).max(), 20)
+
+    def test_batch_size(self):
+        # same detections with and without batching (with random weights)
+        pytest.importorskip('tensorflow')
+        from unittest import mock
+        from pkg_resources import resource_filename
+        from ocrd_anybaseocr.mrcnn import model as modellib
+        pages = random_pages(np.random.default_rng(0), 4)
+        results = {}
+        weights = None
+        for batch_size in (1, 3):
+            mrcnn_model = modellib.MaskRCNN(mode='inference',
+                                            model_dir=resource_filename('ocrd_anybaseocr', 'mrcnn'),
+                                            config=InferenceConfig(0.0, batch_size))
+            if weights is None:
+                weights = mrcnn_model.keras_model.get_weights()
+            else:
+                mrcnn_model.keras_model.set_weights(weights)
+            with mock.patch.object(OcrdAnybaseocrBlockSegmenter, 'setup'):
+                processor = OcrdAnybaseocrBlockSegmenter(None, parameter={'batch_size': batch_size})
+            processor.mrcnn_model = mrcnn_model
+            results[batch_size] = processor._detect(pages)
+        self.assertEqual(len(results[3]), len(pages))
+        for single, batched in zip(results[1], results[3]):
+            self.assertTrue(np.array_equal(single['class_ids'], batched['class_ids']))
+            self.assertTrue(np.allclose(single['scores'], batched['scores'], atol=1e-4))
+            self.assertLessEqual(np.abs(single['rois'] - batched['rois']).max(initial=0), 1)
+
+if __name__ == "__main__":
+    main(__file__)
@@ -0,0 +1,35 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import numpy as np
+from scipy.ndimage import interpolation
+
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_deskew import projection_skew_estimates
+
+from .base import TestCase, main
+
+
+def synthetic_page(angle, seed=0):
+    """draw rows of random glyph boxes, rotate by angle and crop the margins"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((800, 600))
+    for y in range(60, 740, 30):
+        for x in range(50, 550, 11):
+            if rng.random() < 0.8:
+                image[y:y+rng.integers(6, 12), x:x+rng.integers(4, 8)] = 1
+    image = interpolation.rotate(image, angle, order=0, reshape=False)
+    return image[80:-80, 60:-60]
+
+class AnyocrDeskewerTest(TestCase):
+
+    def test_projection_skew_estimates(self):
+        angles = np.linspace(-1, 1, 17)
+        for angle in [-0.7, -0.2, 0.3, 0.6]:
+            image = synthetic_page(angle)
+            rotated = [(np.var(np.mean(interpolation.rotate(
+                image, a, order=0, mode='constant'), axis=1)), a)
+                       for a in angles]
+            projected = projection_skew_estimates(image, angles)
+            self.assertLessEqual(abs(max(rotated)[1] - max(projected)[1]),
+                                 angles[1] - angles[0])
+
+if __name__ == "__main__":
+    main(__file__)
@@ -34,6 +34,147 @@ class AnyocrDewarperTest(TestCase):
             pagexml_after = len(ws.mets.find_all_files(mimetype=MIMETYPE_PAGE))
             self.assertEqual(pagexml_after, pagexml_before + 1)
 
+    def test_collate_by_size(self):
+        from ocrd_anybaseocr.pix2pixhd_model import collate_by_size
+        items = [{'label': torch.zeros(3, height, 4), 'path': '', 'index': index,
+                  'inst': 0, 'image': 0, 'feat': 0}
+                 for index, height in enumerate([4, 8, 4])]
+        batches = collate_by_size(items)
+        self.assertEqual([batch['index'].tolist() for batch in batches], [[0, 2], [1]])
+        self.assertEqual(tuple(batches[0]['label'].shape), (2, 3, 4, 4))
+        self.assertEqual(tuple(batches[1]['inst'].shape), (1,))
+
+    def test_tiled_inference(self):
+        from PIL import Image
+        import numpy as np
+        from ocrd_anybaseocr.pix2pixhd_model import tiled_inference
+        class Identity:
+            def inference(self, label, inst, image): # pylint: disable=unused-argument
+                return label
+        array = np.random.default_rng(0).integers(0, 256, (300, 200), dtype=np.uint8)
+        for tile_size, overlap, batch_size in [(128, 32, 1), (64, 16, 3), (512, 128, 2)]:
+            result = tiled_inference(Identity(), Image.fromarray(array), tile_size, overlap,
+                                     batch_size=batch_size)
+            self.assertEqual(result.shape, array.shape)
+            self.assertLessEqual(np.abs(result.astype(int) - array).max(), 1)
+        with self.assertRaises(ValueError):
+            tiled_inference(Identity(), Image.fromarray(array), 100, 16)
+
+    def test_tensor2gray(self):
+        import numpy as np
+        from ocrd_anybaseocr.pix2pixhd_model import tensor2gray
+        # within the range of the generator's tanh output
+        generated = torch.rand(2, 3, 16, 8) * 2 - 1
+        # channel mean of pix2pixHD's tensor2im
+        expected = np.clip((generated.numpy().transpose(0, 2, 3, 1) + 1) / 2 * 255, 0, 255)
+        expected = expected.astype(np.uint8).mean(axis=-1)
+        gray = tensor2gray(generated)
+        self.assertEqual(gray.dtype, np.uint8)
+        self.assertEqual(gray.shape, (2, 16, 8))
+        self.assertLessEqual(np.abs(gray - expected).max(), 1)
+        self.assertEqual(tensor2gray(generated[0]).shape, (16, 8))
+
+    def test_rebinarize(self):
+        # compare with the former RGB post-processing (tensor2im, RGB resize, RGB midrange)
+        from unittest import mock
+        import numpy as np
+        from PIL import Image
+        import ocrolib
+        from pix2pixhd.util.util import tensor2im
+        from ocrd_anybaseocr.pix2pixhd_model import tensor2gray
+        generator = torch.Generator().manual_seed(0)
+        pattern = (torch.rand(1, 1, 32, 24, generator=generator) > 0.5).float() * 2 - 1
+        pattern = torch.nn.functional.interpolate(pattern, size=(128, 96), mode='bilinear')[0]
+        with mock.patch.object(OcrdAnybaseocrDewarper, 'setup'):
+            processor = OcrdAnybaseocrDewarper(None, parameter={})
+        for noise, tolerance in [(0, 0), (0.05, 0.01)]:
+            generated = (pattern.expand(3, -1, -1) +
+                         noise * torch.randn(3, 128, 96, generator=generator)).clamp(-1, 1)
+            expected = np.array(Image.fromarray(tensor2im(generated)).resize((150, 200), Image.BICUBIC))
+            expected = expected.mean(axis=2) > ocrolib.midrange(expected)
+            with mock.patch('ocrd_anybaseocr.cli.ocrd_anybaseocr_dewarp.save_image_file') as save:
+                processor._process_segment(tensor2gray(generated), mock.Mock(), {'features': ''},
+                                           (150, 200), None, 'FILE')
+            result = np.asarray(save.call_args.args[1])
+            self.assertEqual(result.shape, (200, 150))
+            self.assertLessEqual(np.mean(result != expected), tolerance)
+
+    def test_stages(self):
+        # load_page -> predict_pages -> write_page, with an identity generator
+        from unittest import mock
+        import numpy as np
+        from PIL import Image
+        from ocrd_utils import pushd_popd
+        from ocrd_anybaseocr.cli.ocrd_anybaseocr_binarize import OcrdAnybaseocrBinarizer
+        from ocrd_anybaseocr.pix2pixhd_model import Dewarper, prepare_options
+        class Identity:
+            def inference(self, label, inst, image): # pylint: disable=unused-argument
+                return label
+        with pushd_popd(tempdir=True) as wsdir:
+            ws = self.resolver.workspace_from_nothing(directory=wsdir)
+            array = np.full((300, 200), 220, np.uint8)
+            array[50:250:20, 20:180] = 20
+            Image.fromarray(array).save(Path(wsdir, 'page.png'))
+            ws.add_file('IMG', ID='IMG_0001', pageId='PHYS_0001', mimetype='image/png',
+                        local_filename='page.png')
+            ws.save_mets()
+            run_processor(OcrdAnybaseocrBinarizer, resolver=self.resolver,
+                          mets_url=str(Path(wsdir, 'mets.xml')),
+                          input_file_grp='IMG', output_file_grp='BIN')
+            ws.reload_mets()
+            with mock.patch.object(OcrdAnybaseocrDewarper, 'setup'):
+                processor = OcrdAnybaseocrDewarper(ws, input_file_grp='BIN', output_file_grp='DEW',
+                                                   parameter={'batch_size': 2})
+            opt = prepare_options(gpu_id=-1, model_path=str(Path(wsdir, 'model', 'latest_net_G.pth')),
+                                  resize_or_crop='resize_and_crop', loadSize=128, fineSize=128)
+            processor.model = Dewarper(Identity(), opt)
+            input_file = next(iter(processor.input_files))
+            states = processor.predict_pages([processor.load_page(0, input_file)])
+            pcgts = processor.write_page(states[0])
+            images = pcgts.get_Page().get_AlternativeImage()
+            self.assertIn('dewarped', images[-1].get_comments())
+            dewarped = Image.open(Path(wsdir, images[-1].get_filename()))
+            self.assertEqual(dewarped.size, (200, 300))
+
+    def test_compile_model(self):
+        from tempfile import TemporaryDirectory
+        from types import SimpleNamespace
+        from ocrd_anybaseocr.pix2pixhd_model import compile_model
+        torch.manual_seed(0)
+        model = SimpleNamespace(netG=torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3, padding=1), torch.nn.ReLU(),
+            torch.nn.Conv2d(8, 3, 3, padding=1), torch.nn.Tanh()))
+        label = torch.rand(2, 3, 64, 128) * 2 - 1
+        with torch.no_grad():
+            expected = model.netG(label)
+        with TemporaryDirectory() as tempdir:
+            model_path = Path(tempdir, 'latest_net_G.pth')
+            model_path.touch()
+            device = torch.device('cpu')
+            for _ in range(2):
+                compiled = compile_model(model, model_path, device)
+                generated = compiled.inference(label, None, None)
+                self.assertTrue(torch.allclose(generated, expected, atol=1e-5))
+                self.assertTrue(Path(tempdir, 'latest_net_G.cpu.float32.ts').is_file())
+
+    def test_num_threads(self):
+        # limited during predict only (process-wide, so shared by all models of a server)
+        from PIL import Image
+        from ocrd_anybaseocr.pix2pixhd_model import Dewarper
+        class Threads:
+            def inference(self, label, inst, image): # pylint: disable=unused-argument
+                threads.append(torch.get_num_threads())
+                return label
+        threads = []
+        previous = torch.get_num_threads()
+        dewarper = Dewarper(Threads(), None)
+        dewarper.predict([Image.new('L', (64, 64), 255)], tile_size=64, num_threads=1)
+        self.assertEqual(threads, [1])
+        self.assertEqual(torch.get_num_threads(), previous)
+        with self.assertRaises(ValueError):
+            dewarper.predict([Image.new('L', (64, 64), 255)], tile_size=60, num_threads=1)
+        self.assertEqual(torch.get_num_threads(), previous)
+
 if __name__ == "__main__":
     main(__file__)
 
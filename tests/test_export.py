@@ -0,0 +1,151 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from .base import TestCase, main
+
+pytest.importorskip('tensorflow')
+
+# pylint: disable=wrong-import-position
+from ocrd_anybaseocr.tensorflow_importer import tf
+from ocrd_anybaseocr.mrcnn import model as modellib
+from ocrd_anybaseocr.mrcnn.export import FrozenMaskRCNN, quantize_weights, _freeze
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import InferenceConfig
+
+
+def matmul_graph(weights, bias):
+    """GraphDef of x @ weights + bias (with float32 constants)"""
+    graph = tf.Graph()
+    with graph.as_default():
+        inputs = tf.placeholder(tf.float32, (None, weights.shape[0]), name='inputs')
+        tf.add(tf.matmul(inputs, tf.constant(weights, name='weights')),
+               tf.constant(bias, name='bias'), name='outputs')
+    return graph.as_graph_def()
+
+def run_graph(graph_def, inputs, names=('outputs',)):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    with tf.Session(graph=graph) as session:
+        return session.run([name + ':0' for name in names], feed_dict={'inputs:0': inputs})
+
+def detections(rng, count, shape=(50, 40)):
+    """detect results with ``count`` instances, as full and as compact masks"""
+    ys = np.sort(rng.integers(0, shape[0], (count, 2)), axis=1)
+    xs = np.sort(rng.integers(0, shape[1], (count, 2)), axis=1)
+    rois = np.stack([ys[:, 0], xs[:, 0], ys[:, 1] + 1, xs[:, 1] + 1], axis=1)
+    scores = rng.random(count).astype(np.float32)
+    full_masks = np.zeros(shape + (count,), bool)
+    compact_masks = []
+    for i, (y1, x1, y2, x2) in enumerate(rois):
+        mask = rng.random((y2 - y1, x2 - x1)) < 0.5
+        full_masks[y1:y2, x1:x2, i] = mask
+        compact_masks.append(mask)
+    result = {'rois': rois,
+              'class_ids': rng.integers(1, 6, count).astype(np.int32),
+              'scores': scores}
+    return (dict(result, masks=full_masks),
+            dict(result, masks=compact_masks, mask_offsets=rois[:, :2].copy()))
+
+class ExportTest(TestCase):
+
+    def test_freeze(self):
+        # resource variables, also when read within a while loop (like in TimeDistributed)
+        rng = np.random.default_rng(0)
+        weights = rng.normal(0, 1, (8, 8)).astype(np.float32)
+        bias = rng.normal(0, 1, 8).astype(np.float32)
+        inputs = rng.normal(0, 1, (3, 8)).astype(np.float32)
+        graph = tf.Graph()
+        with graph.as_default():
+            placeholder = tf.placeholder(tf.float32, (None, 8), name='inputs')
+            weights_variable = tf.Variable(weights, use_resource=True, name='weights')
+            bias_variable = tf.Variable(bias, use_resource=True, name='bias')
+            _, result = tf.while_loop(
+                lambda i, x: i < 3,
+                lambda i, x: (i + 1, tf.tanh(tf.matmul(x, weights_variable.read_value()))),
+                [tf.constant(0), placeholder])
+            tf.add(result, bias_variable, name='outputs')
+            with tf.Session(graph=graph) as session:
+                session.run(tf.global_variables_initializer())
+                outputs, = session.run(['outputs:0'], feed_dict={placeholder: inputs})
+                frozen = _freeze(session, graph.as_graph_def(), ['outputs'])
+        ops = {node.op for node in frozen.node}
+        self.assertNotIn('VarHandleOp', ops)
+        self.assertNotIn('ReadVariableOp', ops)
+        frozen_outputs, = run_graph(frozen, inputs)
+        self.assertTrue(np.allclose(frozen_outputs, outputs, atol=1e-6))
+
+    def test_quantize_weights(self):
+        rng = np.random.default_rng(0)
+        weights = rng.normal(0, 1, (64, 32)).astype(np.float32)
+        bias = rng.normal(0, 1, 32).astype(np.float32)
+        inputs = rng.normal(0, 1, (5, 64)).astype(np.float32)
+        graph_def = matmul_graph(weights, bias)
+        outputs, = run_graph(graph_def, inputs)
+        for mode in ['float16', 'int8']:
+            quantized = quantize_weights(graph_def, mode)
+            ops = {node.name: node.op for node in quantized.node}
+            # same names for the consumers
+            self.assertEqual(ops['weights'], 'Cast' if mode == 'float16' else 'Dequantize')
+            # too small to be quantized
+            self.assertEqual(ops['bias'], 'Const')
+            restored, restored_bias, quantized_outputs = run_graph(
+                quantized, inputs, ('weights', 'bias', 'outputs'))
+            self.assertEqual(restored.dtype, np.float32)
+            self.assertTrue(np.array_equal(restored_bias, bias))
+            if mode == 'float16':
+                self.assertTrue(np.array_equal(restored, weights.astype(np.float16)))
+            else:
+                step = (weights.max() - weights.min()) / 255
+                self.assertLessEqual(np.abs(restored - weights).max(), step / 2 * 1.001)
+            error = np.abs(restored - weights).max()
+            # each output sums 64 products with weight errors of at most error
+            self.assertLessEqual(np.abs(quantized_outputs - outputs).max(),
+                                 error * np.abs(inputs).sum(axis=1).max() + 1e-4)
+        with self.assertRaises(ValueError):
+            quantize_weights(graph_def, 'int4')
+
+    def test_frozen_detect(self):
+        # a higher minimum confidence than exported gets applied to all results
+        rng = np.random.default_rng(0)
+        config = InferenceConfig(0.5, 2)
+        model = FrozenMaskRCNN.__new__(FrozenMaskRCNN)
+        model.config = config
+        model.export_info = {'min_confidence': 0.0}
+        for compact_masks in [False, True]:
+            results = [detections(rng, count)[compact_masks] for count in (7, 0)]
+            expected = []
+            for result in results:
+                keep = result['scores'] >= 0.5
+                expected.append({key: [value[i] for i in np.flatnonzero(keep)]
+                                 if key == 'masks' and compact_masks else
+                                 value[:, :, keep] if key == 'masks' else value[keep]
+                                 for key, value in result.items()})
+            with mock.patch.object(modellib.MaskRCNN, 'detect', return_value=results):
+                filtered = model.detect([None, None], compact_masks=compact_masks)
+            self.assertEqual(len(filtered), 2)
+            for result, expect in zip(filtered, expected):
+                self.assertEqual(set(result), set(expect))
+                self.assertTrue(np.all(result['scores'] >= 0.5))
+                for key in ['rois', 'class_ids', 'scores', 'mask_offsets']:
+                    if key in expect:
+                        self.assertTrue(np.array_equal(result[key], expect[key]))
+                if compact_masks:
+                    self.assertEqual(len(result['masks']), len(result['rois']))
+                    for mask, expect_mask, (y1, x1, y2, x2) in zip(
+                            result['masks'], expect['masks'], result['rois']):
+                        self.assertEqual(mask.shape, (y2 - y1, x2 - x1))
+                        self.assertTrue(np.array_equal(mask, expect_mask))
+                else:
+                    self.assertEqual(result['masks'].shape[-1], len(result['rois']))
+                    self.assertTrue(np.array_equal(result['masks'], expect['masks']))
+        # nothing to filter
+        model.export_info = {'min_confidence': 0.5}
+        results = [detections(rng, 5)[0]]
+        with mock.patch.object(modellib.MaskRCNN, 'detect', return_value=results):
+            self.assertIs(model.detect([None])[0], results[0])
+
+if __name__ == '__main__':
+    main(__file__)
@@ -0,0 +1,80 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import io
+
+import numpy as np
+from PIL import Image
+
+from ocrd_anybaseocr.imagefile import encode_image, save_image_file, pil2array
+
+from .base import TestCase, main
+
+
+def random_bilevel(shape=(120, 90), seed=0):
+    rng = np.random.default_rng(seed)
+    return np.where(rng.random(shape) < 0.3, np.uint8(0), np.uint8(255))
+
+class RecordingWorkspace:
+    overwrite_mode = False
+
+    def __init__(self):
+        self.files = []
+        self.images = {}
+
+    def add_file(self, file_grp, content=None, **kwargs):
+        self.files.append((file_grp, content, kwargs))
+
+    def cache_image(self, file_path, image):
+        self.images[file_path] = image
+
+class ImageFileTest(TestCase):
+
+    def test_roundtrip(self):
+        array = random_bilevel()
+        for output_format, mimetype in [('png', 'image/png'),
+                                        ('png-1bit', 'image/png'),
+                                        ('tiff-g4', 'image/tiff')]:
+            content, result_mimetype = encode_image(Image.fromarray(array), output_format)
+            self.assertEqual(result_mimetype, mimetype)
+            image = Image.open(io.BytesIO(content))
+            self.assertEqual(image.mode, 'L' if output_format == 'png' else '1')
+            self.assertTrue(np.array_equal(pil2array(image), array))
+        with self.assertRaises(ValueError):
+            encode_image(Image.fromarray(array), 'jpeg')
+
+    def test_threshold(self):
+        array = np.array([[0, 127, 128, 255]], np.uint8)
+        content, _ = encode_image(Image.fromarray(array), 'png-1bit')
+        self.assertEqual(pil2array(Image.open(io.BytesIO(content))).tolist(),
+                         [[0, 0, 255, 255]])
+
+    def test_smaller(self):
+        image = Image.fromarray(random_bilevel((400, 300)))
+        size = len(encode_image(image, 'png')[0])
+        self.assertLess(len(encode_image(image, 'png-1bit')[0]), size)
+        self.assertLess(len(encode_image(image, 'png-1bit', compression=9)[0]),
+                        len(encode_image(image, 'png-1bit', compression=1)[0]))
+
+    def test_save_image_file(self):
+        workspace = RecordingWorkspace()
+        file_path = save_image_file(workspace, Image.fromarray(random_bilevel()),
+                                    'FILE_0001', 'OUT', page_id='PHYS_0001',
+                                    output_format='tiff-g4')
+        self.assertEqual(file_path, 'OUT/FILE_0001.tif')
+        (file_grp, content, kwargs), = workspace.files
+        self.assertEqual(file_grp, 'OUT')
+        self.assertEqual(kwargs['mimetype'], 'image/tiff')
+        self.assertEqual(kwargs['pageId'], 'PHYS_0001')
+        self.assertEqual(Image.open(io.BytesIO(content)).mode, '1')
+        self.assertEqual(workspace.images[file_path].mode, '1')
+
+    def test_pil2array(self):
+        array = random_bilevel()
+        for mode in ['1', 'L', 'RGB']:
+            result = pil2array(Image.fromarray(array).convert(mode))
+            self.assertEqual(result.dtype, np.uint8)
+            expected = array if mode != 'RGB' else np.stack([array] * 3, axis=-1)
+            self.assertTrue(np.array_equal(result, expected))
+            self.assertTrue(result.flags.writeable)
+
+if __name__ == '__main__':
+    main(__file__)
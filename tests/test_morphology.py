@@ -0,0 +1,82 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import numpy as np
+from scipy import ndimage
+
+from ocrd_anybaseocr.morphology import (
+    seedfill_binary,
+    pack_binary,
+    unpack_binary,
+    reduce_rank_binary2,
+    expand_replicate_binary,
+)
+
+from .base import TestCase, main
+
+
+def seedfill_binary_loop(mask, seed):
+    """the original per-component seedfill of tiseg"""
+    fill = np.array(seed)
+    labels, _ = ndimage.label(mask, np.ones((3, 3)))
+    for label in np.unique(labels * seed):
+        if label:
+            fill[labels == label] = 1
+    return fill
+
+def reduce_rank_binary2_unpacked(image, level):
+    """rank reduction by counting the pixels in each 2x2 block"""
+    rows, cols = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    blocks = np.asarray(image[:rows, :cols] != 0, int)
+    counts = blocks[0::2, 0::2] + blocks[0::2, 1::2] + blocks[1::2, 0::2] + blocks[1::2, 1::2]
+    return counts >= level
+
+class MorphologyTest(TestCase):
+
+    def test_seedfill_binary(self):
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            shape = rng.integers(1, 60, 2)
+            mask = rng.random(shape) < rng.random()
+            seed = np.array(rng.random(shape) < rng.random() / 10, float)
+            fill = seedfill_binary(mask, seed)
+            self.assertEqual(fill.dtype, bool)
+            self.assertTrue(np.array_equal(fill, seedfill_binary_loop(mask, seed) != 0))
+
+    def test_seedfill_binary_connectivity(self):
+        mask = np.eye(3, dtype=bool)
+        seed = np.zeros((3, 3))
+        seed[0, 0] = 1
+        self.assertTrue(np.array_equal(seedfill_binary(mask, seed), mask))
+        self.assertTrue(np.array_equal(seedfill_binary(mask, seed, connectivity=4), seed))
+        with self.assertRaises(ValueError):
+            seedfill_binary(mask, seed, connectivity=6)
+
+    def test_reduce_rank_binary2(self):
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            image = rng.random(rng.integers(1, 60, 2)) < rng.random()
+            packed = pack_binary(image)
+            self.assertTrue(np.array_equal(unpack_binary(packed, image.shape[1]), image))
+            for level in range(1, 5):
+                reduced = unpack_binary(reduce_rank_binary2(packed, level), image.shape[1] // 2)
+                self.assertTrue(np.array_equal(reduced, reduce_rank_binary2_unpacked(image, level)))
+        with self.assertRaises(ValueError):
+            reduce_rank_binary2(packed, 0)
+
+    def test_expand_replicate_binary(self):
+        rng = np.random.default_rng(0)
+        for _ in range(100):
+            image = rng.random(rng.integers(1, 30, 2)) < rng.random()
+            # as many rows/columns as there are pixels, plus some padding
+            shape = 4 * np.array(image.shape) + rng.integers(-3, 4, 2)
+            expected = np.zeros(shape, bool)
+            expanded = np.repeat(np.repeat(image, 4, axis=0), 4, axis=1)[:shape[0], :shape[1]]
+            expected[:expanded.shape[0], :expanded.shape[1]] = expanded
+            # garbage in the padding bits must not show up in the result
+            packed = pack_binary(image)
+            packed[:, -1] |= np.uint8(0xff >> image.shape[1] % 8) if image.shape[1] % 8 else 0
+            expanded = expand_replicate_binary(packed, image.shape[1], shape)
+            self.assertTrue(np.array_equal(unpack_binary(expanded, shape[1]), expected))
+            self.assertFalse(np.any(unpack_binary(expanded, 8 * expanded.shape[1])[:, shape[1]:]))
+
+if __name__ == "__main__":
+    main(__file__)
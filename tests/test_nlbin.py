@@ -0,0 +1,35 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import numpy as np
+from scipy import stats
+
+from ocrd_anybaseocr.nlbin import histogram_percentiles, estimate_thresholds
+
+from .base import TestCase, main
+
+
+class NlbinTest(TestCase):
+
+    def test_histogram_percentiles(self):
+        rng = np.random.default_rng(0)
+        values = rng.beta(2, 5, (600, 400))
+        mask = rng.random(values.shape) < 0.6
+        for bins in [256, 1024]:
+            estimates = histogram_percentiles(values, [5, 90], bins=bins,
+                                              value_range=(0, 1), mask=mask)
+            for perc, estimate in zip([5, 90], estimates):
+                exact = stats.scoreatpercentile(values[mask], perc)
+                self.assertLessEqual(abs(estimate - exact), 1.0 / bins)
+
+    def test_estimate_thresholds(self):
+        rng = np.random.default_rng(0)
+        flat = np.clip(rng.normal(0.9, 0.02, (800, 600)), 0, 1)
+        for y in range(200, 600, 20):
+            flat[y:y+8, 100:500] = 0.1
+        exact = estimate_thresholds(flat)
+        for bins, decimate in [(1024, 1), (0, 2), (1024, 4)]:
+            lo, hi = estimate_thresholds(flat, bins=bins, decimate=decimate)
+            self.assertAlmostEqual(lo, exact[0], places=2)
+            self.assertAlmostEqual(hi, exact[1], places=2)
+
+if __name__ == "__main__":
+    main(__file__)
@@ -0,0 +1,58 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import threading
+import time
+
+from ocrd_anybaseocr.pipeline import run_pipeline
+
+from .base import TestCase, main
+
+
+class PipelineTest(TestCase):
+
+    def test_order(self):
+        threads = set()
+        written = []
+        def load(n):
+            threads.add(('load', threading.current_thread().name))
+            time.sleep(0.001 * (n % 3))
+            return n
+        def predict(batch):
+            threads.add(('predict', threading.current_thread().name))
+            self.assertLessEqual(len(batch), 3)
+            return [n * 10 for n in batch]
+        def write(n):
+            threads.add(('write', threading.current_thread().name))
+            written.append(n)
+        timings = run_pipeline([(n,) for n in range(10)], load, predict, write,
+                               depth=2, batch_size=3)
+        self.assertEqual(written, [n * 10 for n in range(10)])
+        self.assertEqual(len(threads), 3)
+        self.assertIn(('predict', threading.current_thread().name), threads)
+        self.assertEqual(set(timings), {'load', 'predict', 'write', 'idle', 'total'})
+
+    def test_overlap(self):
+        def load(n):
+            time.sleep(0.05)
+            return n
+        def predict(batch):
+            time.sleep(0.05)
+            return batch
+        def write(n):
+            time.sleep(0.05)
+        timings = run_pipeline([(n,) for n in range(10)], load, predict, write)
+        # sequentially, this would take 1.5s
+        self.assertLess(timings['total'], 1.0)
+        self.assertGreater(timings['load'], 0.4)
+        self.assertGreater(timings['write'], 0.4)
+
+    def test_errors(self):
+        def fail(n):
+            raise ValueError(n)
+        def keep(n):
+            return n
+        for stages in [(fail, list, keep), (keep, fail, keep), (keep, list, fail)]:
+            with self.assertRaises(ValueError):
+                run_pipeline([(n,) for n in range(10)], *stages, depth=1)
+
+if __name__ == "__main__":
+    main(__file__)
@@ -0,0 +1,76 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import numpy as np
+from PIL import Image, ImageFile
+
+from ocrd import Resolver, Workspace
+from ocrd.processor.base import run_processor
+from ocrd_models.ocrd_page import PageType, PcGtsType
+from ocrd_utils import MIMETYPE_PAGE, initLogging, pushd_popd
+
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_preprocess import (
+    ImageCachingWorkspace, OcrdAnybaseocrPreprocessor)
+
+from .base import TestCase, assets, main, copy_of_directory
+
+
+class AnyocrPreprocessorTest(TestCase):
+
+    def setUp(self):
+        self.resolver = Resolver()
+        initLogging()
+
+    def test_preprocess(self):
+        with copy_of_directory(assets.path_to('dfki-testdata/data')) as wsdir:
+            ws = Workspace(self.resolver, wsdir)
+            pagexml_before = len(list(ws.mets.find_files(mimetype=MIMETYPE_PAGE)))
+            run_processor(
+                OcrdAnybaseocrPreprocessor,
+                resolver=self.resolver,
+                mets_url=str(Path(wsdir, 'mets.xml')),
+                input_file_grp='MAX',
+                output_file_grp='BIN-TEST,DESKEW-TEST,CROP-TEST',
+                parameter={},
+            )
+            ws.reload_mets()
+            pagexml_after = len(list(ws.mets.find_files(mimetype=MIMETYPE_PAGE)))
+            self.assertEqual(pagexml_after, pagexml_before + 3)
+            page = ws.mets.find_all_files(fileGrp='CROP-TEST', mimetype=MIMETYPE_PAGE)[0]
+            self.assertIn('cropped', Path(wsdir, page.local_filename).read_text())
+
+    def test_image_cache(self):
+        with TemporaryDirectory() as wsdir, pushd_popd(wsdir):
+            ws = self.resolver.workspace_from_nothing(directory=wsdir)
+            image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (60, 40), np.uint8))
+            image.save(Path(wsdir, 'page.png'))
+            ws.add_file('IMG', ID='IMG_1', pageId='PHYS_1', mimetype='image/png',
+                        local_filename='page.png')
+            page = PcGtsType(Page=PageType(imageFilename='page.png',
+                                           imageWidth=40, imageHeight=60)).get_Page()
+            workspace = ImageCachingWorkspace(ws)
+            # count decoding (not just opening, which EXIF resolution does as well)
+            decoded = []
+            load = ImageFile.ImageFile.load
+            def decode(image):
+                if image.tile:
+                    decoded.append(image.filename)
+                return load(image)
+            with mock.patch.object(ImageFile.ImageFile, 'load', autospec=True, side_effect=decode):
+                first, _, _ = workspace.image_from_page(page, 'PHYS_1')
+                second, _, _ = workspace.image_from_page(page, 'PHYS_1')
+            self.assertEqual(decoded, ['page.png'])
+            self.assertEqual(np.array(first).tolist(), np.array(image).tolist())
+            self.assertEqual(np.array(second).tolist(), np.array(image).tolist())
+            # saved images are not decoded again either
+            derived = image.point(lambda x: 255 - x)
+            file_path = workspace.save_image_file(derived, 'IMG-INV_1', 'IMG-INV', page_id='PHYS_1')
+            with mock.patch.object(ImageFile.ImageFile, 'load', autospec=True, side_effect=decode):
+                loaded = workspace._resolve_image_as_pil(file_path)
+            self.assertEqual(decoded, ['page.png'])
+            self.assertEqual(np.array(loaded).tolist(), np.array(derived).tolist())
+
+if __name__ == "__main__":
+    main(__file__)
@@ -0,0 +1,94 @@
+# pylint: disable=import-error, unused-import, missing-docstring, protected-access
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from ocrd_anybaseocr import server
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation import InferenceConfig
+
+from .base import TestCase, main
+
+# some cheap "model" of this package
+LOADER = 'ocrd_anybaseocr.cli.ocrd_anybaseocr_block_segmentation:InferenceConfig'
+
+class ServerTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'server.sock')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+        super().tearDown()
+
+    def test_fallback(self):
+        with mock.patch.dict(os.environ, {'OCRD_ANYBASEOCR_SERVER': self.path}):
+            model = server.load_model(LOADER, confidence=0.5, batch_size=2)
+        self.assertIsInstance(model, InferenceConfig)
+        self.assertEqual(model.BATCH_SIZE, 2)
+
+    def test_socket_path(self):
+        with mock.patch.dict(os.environ, {'XDG_RUNTIME_DIR': self.tempdir.name}):
+            os.environ.pop('OCRD_ANYBASEOCR_SERVER', None)
+            self.assertEqual(server.socket_path(), os.path.join(self.tempdir.name, 'ocrd-anybaseocr.sock'))
+            os.environ['XDG_RUNTIME_DIR'] = ''
+            self.assertEqual(os.path.dirname(server.socket_path()),
+                             os.path.join(tempfile.gettempdir(), 'ocrd-anybaseocr-%d' % os.getuid()))
+
+    def test_public_directory(self):
+        os.chmod(self.tempdir.name, 0o777)
+        with self.assertRaises(PermissionError):
+            server._Server().run(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_remote(self):
+        instance = server._Server()
+        thread = threading.Thread(target=instance.run, args=(self.path,), daemon=True)
+        thread.start()
+        for _ in range(100):
+            if os.path.exists(self.path):
+                break
+            time.sleep(0.01)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(self.path + '.key').st_mode & 0o777, 0o600)
+        with mock.patch.dict(os.environ, {'OCRD_ANYBASEOCR_SERVER': self.path}):
+            model = server.load_model(LOADER, confidence=0.5, batch_size=2)
+            same = server.load_model(LOADER, batch_size=2, confidence=0.5)
+            other = server.load_model(LOADER, confidence=0.5, batch_size=4)
+        self.assertIsInstance(model, server.RemoteModel)
+        self.assertEqual(model._handle, same._handle)
+        self.assertNotEqual(model._handle, other._handle)
+        self.assertEqual(len(instance.models), 2)
+        self.assertEqual(instance.models[other._handle].BATCH_SIZE, 4)
+        self.assertIsNone(model.display())
+        # errors get re-raised in the client
+        with self.assertRaises(AttributeError):
+            model.detect([])
+        with self.assertRaises(ValueError):
+            server.RemoteModel(model._connection, None, 'os:system')._request('load', 'os:system', {})
+        # another server on the same socket is refused
+        with self.assertRaises(RuntimeError):
+            server._Server().run(self.path)
+        # clients without the key load in-process (and the server keeps running)
+        with open(self.path + '.key', 'rb') as key_file:
+            authkey = key_file.read()
+        with open(self.path + '.key', 'wb') as key_file:
+            key_file.write(b'wrong')
+        with mock.patch.dict(os.environ, {'OCRD_ANYBASEOCR_SERVER': self.path}):
+            self.assertIsInstance(server.load_model(LOADER, confidence=0.5, batch_size=2), InferenceConfig)
+            with open(self.path + '.key', 'wb') as key_file:
+                key_file.write(authkey)
+            self.assertIsInstance(server.load_model(LOADER, confidence=0.5, batch_size=2), server.RemoteModel)
+            # nor to sockets accessible by others
+            os.chmod(self.path, 0o666)
+            self.assertIsInstance(server.load_model(LOADER, confidence=0.5, batch_size=2), InferenceConfig)
+        instance.stop()
+        thread.join()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.key'))
+
+if __name__ == "__main__":
+    main(__file__)
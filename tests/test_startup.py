@@ -0,0 +1,23 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+import subprocess
+import sys
+
+from .base import TestCase, main
+
+MODULES = ['binarize', 'deskew', 'cropping', 'preprocess', 'dewarp', 'tiseg',
+           'textline', 'layout_analysis', 'block_segmentation', 'block_segmentation_export', 'server']
+HEAVY = ['tensorflow', 'torch', 'matplotlib', 'pix2pixhd']
+
+class StartupTest(TestCase):
+
+    def test_no_heavy_imports(self):
+        for name in MODULES:
+            module = 'ocrd_anybaseocr.cli.ocrd_anybaseocr_' + name
+            code = ('import sys, %s; print(" ".join(name for name in %r if name in sys.modules))'
+                    % (module, HEAVY))
+            result = subprocess.run([sys.executable, '-c', code],
+                                    capture_output=True, text=True, check=True)
+            self.assertEqual(result.stdout.split(), [], module)
+
+if __name__ == "__main__":
+    main(__file__)
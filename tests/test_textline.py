@@ -0,0 +1,91 @@
+# pylint: disable=import-error, unused-import, missing-docstring
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from ocrd import Resolver, Workspace
+from ocrd_modelfactory import page_from_file
+
+from ocrd_anybaseocr.cli import ocrd_anybaseocr_textline
+from ocrd_anybaseocr.cli.ocrd_anybaseocr_textline import (
+    OcrdAnybaseocrTextline, fill_gaps, mark_line_seeds)
+
+from .base import TestCase, assets, main, copy_of_directory
+
+
+def fill_gaps_loop(image, maxgap, axis=1):
+    """the original pixel-by-pixel gap filling of compute_colseps_conv"""
+    lines = image if axis == 1 else image.T
+    for r in range(0, len(lines)):
+        count = 0
+        for c in range(0, len(lines[0])):
+            if lines[r][c] == 1:
+                continue
+            count += 1
+            if c != len(lines[0])-1 and lines[r][c+1] == 1:
+                if count <= maxgap:
+                    for z in range(c-count, c+1):
+                        lines[r][z] = 1
+                count = 0
+    return image
+
+def mark_line_seeds_loop(bmarked, tmarked, delta, maxheight):
+    """the original column-by-column seed marking of compute_line_seeds"""
+    from ocrolib import psegutils
+    seeds = np.zeros(bmarked.shape, 'i')
+    for x in range(bmarked.shape[1]):
+        transitions = sorted([(y, 1) for y in psegutils.find(bmarked[:, x])] +
+                             [(y, 0) for y in psegutils.find(tmarked[:, x])])[::-1]
+        transitions += [(0, 0)]
+        for l in range(len(transitions)-1):
+            y0, s0 = transitions[l]
+            if s0 == 0:
+                continue
+            seeds[y0-delta:y0, x] = 1
+            y1, s1 = transitions[l+1]
+            if s1 == 0 and (y0-y1) < maxheight:
+                seeds[y1:y0, x] = 1
+    return seeds
+
+class AnyocrTextlineTest(TestCase):
+
+    def test_fill_gaps(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            image = np.array(rng.random(rng.integers(1, 40, 2)) < rng.random(), int)
+            maxgap = rng.integers(0, 10)
+            for axis in (0, 1):
+                self.assertTrue(np.array_equal(fill_gaps(image.copy(), maxgap, axis),
+                                               fill_gaps_loop(image.copy(), maxgap, axis)))
+
+    def test_mark_line_seeds(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            shape = rng.integers(1, 30, 2)
+            bmarked = rng.random(shape) < rng.random() / 2
+            tmarked = rng.random(shape) < rng.random() / 2
+            delta = int(rng.integers(0, 8))
+            maxheight = rng.random() * 15
+            self.assertTrue(np.array_equal(mark_line_seeds(bmarked, tmarked, delta, maxheight),
+                                           mark_line_seeds_loop(bmarked, tmarked, delta, maxheight)))
+
+    def test_compute_colseps_conv(self):
+        from ocrolib import psegutils
+        with copy_of_directory(assets.path_to('dfki-testdata/data')) as wsdir:
+            ws = Workspace(Resolver(), wsdir)
+            input_file = ws.mets.find_all_files(fileGrp='BIN', mimetype='application/vnd.prima.page+xml')[0]
+            page = page_from_file(ws.download_file(input_file)).get_Page()
+            page_image, _, _ = ws.image_from_page(page, input_file.pageId,
+                                                  feature_selector='binarized')
+        # keep the pixel-by-pixel reference fast enough
+        binary = np.array(page_image.convert('L'))[::2, ::2]
+        binary = np.array(1 - binary / np.amax(binary), 'B')
+        scale = psegutils.estimate_scale(binary)
+        processor = OcrdAnybaseocrTextline(None, parameter={})
+        seps = processor.compute_colseps_conv(binary, scale)
+        with mock.patch.object(ocrd_anybaseocr_textline, 'fill_gaps', fill_gaps_loop):
+            expected = processor.compute_colseps_conv(binary, scale)
+        self.assertTrue(np.array_equal(seps, expected))
+
+if __name__ == "__main__":
+    main(__file__)